@@ -0,0 +1,48 @@
+"""047_add_chat_record_blob
+
+Revision ID: 3f6c1a9d2b47
+Revises: 8855aea2dd61
+Create Date: 2025-10-09 10:12:33.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c1a9d2b47'
+down_revision = '8855aea2dd61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('chat_record_blob',
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('codec', sa.String(length=16), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('content', sa.LargeBinary(), nullable=False),
+    sa.Column('create_time', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('hash')
+    )
+
+
+def downgrade():
+    # 将外置的结果写回 chat_record 后再删除 blob 表
+    import zlib
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT hash, codec, size, content FROM chat_record_blob")).fetchall()
+    for row in rows:
+        if row.codec == 'zstd':
+            import zstandard
+            raw = zstandard.ZstdDecompressor().decompress(row.content)
+        elif row.codec == 'zlib':
+            raw = zlib.decompress(row.content)
+        else:
+            raw = row.content
+        ref = f'sqlbot-blob:{row.hash}:{row.size}'
+        value = raw.decode('utf-8')
+        for column in ('data', 'predict_data'):
+            conn.execute(sa.text(f"UPDATE chat_record SET {column} = :value WHERE {column} = :ref"),
+                         {"value": value, "ref": ref})
+    op.drop_table('chat_record_blob')
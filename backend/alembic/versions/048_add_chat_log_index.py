@@ -0,0 +1,27 @@
+"""048_add_chat_log_index
+
+Revision ID: 14bb91a0598f
+Revises: 3f6c1a9d2b47
+Create Date: 2025-10-13 15:26:08.512340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '14bb91a0598f'
+down_revision = '3f6c1a9d2b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_chat_log_pid_type_operate_start_time', 'chat_log', ['pid', 'type', 'operate', 'start_time'],
+                    unique=False)
+    op.create_index('ix_chat_record_chat_id', 'chat_record', ['chat_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_chat_record_chat_id', table_name='chat_record')
+    op.drop_index('ix_chat_log_pid_type_operate_start_time', table_name='chat_log')
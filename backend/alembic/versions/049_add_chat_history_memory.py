@@ -0,0 +1,25 @@
+"""049_add_chat_history_memory
+
+Revision ID: 1d43b4b5b080
+Revises: 14bb91a0598f
+Create Date: 2025-10-14 11:02:47.193056
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '1d43b4b5b080'
+down_revision = '14bb91a0598f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('chat', sa.Column('history_memory', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade():
+    op.drop_column('chat', 'history_memory')
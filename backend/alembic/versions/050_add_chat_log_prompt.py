@@ -0,0 +1,46 @@
+"""050_add_chat_log_prompt
+
+Revision ID: 5bcf8003fcc3
+Revises: 1d43b4b5b080
+Create Date: 2025-10-15 10:21:36.408217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5bcf8003fcc3'
+down_revision = '1d43b4b5b080'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'chat_log_prompt',
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('create_time', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('hash')
+    )
+
+
+def downgrade():
+    # 把 content_ref 还原为 content 后再删除表
+    op.execute("""
+        UPDATE chat_log l
+        SET messages = (
+            SELECT jsonb_agg(
+                CASE WHEN m ? 'content_ref'
+                     THEN (m - 'content_ref') || jsonb_build_object('content', COALESCE(p.content, ''))
+                     ELSE m END
+                ORDER BY ord)
+            FROM jsonb_array_elements(l.messages) WITH ORDINALITY AS e(m, ord)
+            LEFT JOIN chat_log_prompt p ON p.hash = e.m ->> 'content_ref'
+        )
+        WHERE jsonb_typeof(l.messages) = 'array'
+          AND EXISTS (SELECT 1 FROM jsonb_array_elements(l.messages) AS x(m) WHERE x.m ? 'content_ref')
+    """)
+    op.drop_table('chat_log_prompt')
@@ -16,6 +16,10 @@ from langchain_community.llms import VLLMOpenAI
 from langchain_openai import AzureChatOpenAI
 # from langchain_community.llms import Tongyi, VLLM
 
+# 模型参数中由 SQLBot 自身使用的配置项，不传给模型
+sqlbot_model_params = {'schema_token_budget'}
+
+
 class LLMConfig(BaseModel):
     """Base configuration class for large language models"""
     model_id: Optional[int] = None
@@ -43,6 +47,11 @@ class LLMConfig(BaseModel):
             hashable_params
         ))
 
+    @property
+    def model_params(self) -> Dict[str, Any]:
+        """传给模型的参数，去掉 SQLBot 自身使用的配置项"""
+        return {k: v for k, v in self.additional_params.items() if k not in sqlbot_model_params}
+
 
 class BaseLLM(ABC):
     """Abstract base class for large language models"""
@@ -68,17 +77,14 @@ class OpenAIvLLM(BaseLLM):
             openai_api_base=self.config.api_base_url,
             model_name=self.config.model_name,
             streaming=True,
-            **self.config.additional_params,
+            **self.config.model_params,
         )
 
 class OpenAIAzureLLM(BaseLLM):
     def _init_llm(self) -> AzureChatOpenAI:
-        api_version = self.config.additional_params.get("api_version")
-        deployment_name = self.config.additional_params.get("deployment_name")
-        if api_version:
-            self.config.additional_params.pop("api_version")
-        if deployment_name:
-            self.config.additional_params.pop("deployment_name")
+        model_params = self.config.model_params
+        api_version = model_params.pop("api_version", None)
+        deployment_name = model_params.pop("deployment_name", None)
         return AzureChatOpenAI(
             azure_endpoint=self.config.api_base_url,
             api_key=self.config.api_key or 'Empty',
@@ -86,7 +92,7 @@ class OpenAIAzureLLM(BaseLLM):
             api_version=api_version,
             deployment_name=deployment_name,
             streaming=True,
-            **self.config.additional_params,
+            **model_params,
         )
 class OpenAILLM(BaseLLM):
     def _init_llm(self) -> BaseChatModel:
@@ -95,7 +101,7 @@ class OpenAILLM(BaseLLM):
             api_key=self.config.api_key or 'Empty',
             base_url=self.config.api_base_url,
             stream_usage=True,
-            **self.config.additional_params,
+            **self.config.model_params,
         )
 
     def generate(self, prompt: str) -> str:
@@ -5,7 +5,7 @@ from apps.dashboard.api import dashboard_api
 from apps.data_training.api import data_training
 from apps.datasource.api import datasource, table_relation
 from apps.mcp import mcp
-from apps.system.api import login, user, aimodel, workspace, assistant
+from apps.system.api import login, user, aimodel, workspace, assistant, monitor
 from apps.scheduler.api import router as scheduler_router
 from apps.terminology.api import terminology
 
@@ -15,6 +15,7 @@ api_router.include_router(user.router)
 api_router.include_router(workspace.router)
 api_router.include_router(assistant.router)
 api_router.include_router(aimodel.router)
+api_router.include_router(monitor.router)
 api_router.include_router(terminology.router)
 api_router.include_router(data_training.router)
 api_router.include_router(datasource.router)
@@ -16,6 +16,7 @@ from apps.chat.curd.chat import list_chats, get_chat_with_records, create_chat,
 from apps.chat.models.chat_model import CreateChat, ChatRecord, RenameChat, ChatQuestion, ExcelData
 from apps.chat.task.llm import LLMService
 from common.core.deps import CurrentAssistant, SessionDep, CurrentUser, Trans
+from common.error import ChatTaskRejectedError
 
 router = APIRouter(tags=["Data Q&A"], prefix="/chat")
 
@@ -45,9 +46,11 @@ async def get_chat_with_data(session: SessionDep, current_user: CurrentUser, cha
 
 
 @router.get("/record/get/{chart_record_id}/data")
-async def chat_record_data(session: SessionDep, chart_record_id: int):
+async def chat_record_data(session: SessionDep, chart_record_id: int, columnar: bool = False):
+    """columnar=true 时返回列式结构 {fields, rows}，否则返回 {fields, data: [行字典]}"""
+
     def inner():
-        return get_chat_chart_data(chart_record_id=chart_record_id, session=session)
+        return get_chat_chart_data(chart_record_id=chart_record_id, session=session, columnar=columnar)
 
     return await asyncio.to_thread(inner)
 
@@ -110,6 +113,7 @@ async def recommend_questions(session: SessionDep, current_user: CurrentUser, ch
     def _return_empty():
         yield 'data:' + orjson.dumps({'content': '[]', 'type': 'recommended_question'}).decode() + '\n\n'
 
+    llm_service: Optional[LLMService] = None
     try:
         record = get_chat_record_by_id(session, chat_record_id)
 
@@ -121,8 +125,12 @@ async def recommend_questions(session: SessionDep, current_user: CurrentUser, ch
         llm_service = await LLMService.create(current_user, request_question, current_assistant, True)
         llm_service.set_record(record)
         llm_service.run_recommend_questions_task_async()
+    except ChatTaskRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
     except Exception as e:
         traceback.print_exc()
+        if llm_service:
+            llm_service.close()
 
         def _err(_e: Exception):
             yield 'data:' + orjson.dumps({'content': str(_e), 'type': 'error'}).decode() + '\n\n'
@@ -146,12 +154,17 @@ async def stream_sql(session: SessionDep, current_user: CurrentUser, request_que
         Streaming response with analysis results
     """
 
+    llm_service: Optional[LLMService] = None
     try:
         llm_service = await LLMService.create(current_user, request_question, current_assistant, embedding=True)
         llm_service.init_record()
         llm_service.run_task_async()
+    except ChatTaskRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
     except Exception as e:
         traceback.print_exc()
+        if llm_service:
+            llm_service.close()
 
         def _err(_e: Exception):
             yield 'data:' + orjson.dumps({'content': str(_e), 'type': 'error'}).decode() + '\n\n'
@@ -174,6 +187,7 @@ async def execute_sql(session: SessionDep, current_user: CurrentUser, request: d
     Returns:
         Streaming response with execution results
     """
+    llm_service: Optional[LLMService] = None
     try:
         # Create ChatQuestion object with provided SQL
         user_sql = request.get('sql')
@@ -189,8 +203,12 @@ async def execute_sql(session: SessionDep, current_user: CurrentUser, request: d
         # Run task with direct SQL execution mode
         llm_service.execute_direct_sql_async()
 
+    except ChatTaskRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
     except Exception as e:
         traceback.print_exc()
+        if llm_service:
+            llm_service.close()
 
         def _err(_e: Exception):
             yield 'data:' + orjson.dumps({'content': str(_e), 'type': 'error'}).decode() + '\n\n'
@@ -208,6 +226,7 @@ class AnalysisOrPredictRequest(BaseModel):
 @router.post("/record/{chat_record_id}/{action_type}")
 async def analysis_or_predict(session: SessionDep, current_user: CurrentUser, chat_record_id: int, action_type: str,
                               current_assistant: CurrentAssistant, request_body: AnalysisOrPredictRequest = None):
+    llm_service: Optional[LLMService] = None
     try:
         if action_type != 'analysis' and action_type != 'predict':
             raise Exception(f"Type {action_type} Not Found")
@@ -243,8 +262,12 @@ async def analysis_or_predict(session: SessionDep, current_user: CurrentUser, ch
 
         llm_service = await LLMService.create(current_user, request_question, current_assistant)
         llm_service.run_analysis_or_predict_task_async(action_type, record)
+    except ChatTaskRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
     except Exception as e:
         traceback.print_exc()
+        if llm_service:
+            llm_service.close()
 
         def _err(_e: Exception):
             yield 'data:' + orjson.dumps({'content': str(_e), 'type': 'error'}).decode() + '\n\n'
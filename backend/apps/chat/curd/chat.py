@@ -1,11 +1,14 @@
 import datetime
-from typing import List
+from typing import List, Optional
 
 import orjson
 import sqlparse
 from sqlalchemy import and_, select, update
 from sqlalchemy.orm import aliased
 
+from apps.chat.curd import record_blob
+from apps.chat.curd.log_prompt import pack_messages, unpack_messages
+from apps.chat.curd.record_buffer import ChatRecordBuffer
 from apps.chat.models.chat_model import Chat, ChatRecord, CreateChat, ChatInfo, RenameChat, ChatQuestion, ChatLog, \
     TypeEnum, OperationEnum, ChatRecordResult
 from apps.datasource.models.datasource import CoreDatasource
@@ -34,12 +37,17 @@ def list_chats(session: SessionDep, current_user: CurrentUser) -> List[Chat]:
     return chart_list
 
 
+def get_chat_brief(question: str) -> str:
+    """对话标题：问题去掉首尾空白后的前 20 个字符"""
+    return question.strip()[:20]
+
+
 def rename_chat(session: SessionDep, rename_object: RenameChat) -> str:
     chat = session.get(Chat, rename_object.id)
     if not chat:
         raise Exception(f"Chat with id {rename_object.id} not found")
 
-    chat.brief = rename_object.brief.strip()[:20]
+    chat.brief = get_chat_brief(rename_object.brief)
     session.add(chat)
     session.flush()
     session.refresh(chat)
@@ -86,12 +94,47 @@ def get_last_execute_sql_error(session: SessionDep, chart_id: int):
     return None
 
 
-def get_chat_chart_data(session: SessionDep, chart_record_id: int):
+def encode_chart_data(data_obj: dict) -> str:
+    """
+    以列式结构保存查询结果：{"fields": [...], "rows": [[...], ...]}，避免每行重复字段名
+    """
+    obj = {k: v for k, v in data_obj.items() if k != 'data'}
+    fields = obj.get('fields') or []
+    data = data_obj.get('data') or []
+    if not fields and data:
+        fields = list(data[0].keys())
+        obj['fields'] = fields
+    obj['rows'] = [[row.get(field) for field in fields] for row in data]
+    return orjson.dumps(obj).decode()
+
+
+def decode_chart_data(obj, columnar: bool = False):
+    """
+    兼容旧记录（data 为行字典列表）与列式结构，columnar 为 False 时统一还原为行字典列表
+    """
+    if not isinstance(obj, dict):
+        return obj
+    if columnar:
+        if 'rows' not in obj and isinstance(obj.get('data'), list):
+            obj = {**obj}
+            data = obj.pop('data')
+            fields = obj.get('fields') or (list(data[0].keys()) if data else [])
+            obj['fields'] = fields
+            obj['rows'] = [[row.get(field) for field in fields] for row in data]
+        return obj
+    if 'rows' in obj:
+        obj = {**obj}
+        fields = obj.get('fields') or []
+        obj['data'] = [dict(zip(fields, row)) for row in obj.pop('rows') or []]
+    return obj
+
+
+def get_chat_chart_data(session: SessionDep, chart_record_id: int, columnar: bool = False):
     stmt = select(ChatRecord.data).where(and_(ChatRecord.id == chart_record_id))
     res = session.execute(stmt)
     for row in res:
         try:
-            return orjson.loads(row.data)
+            return decode_chart_data(orjson.loads(record_blob.resolve(session, row.data)), columnar)
         except Exception:
             pass
     return []
@@ -102,7 +145,7 @@ def get_chat_predict_data(session: SessionDep, chart_record_id: int):
     res = session.execute(stmt)
     for row in res:
         try:
-            return orjson.loads(row.predict_data)
+            return orjson.loads(record_blob.resolve(session, row.predict_data))
         except Exception:
             pass
     return []
@@ -179,6 +222,8 @@ def get_chat_with_records(session: SessionDep, chart_id: int, current_user: Curr
             ChatRecord.create_time)
 
     result = session.execute(stmt).all()
+    blobs = record_blob.resolve_many(session, [v for row in result for v in (row.data, row.predict_data)]) \
+        if with_data else {}
     record_list: list[ChatRecordResult] = []
     for row in result:
         if not with_data:
@@ -207,7 +252,8 @@ def get_chat_with_records(session: SessionDep, chart_id: int, current_user: Curr
                                  datasource_select_answer=row.datasource_select_answer,
                                  analysis_record_id=row.analysis_record_id, predict_record_id=row.predict_record_id,
                                  recommended_question=row.recommended_question, first_chat=row.first_chat,
-                                 finish=row.finish, error=row.error, data=row.data, predict_data=row.predict_data))
+                                 finish=row.finish, error=row.error, data=blobs.get(row.data, row.data),
+                                 predict_data=blobs.get(row.predict_data, row.predict_data)))
 
     result = list(map(format_record, record_list))
 
@@ -248,7 +294,7 @@ def format_record(record: ChatRecordResult):
     if record.data and record.data.strip() != '':
         try:
             _obj = orjson.loads(record.data)
-            _dict['data'] = _obj
+            _dict['data'] = decode_chart_data(_obj)
         except Exception:
             pass
     if record.predict_data and record.predict_data.strip() != '':
@@ -266,30 +312,36 @@ def format_record(record: ChatRecordResult):
     return _dict
 
 
-def list_generate_sql_logs(session: SessionDep, chart_id: int) -> List[ChatLog]:
+def list_generate_logs(session: SessionDep, chart_id: int, operate: OperationEnum, limit: int = 0) -> List[ChatLog]:
+    """
+    按开始时间升序返回对话中指定操作的日志
+
+    :param limit: 大于 0 时只查询最近的 limit 条（chat_log 上有 (pid, type, operate, start_time) 索引）
+    """
     stmt = select(ChatLog).where(
         and_(ChatLog.pid.in_(select(ChatRecord.id).where(and_(ChatRecord.chat_id == chart_id))),
-             ChatLog.type == TypeEnum.CHAT, ChatLog.operate == OperationEnum.GENERATE_SQL)).order_by(
-        ChatLog.start_time)
+             ChatLog.type == TypeEnum.CHAT, ChatLog.operate == operate))
+    if limit > 0:
+        stmt = stmt.order_by(ChatLog.start_time.desc()).limit(limit)
+    else:
+        stmt = stmt.order_by(ChatLog.start_time)
     result = session.execute(stmt).all()
     _list = []
     for row in result:
         for r in row:
             _list.append(ChatLog(**r.model_dump()))
+    if limit > 0:
+        _list.reverse()
+    unpack_messages(session, _list)
     return _list
 
 
-def list_generate_chart_logs(session: SessionDep, chart_id: int) -> List[ChatLog]:
-    stmt = select(ChatLog).where(
-        and_(ChatLog.pid.in_(select(ChatRecord.id).where(and_(ChatRecord.chat_id == chart_id))),
-             ChatLog.type == TypeEnum.CHAT, ChatLog.operate == OperationEnum.GENERATE_CHART)).order_by(
-        ChatLog.start_time)
-    result = session.execute(stmt).all()
-    _list = []
-    for row in result:
-        for r in row:
-            _list.append(ChatLog(**r.model_dump()))
-    return _list
+def list_generate_sql_logs(session: SessionDep, chart_id: int, limit: int = 0) -> List[ChatLog]:
+    return list_generate_logs(session, chart_id, OperationEnum.GENERATE_SQL, limit)
+
+
+def list_generate_chart_logs(session: SessionDep, chart_id: int, limit: int = 0) -> List[ChatLog]:
+    return list_generate_logs(session, chart_id, OperationEnum.GENERATE_CHART, limit)
 
 
 def create_chat(session: SessionDep, current_user: CurrentUser, create_chat_obj: CreateChat,
@@ -303,7 +355,7 @@ def create_chat(session: SessionDep, current_user: CurrentUser, create_chat_obj:
     chat = Chat(create_time=datetime.datetime.now(),
                 create_by=current_user.id,
                 oid=current_user.oid if current_user.oid is not None else 1,
-                brief=create_chat_obj.question.strip()[:20],
+                brief=get_chat_brief(create_chat_obj.question),
                 origin=create_chat_obj.origin if create_chat_obj.origin is not None else 0)
     ds: CoreDatasource | None = None
     if create_chat_obj.datasource:
@@ -415,11 +467,15 @@ def save_analysis_predict_record(session: SessionDep, base_record: ChatRecord, a
 
 def start_log(session: SessionDep, ai_modal_id: int, ai_modal_name: str, operate: OperationEnum, record_id: int,
               full_message: list[dict]) -> ChatLog:
+    messages, prompt_stmt = pack_messages(full_message)
     log = ChatLog(type=TypeEnum.CHAT, operate=operate, pid=record_id, ai_modal_id=ai_modal_id, base_modal=ai_modal_name,
-                  messages=full_message, start_time=datetime.datetime.now())
+                  messages=messages, start_time=datetime.datetime.now())
 
     result = ChatLog(**log.model_dump())
+    result.messages = full_message
 
+    if prompt_stmt is not None:
+        session.execute(prompt_stmt)
     session.add(log)
     session.flush()
     session.refresh(log)
@@ -430,7 +486,7 @@ def start_log(session: SessionDep, ai_modal_id: int, ai_modal_name: str, operate
 
 
 def end_log(session: SessionDep, log: ChatLog, full_message: list[dict], reasoning_content: str = None,
-            token_usage=None) -> ChatLog:
+            token_usage=None, buffer: Optional[ChatRecordBuffer] = None) -> ChatLog:
     if token_usage is None:
         token_usage = {}
     log.messages = full_message
@@ -438,21 +494,32 @@ def end_log(session: SessionDep, log: ChatLog, full_message: list[dict], reasoni
     log.finish_time = datetime.datetime.now()
     log.reasoning_content = reasoning_content if reasoning_content and len(reasoning_content.strip()) > 0 else None
 
+    messages, prompt_stmt = pack_messages(log.messages)
     stmt = update(ChatLog).where(and_(ChatLog.id == log.id)).values(
-        messages=log.messages,
+        messages=messages,
         token_usage=log.token_usage,
         finish_time=log.finish_time,
         reasoning_content=log.reasoning_content
     )
+    if buffer is not None:
+        if prompt_stmt is not None:
+            buffer.add(prompt_stmt)
+        buffer.add(stmt)
+        return log
+    if prompt_stmt is not None:
+        session.execute(prompt_stmt)
     session.execute(stmt)
     session.commit()
 
     return log
 
 
-def save_sql_answer(session: SessionDep, record_id: int, answer: str) -> ChatRecord:
+def save_sql_answer(session: SessionDep, record_id: int, answer: str,
+                    buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(sql_answer=answer)
 
     stmt = update(ChatRecord).where(and_(ChatRecord.id == record_id)).values(
         sql_answer=answer,
@@ -467,9 +534,12 @@ def save_sql_answer(session: SessionDep, record_id: int, answer: str) -> ChatRec
     return record
 
 
-def save_analysis_answer(session: SessionDep, record_id: int, answer: str = '') -> ChatRecord:
+def save_analysis_answer(session: SessionDep, record_id: int, answer: str = '',
+                         buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(analysis=answer)
 
     stmt = update(ChatRecord).where(and_(ChatRecord.id == record_id)).values(
         analysis=answer,
@@ -484,9 +554,12 @@ def save_analysis_answer(session: SessionDep, record_id: int, answer: str = '')
     return record
 
 
-def save_predict_answer(session: SessionDep, record_id: int, answer: str) -> ChatRecord:
+def save_predict_answer(session: SessionDep, record_id: int, answer: str,
+                        buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(predict=answer)
 
     stmt = update(ChatRecord).where(and_(ChatRecord.id == record_id)).values(
         predict=answer,
@@ -502,9 +575,14 @@ def save_predict_answer(session: SessionDep, record_id: int, answer: str) -> Cha
 
 
 def save_select_datasource_answer(session: SessionDep, record_id: int, answer: str,
-                                  datasource: int = None, engine_type: str = None) -> ChatRecord:
+                                  datasource: int = None, engine_type: str = None,
+                                  buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        if datasource:
+            return buffer.set(datasource_select_answer=answer, datasource=datasource, engine_type=engine_type)
+        return buffer.set(datasource_select_answer=answer)
     record = get_chat_record_by_id(session, record_id)
 
     record.datasource_select_answer = answer
@@ -534,7 +612,7 @@ def save_select_datasource_answer(session: SessionDep, record_id: int, answer: s
 
 
 def save_recommend_question_answer(session: SessionDep, record_id: int,
-                                   answer: dict = None) -> ChatRecord:
+                                   answer: dict = None, buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
 
@@ -551,6 +629,10 @@ def save_recommend_question_answer(session: SessionDep, record_id: int,
             pass
     recommended_question = json_str
 
+    if buffer is not None:
+        return buffer.set(recommended_question_answer=recommended_question_answer,
+                          recommended_question=recommended_question)
+
     stmt = update(ChatRecord).where(and_(ChatRecord.id == record_id)).values(
         recommended_question_answer=recommended_question_answer,
         recommended_question=recommended_question,
@@ -567,9 +649,11 @@ def save_recommend_question_answer(session: SessionDep, record_id: int,
     return record
 
 
-def save_sql(session: SessionDep, record_id: int, sql: str) -> ChatRecord:
+def save_sql(session: SessionDep, record_id: int, sql: str, buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(sql=sql)
 
     record = get_chat_record_by_id(session, record_id)
 
@@ -588,9 +672,12 @@ def save_sql(session: SessionDep, record_id: int, sql: str) -> ChatRecord:
     return result
 
 
-def save_chart_answer(session: SessionDep, record_id: int, answer: str) -> ChatRecord:
+def save_chart_answer(session: SessionDep, record_id: int, answer: str,
+                      buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(chart_answer=answer)
 
     stmt = update(ChatRecord).where(and_(ChatRecord.id == record_id)).values(
         chart_answer=answer,
@@ -605,9 +692,12 @@ def save_chart_answer(session: SessionDep, record_id: int, answer: str) -> ChatR
     return record
 
 
-def save_chart(session: SessionDep, record_id: int, chart: str) -> ChatRecord:
+def save_chart(session: SessionDep, record_id: int, chart: str,
+               buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(chart=chart)
     record = get_chat_record_by_id(session, record_id)
 
     record.chart = chart
@@ -625,9 +715,12 @@ def save_chart(session: SessionDep, record_id: int, chart: str) -> ChatRecord:
     return result
 
 
-def save_predict_data(session: SessionDep, record_id: int, data: str = '') -> ChatRecord:
+def save_predict_data(session: SessionDep, record_id: int, data: str = '',
+                      buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(predict_data=record_blob.offload(session, data))
     record = get_chat_record_by_id(session, record_id)
 
     record.predict_data = data
@@ -635,7 +728,7 @@ def save_predict_data(session: SessionDep, record_id: int, data: str = '') -> Ch
     result = ChatRecord(**record.model_dump())
 
     stmt = update(ChatRecord).where(and_(ChatRecord.id == record.id)).values(
-        predict_data=record.predict_data
+        predict_data=record_blob.offload(session, record.predict_data)
     )
 
     session.execute(stmt)
@@ -645,9 +738,12 @@ def save_predict_data(session: SessionDep, record_id: int, data: str = '') -> Ch
     return result
 
 
-def save_error_message(session: SessionDep, record_id: int, message: str) -> ChatRecord:
+def save_error_message(session: SessionDep, record_id: int, message: str,
+                       buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(error=message, finish=True, finish_time=datetime.datetime.now())
     record = get_chat_record_by_id(session, record_id)
 
     record.error = message
@@ -669,9 +765,12 @@ def save_error_message(session: SessionDep, record_id: int, message: str) -> Cha
     return result
 
 
-def save_sql_exec_data(session: SessionDep, record_id: int, data: str) -> ChatRecord:
+def save_sql_exec_data(session: SessionDep, record_id: int, data: str,
+                       buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(data=record_blob.offload(session, data))
     record = get_chat_record_by_id(session, record_id)
 
     record.data = data
@@ -679,7 +778,7 @@ def save_sql_exec_data(session: SessionDep, record_id: int, data: str) -> ChatRe
     result = ChatRecord(**record.model_dump())
 
     stmt = update(ChatRecord).where(and_(ChatRecord.id == record.id)).values(
-        data=record.data,
+        data=record_blob.offload(session, record.data),
     )
 
     session.execute(stmt)
@@ -689,9 +788,11 @@ def save_sql_exec_data(session: SessionDep, record_id: int, data: str) -> ChatRe
     return result
 
 
-def finish_record(session: SessionDep, record_id: int) -> ChatRecord:
+def finish_record(session: SessionDep, record_id: int, buffer: Optional[ChatRecordBuffer] = None) -> ChatRecord:
     if not record_id:
         raise Exception("Record id cannot be None")
+    if buffer is not None:
+        return buffer.set(finish=True, finish_time=datetime.datetime.now())
     record = get_chat_record_by_id(session, record_id)
 
     record.finish = True
@@ -0,0 +1,94 @@
+"""
+对话日志提示词去重存储
+
+chat_log.messages 保存每次调用 LLM 的完整消息，其中系统提示词（M-Schema、术语、数据训练等）在同一数据源下几乎完全相同。
+长度超过 CHAT_LOG_PROMPT_THRESHOLD 个字符的消息内容按 sha256 存入 chat_log_prompt 表，
+messages 中对应的消息改为 {'type': ..., 'content_ref': <sha256>}；读取日志时由 unpack_messages 还原。
+不再被任何日志引用的内容由定时任务调用 collect_garbage 清理。
+"""
+
+import datetime
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import Executable
+
+from apps.chat.models.chat_model import ChatLog, ChatLogPrompt
+from common.core.config import settings
+from common.core.deps import SessionDep
+from common.utils.utils import SQLBotLogUtil
+
+CONTENT_REF = 'content_ref'
+
+
+def pack_messages(messages: Optional[List[Dict[str, Any]]]) -> Tuple[Optional[List[Dict[str, Any]]],
+                                                                    Optional[Executable]]:
+    """
+    :return: (替换为引用后的 messages, 写入提示词内容的语句)；没有需要外置的内容时语句为 None，由调用方执行并提交
+    """
+    threshold = settings.CHAT_LOG_PROMPT_THRESHOLD
+    if not messages or threshold <= 0:
+        return messages, None
+    packed = []
+    rows: Dict[str, dict] = {}
+    now = datetime.datetime.now()
+    for message in messages:
+        content = message.get('content') if isinstance(message, dict) else None
+        if not isinstance(content, str) or len(content) < threshold:
+            packed.append(message)
+            continue
+        _hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        rows.setdefault(_hash, {'hash': _hash, 'content': content, 'size': len(content), 'create_time': now})
+        packed.append({**{k: v for k, v in message.items() if k != 'content'}, CONTENT_REF: _hash})
+    if not rows:
+        return messages, None
+    # 已存在时刷新 create_time，避免清理任务在引用提交前把它当作无引用删除
+    stmt = insert(ChatLogPrompt).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(index_elements=['hash'], set_={'create_time': stmt.excluded.create_time})
+    return packed, stmt
+
+
+def unpack_messages(session: SessionDep, logs: Iterable[ChatLog]):
+    """批量还原日志 messages 中的 content_ref（原地修改），内容丢失的消息 content 为空字符串"""
+    logs = [log for log in logs if log.messages]
+    refs = {m.get(CONTENT_REF) for log in logs for m in log.messages if isinstance(m, dict) and m.get(CONTENT_REF)}
+    if not refs:
+        return
+    rows = session.execute(
+        select(ChatLogPrompt.hash, ChatLogPrompt.content).where(ChatLogPrompt.hash.in_(refs))).all()
+    contents = {row.hash: row.content for row in rows}
+    missing = refs - contents.keys()
+    if missing:
+        SQLBotLogUtil.warning(f"Chat log prompts not found: {', '.join(sorted(missing))}")
+    for log in logs:
+        log.messages = [_unpack(m, contents) for m in log.messages]
+
+
+def _unpack(message: Any, contents: Dict[str, str]) -> Any:
+    if not isinstance(message, dict) or not message.get(CONTENT_REF):
+        return message
+    result = {k: v for k, v in message.items() if k != CONTENT_REF}
+    result['content'] = contents.get(message.get(CONTENT_REF), '')
+    return result
+
+
+def collect_garbage(session: SessionDep, grace_hours: int = settings.CHAT_STORAGE_GC_GRACE_HOURS) -> int:
+    """
+    删除不再被 chat_log.messages 引用的提示词内容，只删除 create_time 早于 grace_hours 小时的，
+    避免删掉刚写入、引用尚未提交的内容
+
+    :return: 删除的行数
+    """
+    result = session.execute(text("""
+        DELETE FROM chat_log_prompt p
+        WHERE p.create_time < :cutoff
+          AND p.hash NOT IN (
+              SELECT e.m ->> 'content_ref'
+              FROM chat_log l CROSS JOIN LATERAL jsonb_array_elements(l.messages) AS e(m)
+              WHERE jsonb_typeof(l.messages) = 'array' AND e.m ? 'content_ref'
+          )
+    """), {'cutoff': datetime.datetime.now() - datetime.timedelta(hours=grace_hours)})
+    session.commit()
+    return result.rowcount
@@ -0,0 +1,108 @@
+"""
+对话记录大字段外置存储
+
+超过 CHAT_RECORD_BLOB_THRESHOLD 字节的查询结果压缩后存入 chat_record_blob 表（按内容 sha256 去重），
+chat_record 对应字段只保留引用：sqlbot-blob:<sha256>:<原始字节数>，读取时由渲染数据的接口按需还原。
+删除对话或记录后不再被引用的 blob 由定时任务调用 collect_garbage 清理。
+"""
+
+import datetime
+import hashlib
+import zlib
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from apps.chat.models.chat_model import ChatRecordBlob
+from common.core.config import settings
+from common.core.deps import SessionDep
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOB_PREFIX = 'sqlbot-blob:'
+
+
+def is_blob_ref(value: Optional[str]) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_PREFIX)
+
+
+def parse_blob_ref(value: str) -> tuple[str, int]:
+    _hash, size = value[len(BLOB_PREFIX):].split(':', 1)
+    return _hash, int(size)
+
+
+def _compress(raw: bytes) -> tuple[str, bytes]:
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=3).compress(raw)
+    return 'zlib', zlib.compress(raw, 6)
+
+
+def _decompress(codec: str, content: bytes) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise Exception('zstandard is required to read chat record blob')
+        return zstandard.ZstdDecompressor().decompress(content)
+    if codec == 'zlib':
+        return zlib.decompress(content)
+    return content
+
+
+def offload(session: SessionDep, value: Optional[str]) -> Optional[str]:
+    """超过阈值时写入 blob 表并返回引用，否则原样返回；由调用方提交事务"""
+    threshold = settings.CHAT_RECORD_BLOB_THRESHOLD
+    if not value or threshold <= 0 or is_blob_ref(value):
+        return value
+    raw = value.encode('utf-8')
+    if len(raw) <= threshold:
+        return value
+    _hash = hashlib.sha256(raw).hexdigest()
+    codec, content = _compress(raw)
+    now = datetime.datetime.now()
+    # 已存在时刷新 create_time，避免清理任务在引用提交前把它当作无引用删除
+    stmt = insert(ChatRecordBlob).values(hash=_hash, codec=codec, size=len(raw), content=content,
+                                         create_time=now).on_conflict_do_update(
+        index_elements=['hash'], set_={'create_time': now})
+    session.execute(stmt)
+    return f'{BLOB_PREFIX}{_hash}:{len(raw)}'
+
+
+def resolve(session: SessionDep, value: Optional[str]) -> Optional[str]:
+    if not is_blob_ref(value):
+        return value
+    return resolve_many(session, [value]).get(value)
+
+
+def resolve_many(session: SessionDep, values: Iterable[Optional[str]]) -> Dict[str, str]:
+    """批量还原引用，返回 {引用: 原始内容}；blob 丢失的引用不在结果中"""
+    refs = {v: parse_blob_ref(v)[0] for v in values if is_blob_ref(v)}
+    if not refs:
+        return {}
+    rows = session.execute(
+        select(ChatRecordBlob.hash, ChatRecordBlob.codec, ChatRecordBlob.content).where(
+            ChatRecordBlob.hash.in_(set(refs.values())))).all()
+    contents = {row.hash: _decompress(row.codec, row.content).decode('utf-8') for row in rows}
+    return {ref: contents[_hash] for ref, _hash in refs.items() if _hash in contents}
+
+
+def collect_garbage(session: SessionDep, grace_hours: int = settings.CHAT_STORAGE_GC_GRACE_HOURS) -> int:
+    """
+    删除不再被 chat_record.data / predict_data 引用的 blob，只删除 create_time 早于 grace_hours 小时的，
+    避免删掉刚写入、引用尚未提交的 blob
+
+    :return: 删除的行数
+    """
+    result = session.execute(text("""
+        DELETE FROM chat_record_blob b
+        WHERE b.create_time < :cutoff
+          AND b.hash NOT IN (
+              SELECT split_part(r.data, ':', 2) FROM chat_record r WHERE r.data LIKE 'sqlbot-blob:%'
+              UNION
+              SELECT split_part(r.predict_data, ':', 2) FROM chat_record r WHERE r.predict_data LIKE 'sqlbot-blob:%'
+          )
+    """), {'cutoff': datetime.datetime.now() - datetime.timedelta(hours=grace_hours)})
+    session.commit()
+    return result.rowcount
@@ -0,0 +1,63 @@
+"""
+对话记录写缓冲
+
+一次提问中各步骤分别更新 chat_record / chat_log 的字段，逐个 UPDATE + commit（并重新读取记录）会产生大量元数据库往返。
+任务内的字段变更先在缓冲中累积，到检查点时合并为一条 chat_record UPDATE，与缓冲的 chat_log 更新一起提交：
+
+- 设置检查点字段（sql、chart、data、predict_data、error、finish）时立即提交，页面轮询和重新打开对话依赖这些字段，
+  进程崩溃时不会丢失已完成阶段的结果
+- 其余字段（各阶段的 LLM 原始回答、日志结束信息等）随下一个检查点提交，任务结束（LLMService.close）时提交剩余的变更
+"""
+
+from typing import Any, Dict, List
+
+from sqlalchemy import update
+from sqlalchemy.sql import Executable
+
+from apps.chat.models.chat_model import ChatRecord
+from common.core.deps import SessionDep
+
+_checkpoint_fields = {'sql', 'chart', 'data', 'predict_data', 'error', 'finish'}
+
+
+class ChatRecordBuffer:
+
+    def __init__(self, session: SessionDep, record: ChatRecord):
+        self.session = session
+        self.record_id = record.id
+        self._record = ChatRecord(**record.model_dump())
+        self._values: Dict[str, Any] = {}
+        self._statements: List[Executable] = []
+
+    def set(self, **values) -> ChatRecord:
+        """
+        :return: 合并了已设置字段的记录副本
+        """
+        self._values.update(values)
+        for key, value in values.items():
+            setattr(self._record, key, value)
+        if _checkpoint_fields.intersection(values):
+            self.flush()
+        return ChatRecord(**self._record.model_dump())
+
+    def add(self, stmt: Executable):
+        """缓冲其他表的更新语句（chat_log 结束信息），随下一个检查点一起提交"""
+        self._statements.append(stmt)
+
+    def pending(self) -> bool:
+        return bool(self._values or self._statements)
+
+    def flush(self):
+        if not self.pending():
+            return
+        values, statements = self._values, self._statements
+        self._values, self._statements = {}, []
+        try:
+            for stmt in statements:
+                self.session.execute(stmt)
+            if values:
+                self.session.execute(update(ChatRecord).where(ChatRecord.id == self.record_id).values(**values))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
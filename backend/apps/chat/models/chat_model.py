@@ -4,7 +4,7 @@ from typing import List, Optional
 
 from fastapi import Body
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, Text, BigInteger, DateTime, Identity, Boolean
+from sqlalchemy import Column, Integer, Text, BigInteger, DateTime, Identity, Boolean, LargeBinary, String
 from sqlalchemy import Enum as SQLAlchemyEnum
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import SQLModel, Field
@@ -66,6 +66,15 @@ class ChatLog(SQLModel, table=True):
     token_usage: Optional[dict | None | int] = Field(sa_column=Column(JSONB))
 
 
+class ChatLogPrompt(SQLModel, table=True):
+    """chat_log.messages 中较长的提示词内容，按 sha256 去重存放，messages 中只保留 content_ref"""
+    __tablename__ = "chat_log_prompt"
+    hash: str = Field(sa_column=Column(String(64), primary_key=True))
+    content: str = Field(sa_column=Column(Text, nullable=False))
+    size: int = Field(sa_column=Column(BigInteger, nullable=False))
+    create_time: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
+
+
 class Chat(SQLModel, table=True):
     __tablename__ = "chat"
     id: Optional[int] = Field(sa_column=Column(BigInteger, Identity(always=True), primary_key=True))
@@ -78,6 +87,8 @@ class Chat(SQLModel, table=True):
     engine_type: str = Field(max_length=64)
     origin: Optional[int] = Field(
         sa_column=Column(Integer, nullable=False, default=0))  # 0: default, 1: mcp, 2: assistant
+    # 较早轮次的结构化摘要（问题、用到的表、最终 SQL），见 apps/chat/task/history_memory.py
+    history_memory: Optional[dict] = Field(sa_column=Column(JSONB, nullable=True))
 
 
 class ChatRecord(SQLModel, table=True):
@@ -110,6 +121,16 @@ class ChatRecord(SQLModel, table=True):
     predict_record_id: int = Field(sa_column=Column(BigInteger, nullable=True))
 
 
+class ChatRecordBlob(SQLModel, table=True):
+    """对话记录中较大的查询结果，按内容 sha256 寻址，压缩存放"""
+    __tablename__ = "chat_record_blob"
+    hash: str = Field(sa_column=Column(String(64), primary_key=True))
+    codec: str = Field(sa_column=Column(String(16), nullable=False))
+    size: int = Field(sa_column=Column(BigInteger, nullable=False))
+    content: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    create_time: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=True))
+
+
 class ChatRecordResult(BaseModel):
     id: Optional[int] = None
     chat_id: Optional[int] = None
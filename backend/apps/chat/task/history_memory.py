@@ -0,0 +1,80 @@
+"""
+对话历史结构化摘要
+
+多轮对话时原样回放历史消息，每条用户消息都带着完整的 schema，提示词随轮数快速增长。
+开启 CHAT_HISTORY_MEMORY_ENABLED 后，只原样回放最近 CHAT_HISTORY_RECENT_TURNS 轮，
+更早的轮次压缩为 问题 / 用到的表 / 最终 SQL 的列表拼接到系统提示词中。
+
+摘要直接从对话记录抽取（表名由 sqlglot 解析 SQL 得到），不调用 LLM，相同的记录总是得到相同的输出。
+摘要保存在 chat.history_memory 中，每次提问只增量读取上次之后新增的记录。
+"""
+
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, select
+
+from apps.chat.models.chat_model import Chat, ChatRecord
+from apps.db.sql_rewriter import extract_tables
+from common.core.config import settings
+from common.core.deps import SessionDep
+from common.utils.utils import SQLBotLogUtil
+
+_whitespace = re.compile(r'\s+')
+
+
+def _turn(record_id: int, question: str, sql: str, ds_type: str) -> Dict:
+    return {
+        'id': record_id,
+        'question': (question or '').strip(),
+        'tables': extract_tables(sql, ds_type) or [],
+        'sql': _whitespace.sub(' ', sql.strip()),
+    }
+
+
+def update_history_memory(session: SessionDep, chat: Chat, ds_type: Optional[str]) -> Dict:
+    """
+    把上次摘要之后新增的、已生成 SQL 的记录追加到摘要，只保留最近 CHAT_HISTORY_MEMORY_TURNS 轮
+
+    :return: {'last_record_id': int, 'turns': [{'id', 'question', 'tables', 'sql'}]}
+    """
+    memory = chat.history_memory or {}
+    last_record_id = memory.get('last_record_id') or 0
+    turns: List[Dict] = list(memory.get('turns') or [])
+
+    stmt = select(ChatRecord.id, ChatRecord.question, ChatRecord.sql).where(
+        and_(ChatRecord.chat_id == chat.id, ChatRecord.id > last_record_id, ChatRecord.sql.isnot(None),
+             ChatRecord.sql != '')).order_by(ChatRecord.id)
+    rows = session.execute(stmt).all()
+    if not rows:
+        return memory
+
+    for row in rows:
+        turns.append(_turn(row.id, row.question, row.sql, ds_type or ''))
+    memory = {'last_record_id': rows[-1].id, 'turns': turns[-settings.CHAT_HISTORY_MEMORY_TURNS:]}
+    try:
+        chat.history_memory = memory
+        session.add(chat)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        SQLBotLogUtil.warning(f"Save history memory of chat {chat.id} failed: {e}")
+    return memory
+
+
+def render_history_memory(memory: Optional[Dict], recent_turns: int) -> str:
+    """
+    渲染最近 recent_turns 轮之前的摘要（最近的轮次原样回放，不重复出现），没有内容时返回空字符串
+    """
+    turns = (memory or {}).get('turns') or []
+    if recent_turns > 0:
+        turns = turns[:-recent_turns]
+    if not turns:
+        return ''
+    lines = ['【历史问题】（更早的问题、用到的表和最终执行的 SQL，按时间先后排列）']
+    for index, turn in enumerate(turns, start=1):
+        lines.append(f"{index}. 问题：{turn.get('question')}")
+        if turn.get('tables'):
+            lines.append(f"   表：{', '.join(turn.get('tables'))}")
+        lines.append(f"   SQL：{turn.get('sql')}")
+    return '\n'.join(lines)
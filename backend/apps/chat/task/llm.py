@@ -1,11 +1,12 @@
-import concurrent
+import asyncio
 import json
 import os
-import re
+import threading
+import time
 import traceback
 import urllib.parse
 import warnings
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from typing import Any, List, Optional, Union, Dict, Iterator
 
@@ -26,40 +27,69 @@ from apps.chat.curd.chat import save_question, save_sql_answer, save_sql, \
     save_error_message, save_sql_exec_data, save_chart_answer, save_chart, \
     finish_record, save_analysis_answer, save_predict_answer, save_predict_data, \
     save_select_datasource_answer, save_recommend_question_answer, \
-    get_old_questions, save_analysis_predict_record, rename_chat, get_chart_config, \
-    get_chat_chart_data, list_generate_sql_logs, list_generate_chart_logs, start_log, end_log, \
+    get_old_questions, save_analysis_predict_record, rename_chat, get_chat_brief, get_chart_config, \
+    get_chat_chart_data, encode_chart_data, list_generate_sql_logs, list_generate_chart_logs, start_log, end_log, \
     get_last_execute_sql_error
+from apps.chat.curd.record_buffer import ChatRecordBuffer
 from apps.chat.models.chat_model import ChatQuestion, ChatRecord, Chat, RenameChat, ChatLog, OperationEnum, \
     ChatFinishStep
+from apps.chat.task import sql_cache
+from apps.chat.task.history_memory import update_history_memory, render_history_memory
+from apps.chat.task.scheduler import chat_task_scheduler
 from sqlbot_xpack.license.license_manage import SQLBotLicenseUtil
 from sqlbot_xpack.custom_prompt.curd.custom_prompt import find_custom_prompts
 from sqlbot_xpack.custom_prompt.models.custom_prompt_model import CustomPromptTypeEnum
 from apps.data_training.curd.data_training import get_training_template
 from apps.datasource.crud.datasource import get_table_schema
-from apps.datasource.crud.permission import get_row_permission_filters, is_normal_user
+from apps.datasource.crud.permission import get_row_permission_filters, is_normal_user, get_permission_fingerprint
 from apps.datasource.embedding.ds_embedding import get_ds_embedding
 from apps.datasource.models.datasource import CoreDatasource
-from apps.db.db import exec_sql, get_version, check_connection
+from apps.db.db import QueryCanceller, exec_sql, get_version, check_connection
+from apps.db.result_cache import exec_sql_with_cache
+from apps.db.sql_rewriter import extract_tables, inject_row_filters, replace_tables_with_subqueries, \
+    apply_row_limit, check_read_only
 from apps.system.crud.assistant import AssistantOutDs, AssistantOutDsFactory, get_assistant_ds
 from apps.system.schemas.system_schema import AssistantOutDsSchema
 from apps.terminology.curd.terminology import get_terminology_template
 from common.core.config import settings
-from common.core.db import engine
+from common.core.db import engine, get_pool_status
 from common.core.deps import CurrentAssistant, CurrentUser
-from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError
+from common.error import SingleMessageError, SQLBotDBError, ParseSQLResultError, SQLBotDBConnectionError, \
+    ChatTaskRejectedError
 from common.utils.utils import SQLBotLogUtil, extract_nested_json, prepare_for_orjson
 
 warnings.filterwarnings("ignore")
 
 base_message_count_limit = 6
 
-executor = ThreadPoolExecutor(max_workers=200)
-
 dynamic_ds_types = [1, 3]
 dynamic_subsql_prefix = 'select * from sqlbot_dynamic_temp_table_'
 
 session_maker = sessionmaker(bind=engine)
-db_session = session_maker()
+
+# 对话开始前的上下文准备（术语、数据训练、自定义提示词、连接检查、改名等）并发执行
+context_executor = ThreadPoolExecutor(max_workers=settings.CHAT_CONTEXT_MAX_WORKERS)
+
+# marks the end of a task's chunk stream in LLMService.chunk_queue
+_end_of_stream = object()
+
+
+def new_session() -> Session:
+    session = session_maker()
+    session.exec = session.exec if hasattr(session, "exec") else session.execute
+    return session
+
+
+def get_schema_token_budget(config: Optional[LLMConfig]) -> int:
+    """
+    schema 的 token 预算：模型参数中的 schema_token_budget 优先（LLMConfig.model_params 不会把它传给模型），
+    否则使用 SCHEMA_TOKEN_BUDGET
+    """
+    budget = config.additional_params.get('schema_token_budget') if config is not None else None
+    try:
+        return int(budget) if budget is not None else settings.SCHEMA_TOKEN_BUDGET
+    except (TypeError, ValueError):
+        return settings.SCHEMA_TOKEN_BUDGET
 
 
 class LLMService:
@@ -81,9 +111,11 @@ class LLMService:
     - config: LLM配置
     - llm: 实际的LLM实例
     - sql_message/chart_message: 对话消息历史
-    - session: 数据库会话
+    - session: 数据库会话，每个任务独立持有，任务结束时关闭
     """
     ds: CoreDatasource
+    # get_version 取到的数据源版本，加行数上限时用于选择方言写法
+    db_version: str = ''
     chat_question: ChatQuestion
     record: ChatRecord
     config: LLMConfig
@@ -91,7 +123,7 @@ class LLMService:
     sql_message: List[Union[BaseMessage, dict[str, Any]]] = []
     chart_message: List[Union[BaseMessage, dict[str, Any]]] = []
 
-    session: Session = db_session
+    session: Session
     current_user: CurrentUser
     current_assistant: Optional[CurrentAssistant] = None
     out_ds_instance: Optional[AssistantOutDs] = None
@@ -99,24 +131,57 @@ class LLMService:
 
     generate_sql_logs: List[ChatLog] = []
     generate_chart_logs: List[ChatLog] = []
+    # chat_record 字段变更的写缓冲，在检查点合并提交
+    record_buffer: Optional[ChatRecordBuffer] = None
+    # 较早轮次的结构化摘要，CHAT_HISTORY_MEMORY_ENABLED 时使用
+    history_memory: Optional[Dict[str, Any]] = None
 
     current_logs: dict[OperationEnum, ChatLog] = {}
 
-    chunk_list: List[str] = []
+    chunk_queue: asyncio.Queue
+    loop: asyncio.AbstractEventLoop
     future: Future
 
     last_execute_sql_error: str = None
 
+    # 客户端断开时置位，任务在下一个分片处停止，正在执行的查询通过 query_canceller 取消
+    cancel_event: threading.Event
+    query_canceller: QueryCanceller
+    # schema 的 token 预算，0 为不裁剪
+    schema_token_budget: int = 0
+
+    # 取消时是否把当前记录标记为已取消（推荐问题复用原问题记录，不标记）
+    mark_record_cancelled: bool = True
+
+    # 上下文准备各步骤耗时（秒）
+    context_timings: Dict[str, float] = {}
+
+    # 问题 -> SQL 缓存：scope/上下文指纹，以及命中的缓存条目
+    sql_cache_scope: Optional[str] = None
+    sql_cache_context: Optional[str] = None
+    sql_cache_hit: Optional[Dict[str, Any]] = None
+
     def __init__(self, current_user: CurrentUser, chat_question: ChatQuestion,
                  current_assistant: Optional[CurrentAssistant] = None, no_reasoning: bool = False,
                  embedding: bool = False, config: LLMConfig = None):
-        self.chunk_list = []
-        # engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
-        # session_maker = sessionmaker(bind=engine)
-        # self.session = session_maker()
-        self.session.exec = self.session.exec if hasattr(self.session, "exec") else self.session.execute
+        # each task owns a short-lived session from the shared engine pool, released in close()
+        self.session = new_session()
+        self.current_logs = {}
+        self.context_timings = {}
+        self.cancel_event = threading.Event()
+        self.query_canceller = QueryCanceller()
+        try:
+            self.init_chat(current_user, chat_question, current_assistant, no_reasoning, embedding, config)
+        except Exception:
+            self.close()
+            raise
+
+    def init_chat(self, current_user: CurrentUser, chat_question: ChatQuestion,
+                  current_assistant: Optional[CurrentAssistant] = None, no_reasoning: bool = False,
+                  embedding: bool = False, config: LLMConfig = None):
         self.current_user = current_user
         self.current_assistant = current_assistant
+        self.schema_token_budget = get_schema_token_budget(config)
         # chat = self.session.query(Chat).filter(Chat.id == chat_question.chat_id).first()
         chat_id = chat_question.chat_id
         chat: Chat | None = self.session.get(Chat, chat_id)
@@ -131,18 +196,28 @@ class LLMService:
                 ds = self.out_ds_instance.get_ds(chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = ds.type + get_version(ds)
+                version_future = self.submit_context_step('get_version', get_version, ds)
                 chat_question.db_schema = self.out_ds_instance.get_db_schema(ds.id)
+                self.db_version = version_future.result()
+                chat_question.engine = ds.type + self.db_version
             else:
                 ds = self.session.get(CoreDatasource, chat.datasource)
                 if not ds:
                     raise SingleMessageError("No available datasource configuration found")
-                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + get_version(ds)
+                version_future = self.submit_context_step('get_version', get_version, ds)
                 chat_question.db_schema = get_table_schema(session=self.session, current_user=current_user, ds=ds,
-                                                           question=chat_question.question, embedding=embedding)
-
-        self.generate_sql_logs = list_generate_sql_logs(session=self.session, chart_id=chat_id)
-        self.generate_chart_logs = list_generate_chart_logs(session=self.session, chart_id=chat_id)
+                                                           question=chat_question.question, embedding=embedding,
+                                                           token_budget=self.schema_token_budget)
+                self.db_version = version_future.result()
+                chat_question.engine = (ds.type_name if ds.type != 'excel' else 'PostgreSQL') + self.db_version
+
+        # 历史上下文只用到最近一次生成 SQL / 图表的日志
+        self.generate_sql_logs = list_generate_sql_logs(session=self.session, chart_id=chat_id,
+                                                        limit=settings.CHAT_HISTORY_LOG_LIMIT)
+        self.generate_chart_logs = list_generate_chart_logs(session=self.session, chart_id=chat_id,
+                                                            limit=settings.CHAT_HISTORY_LOG_LIMIT)
+        self.history_memory = update_history_memory(self.session, chat, ds.type if ds else None) \
+            if settings.CHAT_HISTORY_MEMORY_ENABLED else None
 
         self.change_title = len(self.generate_sql_logs) == 0
 
@@ -174,35 +249,89 @@ class LLMService:
         else:
             self.chat_question.error_msg = ''
 
+    def close(self):
+        try:
+            if self.record_buffer is not None:
+                self.record_buffer.flush()
+        except Exception as e:
+            SQLBotLogUtil.error(f"Flush chat record changes failed: {e}")
+        try:
+            self.session.close()
+        except Exception as e:
+            SQLBotLogUtil.error(f"Close chat session failed: {e}")
+        SQLBotLogUtil.debug(f"Chat session closed, pool status: {get_pool_status()}")
+
+    def submit_context_step(self, name: str, fn, *args, with_session: bool = False) -> Future:
+        """
+        在上下文线程池中执行一个准备步骤并记录耗时；with_session 时为该步骤单独创建数据库会话（作为第一个参数传入）
+        """
+
+        def _run():
+            start = time.perf_counter()
+            session = new_session() if with_session else None
+            try:
+                return fn(session, *args) if with_session else fn(*args)
+            except Exception as e:
+                SQLBotLogUtil.error(f"Chat context step {name} failed: {e}")
+                raise
+            finally:
+                if session is not None:
+                    session.close()
+                self.context_timings[name] = round(time.perf_counter() - start, 3)
+
+        return context_executor.submit(_run)
+
+    def assemble_context(self):
+        """
+        并发检索术语、数据训练和自定义提示词，全部就绪后组装 SQL/图表提示词
+        """
+        if self.ds:
+            oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
+            ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
+            question = self.chat_question.question
+            futures = {
+                'terminologies': self.submit_context_step('terminologies', get_terminology_template, question, oid,
+                                                          ds_id, with_session=True),
+                'data_training': self.submit_context_step('data_training', get_training_template, question, ds_id,
+                                                          oid, with_session=True),
+            }
+            if SQLBotLicenseUtil.valid():
+                futures['custom_prompt'] = self.submit_context_step('custom_prompt', find_custom_prompts,
+                                                                    CustomPromptTypeEnum.GENERATE_SQL, oid, ds_id,
+                                                                    with_session=True)
+            for name, future in futures.items():
+                setattr(self.chat_question, name, future.result())
+
+        start = time.perf_counter()
+        self.init_messages()
+        self.context_timings['init_messages'] = round(time.perf_counter() - start, 3)
+
     @classmethod
     async def create(cls, *args, **kwargs):
         config: LLMConfig = await get_default_config()
         instance = cls(*args, **kwargs, config=config)
         return instance
 
-    def is_running(self, timeout=0.5):
-        try:
-            r = concurrent.futures.wait([self.future], timeout)
-            if len(r.not_done) > 0:
-                return True
-            else:
-                return False
-        except Exception as e:
-            return True
-
     def init_messages(self):
         last_sql_messages: List[dict[str, Any]] = self.generate_sql_logs[-1].messages if len(
             self.generate_sql_logs) > 0 else []
 
         # todo maybe can configure
-        count_limit = 0 - base_message_count_limit
+        count_limit = base_message_count_limit
+        sql_sys_question = self.chat_question.sql_sys_question()
+        # 开启历史摘要时只原样回放最近几轮，更早的轮次以摘要形式放在系统提示词中
+        memory_text = render_history_memory(self.history_memory, settings.CHAT_HISTORY_RECENT_TURNS) \
+            if self.history_memory else ''
+        if memory_text:
+            count_limit = 2 * max(settings.CHAT_HISTORY_RECENT_TURNS, 0)
+            sql_sys_question += '\n\n' + memory_text
 
         self.sql_message = []
         # add sys prompt
-        self.sql_message.append(SystemMessage(content=self.chat_question.sql_sys_question()))
-        if last_sql_messages is not None and len(last_sql_messages) > 0:
+        self.sql_message.append(SystemMessage(content=sql_sys_question))
+        if last_sql_messages is not None and len(last_sql_messages) > 0 and count_limit > 0:
             # limit count
-            for last_sql_message in last_sql_messages[count_limit:]:
+            for last_sql_message in last_sql_messages[0 - count_limit:]:
                 _msg: BaseMessage
                 if last_sql_message['type'] == 'human':
                     _msg = HumanMessage(content=last_sql_message['content'])
@@ -236,6 +365,14 @@ class LLMService:
     def get_record(self):
         return self.record
 
+    def get_record_buffer(self) -> ChatRecordBuffer:
+        """当前记录的写缓冲，切换到新记录（分析/预测）时先提交上一条记录缓冲的变更"""
+        if self.record_buffer is None or self.record_buffer.record_id != self.record.id:
+            if self.record_buffer is not None:
+                self.record_buffer.flush()
+            self.record_buffer = ChatRecordBuffer(self.session, self.record)
+        return self.record_buffer
+
     def set_record(self, record: ChatRecord):
         self.record = record
 
@@ -307,9 +444,11 @@ class LLMService:
                                                                  'content': msg.content}
                                                                 for msg in analysis_msg],
                                                             reasoning_content=full_thinking_text,
-                                                            token_usage=token_usage)
+                                                            token_usage=token_usage,
+                                                            buffer=self.get_record_buffer())
         self.record = save_analysis_answer(session=self.session, record_id=self.record.id,
-                                           answer=orjson.dumps({'content': full_analysis_text}).decode())
+                                           answer=orjson.dumps({'content': full_analysis_text}).decode(),
+                                           buffer=self.get_record_buffer())
 
     def generate_predict(self):
         fields = self.get_fields_from_chart()
@@ -349,7 +488,8 @@ class LLMService:
 
         predict_msg.append(AIMessage(full_predict_text))
         self.record = save_predict_answer(session=self.session, record_id=self.record.id,
-                                          answer=orjson.dumps({'content': full_predict_text}).decode())
+                                          answer=orjson.dumps({'content': full_predict_text}).decode(),
+                                          buffer=self.get_record_buffer())
         self.current_logs[OperationEnum.PREDICT_DATA] = end_log(session=self.session,
                                                                 log=self.current_logs[
                                                                     OperationEnum.PREDICT_DATA],
@@ -358,7 +498,8 @@ class LLMService:
                                                                      'content': msg.content}
                                                                     for msg in predict_msg],
                                                                 reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
+                                                                token_usage=token_usage,
+                                                                buffer=self.get_record_buffer())
 
     def generate_recommend_questions_task(self):
 
@@ -368,7 +509,8 @@ class LLMService:
                 self.ds.id) if self.out_ds_instance else get_table_schema(session=self.session,
                                                                           current_user=self.current_user, ds=self.ds,
                                                                           question=self.chat_question.question,
-                                                                          embedding=False)
+                                                                          embedding=False,
+                                                                          token_budget=self.schema_token_budget)
 
         guess_msg: List[Union[BaseMessage, dict[str, Any]]] = []
         guess_msg.append(SystemMessage(content=self.chat_question.guess_sys_question()))
@@ -408,9 +550,11 @@ class LLMService:
                                                                                        'content': msg.content}
                                                                                       for msg in guess_msg],
                                                                                   reasoning_content=full_thinking_text,
-                                                                                  token_usage=token_usage)
+                                                                                  token_usage=token_usage,
+                                                                                  buffer=self.get_record_buffer())
         self.record = save_recommend_question_answer(session=self.session, record_id=self.record.id,
-                                                     answer={'content': full_guess_text})
+                                                     answer={'content': full_guess_text},
+                                                     buffer=self.get_record_buffer())
 
         yield {'recommended_question': self.record.recommended_question}
 
@@ -479,7 +623,8 @@ class LLMService:
                                                                                   'content': msg.content}
                                                                                  for msg in datasource_msg],
                                                                              reasoning_content=full_thinking_text,
-                                                                             token_usage=token_usage)
+                                                                             token_usage=token_usage,
+                                                                             buffer=self.get_record_buffer())
 
                 json_str = extract_nested_json(full_text)
                 if json_str is None:
@@ -499,7 +644,8 @@ class LLMService:
                 if self.current_assistant and self.current_assistant.type in dynamic_ds_types:
                     _ds = self.out_ds_instance.get_ds(data['id'])
                     self.ds = _ds
-                    self.chat_question.engine = _ds.type + get_version(self.ds)
+                    self.db_version = get_version(self.ds)
+                    self.chat_question.engine = _ds.type + self.db_version
                     self.chat_question.db_schema = self.out_ds_instance.get_db_schema(self.ds.id)
                     _engine_type = self.chat_question.engine
                     _chat.engine_type = _ds.type
@@ -509,24 +655,22 @@ class LLMService:
                         _datasource = None
                         raise SingleMessageError(f"Datasource configuration with id {_datasource} not found")
                     self.ds = CoreDatasource(**_ds.model_dump())
-                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + get_version(
-                        self.ds)
+                    self.db_version = get_version(self.ds)
+                    self.chat_question.engine = (_ds.type_name if _ds.type != 'excel' else 'PostgreSQL') + \
+                                                self.db_version
                     self.chat_question.db_schema = get_table_schema(session=self.session,
                                                                     current_user=self.current_user, ds=self.ds,
-                                                                    question=self.chat_question.question)
+                                                                    question=self.chat_question.question,
+                                                                    token_budget=self.schema_token_budget)
                     _engine_type = self.chat_question.engine
                     _chat.engine_type = _ds.type_name
                 # save chat
-                with self.session.begin_nested():
-                    # 为了能继续记日志，先单独处理下事务
-                    try:
-                        self.session.add(_chat)
-                        self.session.flush()
-                        self.session.refresh(_chat)
-                        self.session.commit()
-                    except Exception as e:
-                        self.session.rollback()
-                        raise e
+                try:
+                    self.session.add(_chat)
+                    self.session.commit()
+                except Exception as e:
+                    self.session.rollback()
+                    raise e
 
             elif data['fail']:
                 raise SingleMessageError(data['fail'])
@@ -540,20 +684,10 @@ class LLMService:
             self.record = save_select_datasource_answer(session=self.session, record_id=self.record.id,
                                                         answer=orjson.dumps({'content': full_text}).decode(),
                                                         datasource=_datasource,
-                                                        engine_type=_engine_type)
+                                                        engine_type=_engine_type,
+                                                        buffer=self.get_record_buffer())
         if self.ds:
-            oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
-            ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-
-            self.chat_question.terminologies = get_terminology_template(self.session, self.chat_question.question, oid,
-                                                                        ds_id)
-            self.chat_question.data_training = get_training_template(self.session, self.chat_question.question, ds_id,
-                                                                     oid)
-            if SQLBotLicenseUtil.valid():
-                self.chat_question.custom_prompt = find_custom_prompts(self.session, CustomPromptTypeEnum.GENERATE_SQL,
-                                                                   oid, ds_id)
-
-            self.init_messages()
+            self.assemble_context()
 
         if _error:
             raise _error
@@ -588,7 +722,11 @@ class LLMService:
         full_thinking_text = ''
         full_sql_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.sql_message), token_usage)
+        if self.sql_cache_hit:
+            # 命中缓存时直接回放已校验过的回答，不再调用 LLM
+            res = [{'content': self.sql_cache_hit.get('sql_answer')}]
+        else:
+            res = process_stream(self.llm.stream(self.sql_message), token_usage)
         for chunk in res:
             if chunk.get('content'):
                 full_sql_text += chunk.get('content')
@@ -603,9 +741,11 @@ class LLMService:
                                                                 full_message=[{'type': msg.type, 'content': msg.content}
                                                                               for msg in self.sql_message],
                                                                 reasoning_content=full_thinking_text,
-                                                                token_usage=token_usage)
+                                                                token_usage=token_usage,
+                                                                buffer=self.get_record_buffer())
         self.record = save_sql_answer(session=self.session, record_id=self.record.id,
-                                      answer=orjson.dumps({'content': full_sql_text}).decode())
+                                      answer=orjson.dumps({'content': full_sql_text}).decode(),
+                                      buffer=self.get_record_buffer())
 
     def generate_with_sub_sql(self, sql, sub_mappings: list):
         sub_query = json.dumps(sub_mappings, ensure_ascii=False)
@@ -645,7 +785,8 @@ class LLMService:
                                                                              'content': msg.content}
                                                                             for msg in dynamic_sql_msg],
                                                                         reasoning_content=full_thinking_text,
-                                                                        token_usage=token_usage)
+                                                                        token_usage=token_usage,
+                                                                        buffer=self.get_record_buffer())
 
         SQLBotLogUtil.info(full_dynamic_text)
         return full_dynamic_text
@@ -654,13 +795,18 @@ class LLMService:
         ds: AssistantOutDsSchema = self.ds
         sub_query = []
         result_dict = {}
+        sql_tables = extract_tables(sql, ds.type) or []
         for table in ds.tables:
-            if table.name in tables and table.sql:
+            if (table.name in tables or table.name in sql_tables) and table.sql:
                 # sub_query.append({"table": table.name, "query": table.sql})
                 result_dict[table.name] = table.sql
                 sub_query.append({"table": table.name, "query": f'{dynamic_subsql_prefix}{table.name}'})
         if not sub_query:
             return None
+        # 本地把表引用替换为 (table.sql) AS name，无法解析时才回退到 LLM 改写
+        dynamic_sql = replace_tables_with_subqueries(sql, result_dict, ds.type)
+        if dynamic_sql is not None:
+            return {'sqlbot_dynamic_sql': dynamic_sql}
         temp_sql_text = self.generate_with_sub_sql(sql=sql, sub_mappings=sub_query)
         result_dict['sqlbot_temp_sql_text'] = temp_sql_text
         return result_dict
@@ -703,16 +849,25 @@ class LLMService:
                                                                                       'content': msg.content}
                                                                                      for msg in permission_sql_msg],
                                                                                  reasoning_content=full_thinking_text,
-                                                                                 token_usage=token_usage)
+                                                                                 token_usage=token_usage,
+                                                                                 buffer=self.get_record_buffer())
 
         SQLBotLogUtil.info(full_filter_text)
         return full_filter_text
 
     def generate_filter(self, sql: str, tables: List):
+        # 以 SQL 实际引用的表为准，LLM 返回的 tables 可能不全
+        sql_tables = extract_tables(sql, self.ds.type)
+        tables = list(dict.fromkeys((tables or []) + (sql_tables or [])))
         filters = get_row_permission_filters(session=self.session, current_user=self.current_user, ds=self.ds,
                                              tables=tables)
+        filters = [f for f in filters if f.get('filter')]
         if not filters:
             return None
+        # 本地按语法树注入权限条件，SQL 无法解析时才回退到 LLM 改写
+        permission_sql = inject_row_filters(sql, filters, self.ds.type)
+        if permission_sql is not None:
+            return orjson.dumps({'success': True, 'sql': permission_sql}).decode()
         return self.build_table_filter(sql=sql, filters=filters)
 
     def generate_assistant_filter(self, sql, tables: List):
@@ -741,7 +896,10 @@ class LLMService:
         full_thinking_text = ''
         full_chart_text = ''
         token_usage = {}
-        res = process_stream(self.llm.stream(self.chart_message), token_usage)
+        if self.sql_cache_hit and self.sql_cache_hit.get('chart_answer'):
+            res = [{'content': self.sql_cache_hit.get('chart_answer')}]
+        else:
+            res = process_stream(self.llm.stream(self.chart_message), token_usage)
         for chunk in res:
             if chunk.get('content'):
                 full_chart_text += chunk.get('content')
@@ -752,14 +910,16 @@ class LLMService:
         self.chart_message.append(AIMessage(full_chart_text))
 
         self.record = save_chart_answer(session=self.session, record_id=self.record.id,
-                                        answer=orjson.dumps({'content': full_chart_text}).decode())
+                                        answer=orjson.dumps({'content': full_chart_text}).decode(),
+                                        buffer=self.get_record_buffer())
         self.current_logs[OperationEnum.GENERATE_CHART] = end_log(session=self.session,
                                                                   log=self.current_logs[OperationEnum.GENERATE_CHART],
                                                                   full_message=[
                                                                       {'type': msg.type, 'content': msg.content}
                                                                       for msg in self.chart_message],
                                                                   reasoning_content=full_thinking_text,
-                                                                  token_usage=token_usage)
+                                                                  token_usage=token_usage,
+                                                                  buffer=self.get_record_buffer())
 
     @staticmethod
     def check_sql(res: str) -> tuple[str, Optional[list]]:
@@ -810,14 +970,15 @@ class LLMService:
     def save_user_sql(self):
         _sql = self.chat_question.sql
         if _sql:
-            save_sql(session=self.session, sql=self.chat_question.sql, record_id=self.record.id)
+            save_sql(session=self.session, sql=self.chat_question.sql, record_id=self.record.id,
+                     buffer=self.get_record_buffer())
             return _sql
         else:
             raise SingleMessageError("SQL query is empty")
 
     def check_save_sql(self, res: str) -> str:
         sql, *_ = self.check_sql(res=res)
-        save_sql(session=self.session, sql=sql, record_id=self.record.id)
+        save_sql(session=self.session, sql=sql, record_id=self.record.id, buffer=self.get_record_buffer())
 
         self.chat_question.sql = sql
 
@@ -863,7 +1024,8 @@ class LLMService:
         if error:
             raise SingleMessageError(message)
 
-        save_chart(session=self.session, chart=orjson.dumps(chart).decode(), record_id=self.record.id)
+        save_chart(session=self.session, chart=orjson.dumps(chart).decode(), record_id=self.record.id,
+                   buffer=self.get_record_buffer())
 
         return chart
 
@@ -874,7 +1036,8 @@ class LLMService:
         if not json_str:
             json_str = ''
 
-        save_predict_data(session=self.session, record_id=self.record.id, data=json_str)
+        save_predict_data(session=self.session, record_id=self.record.id, data=json_str,
+                          buffer=self.get_record_buffer())
 
         if json_str == '':
             return False
@@ -882,12 +1045,18 @@ class LLMService:
         return True
 
     def save_error(self, message: str):
-        return save_error_message(session=self.session, record_id=self.record.id, message=message)
+        # discard whatever the failed step left in the task session before recording the error
+        self.session.rollback()
+        if self.is_cancelled():
+            # 客户端断开导致的查询失败不作为执行错误反馈给下一次 SQL 生成
+            message = orjson.dumps({'message': 'Cancelled by client', 'type': 'cancelled'}).decode()
+        return save_error_message(session=self.session, record_id=self.record.id, message=message,
+                                  buffer=self.get_record_buffer())
 
     def save_sql_data(self, data_obj: Dict[str, Any]):
         try:
             data_result = data_obj.get('data')
-            limit = 1000
+            limit = settings.SQL_QUERY_ROW_LIMIT
             if data_result:
                 data_result = prepare_for_orjson(data_result)
                 if data_result and len(data_result) > limit:
@@ -896,12 +1065,49 @@ class LLMService:
                 else:
                     data_obj['data'] = data_result
             return save_sql_exec_data(session=self.session, record_id=self.record.id,
-                                      data=orjson.dumps(data_obj).decode())
+                                      data=encode_chart_data(data_obj),
+                                      buffer=self.get_record_buffer())
         except Exception as e:
             raise e
 
     def finish(self):
-        return finish_record(session=self.session, record_id=self.record.id)
+        return finish_record(session=self.session, record_id=self.record.id, buffer=self.get_record_buffer())
+
+    def lookup_sql_cache(self):
+        """
+        只缓存内置数据源上、不依赖对话上下文的提问（会话中的首个问题且无上次执行错误）
+        """
+        self.sql_cache_hit = None
+        if not sql_cache.is_sql_cache_enabled() or not isinstance(self.ds, CoreDatasource) or self.out_ds_instance \
+                or len(self.generate_sql_logs) > 0 or self.chat_question.error_msg:
+            return
+        try:
+            oid = self.ds.oid if self.ds.oid is not None else 1
+            self.sql_cache_scope = sql_cache.get_scope(self.ds.id, oid,
+                                                       get_permission_fingerprint(self.session, self.current_user,
+                                                                                  self.ds))
+            self.sql_cache_context = sql_cache.get_context_fingerprint(self.chat_question.engine,
+                                                                       self.chat_question.db_schema,
+                                                                       self.chat_question.terminologies,
+                                                                       self.chat_question.data_training,
+                                                                       self.chat_question.custom_prompt)
+            self.sql_cache_hit = sql_cache.lookup(self.sql_cache_scope, self.chat_question.question,
+                                                  self.sql_cache_context)
+        except Exception:
+            traceback.print_exc()
+            self.sql_cache_scope = None
+
+    def save_sql_cache(self, sql_res: str, sql_answer: str, chart_answer: Optional[str], chart_type: Optional[str],
+                       cost: float):
+        if not self.sql_cache_scope:
+            return
+        hit = self.sql_cache_hit
+        if hit and not hit.get('similar') and (hit.get('chart_answer') or not chart_answer):
+            return
+        sql_cache.store(self.sql_cache_scope, self.chat_question.question, self.sql_cache_context,
+                        sql_answer=sql_answer, sql=sql_res, chart_answer=chart_answer or (
+                            hit.get('chart_answer') if hit else None), chart_type=chart_type,
+                        cost=hit.get('cost', cost) if hit else cost)
 
     def execute_sql(self, sql: str):
         """Execute SQL query
@@ -913,72 +1119,130 @@ class LLMService:
         Returns:
             Query results
         """
+        # 多取一行，用于判断结果是否超出展示上限
+        limited_sql = apply_row_limit(sql, settings.SQL_QUERY_ROW_LIMIT + 1, self.ds.type, self.db_version)
+        if limited_sql:
+            sql = limited_sql
         SQLBotLogUtil.info(f"Executing SQL on ds_id {self.ds.id}: {sql}")
         try:
-            return exec_sql(ds=self.ds, sql=sql, origin_column=False)
+            if isinstance(self.ds, CoreDatasource) and not self.out_ds_instance:
+                return exec_sql_with_cache(ds=self.ds, sql=sql,
+                                           permission_fingerprint=lambda: get_permission_fingerprint(
+                                               self.session, self.current_user, self.ds),
+                                           cost_guard=True, canceller=self.query_canceller)
+            return exec_sql(ds=self.ds, sql=sql, origin_column=False, canceller=self.query_canceller)
         except Exception as e:
-            if isinstance(e, ParseSQLResultError):
+            if isinstance(e, (ParseSQLResultError, SQLBotDBError)):
                 raise e
             else:
                 err = traceback.format_exc(limit=1, chain=True)
                 raise SQLBotDBError(err)
 
-    def pop_chunk(self):
+    def submit_task(self, task, *args):
+        """
+        经调度器准入后在线程池中执行生成器任务，产出的每个分片通过事件循环线程安全地推入 asyncio.Queue，
+        由 await_result 异步消费，无需轮询
+        """
+        self.loop = asyncio.get_running_loop()
+        self.chunk_queue = asyncio.Queue()
         try:
-            chunk = self.chunk_list.pop(0)
-            return chunk
-        except IndexError as e:
-            return None
+            self.future = chat_task_scheduler.submit(self.current_user.oid, self.current_user.id,
+                                                     self.produce_chunks, task, *args)
+        except ChatTaskRejectedError as e:
+            if getattr(self, 'record', None):
+                self.save_error(message=orjson.dumps({'message': str(e), 'type': 'too-many-requests'}).decode())
+            self.close()
+            raise e
+
+    def produce_chunks(self, task, *args):
+        try:
+            if self.is_cancelled():
+                # 出队前客户端已断开，不再执行任务
+                self.on_task_cancelled()
+                return
+            gen = task(*args)
+            for chunk in gen:
+                if self.is_cancelled():
+                    break
+                self.loop.call_soon_threadsafe(self.chunk_queue.put_nowait, chunk)
+            if self.is_cancelled():
+                # 在 yield 处结束任务生成器，逐层关闭 LLM 流，任务自身的 finally 照常执行
+                gen.close()
+                self.on_task_cancelled()
+        except Exception as e:
+            SQLBotLogUtil.error(f"Chat task failed: {e}")
+        finally:
+            self.close()
+            self.loop.call_soon_threadsafe(self.chunk_queue.put_nowait, _end_of_stream)
 
-    def await_result(self):
-        while self.is_running():
+    async def await_result(self):
+        completed = False
+        try:
             while True:
-                chunk = self.pop_chunk()
-                if chunk is not None:
-                    yield chunk
-                else:
+                chunk = await self.chunk_queue.get()
+                if chunk is _end_of_stream:
+                    completed = True
                     break
-        while True:
-            chunk = self.pop_chunk()
-            if chunk is None:
-                break
-            yield chunk
+                yield chunk
+        finally:
+            # 客户端断开（CancelledError / GeneratorExit）时通知任务取消
+            if not completed:
+                self.cancel()
+
+    def on_task_cancelled(self):
+        record = getattr(self, 'record', None)
+        if self.mark_record_cancelled and record:
+            self.save_error(message='')
+        SQLBotLogUtil.info(f"Chat task cancelled by client, record id: {getattr(record, 'id', None)}")
+
+    def cancel_queued_task(self):
+        try:
+            self.on_task_cancelled()
+        except Exception as e:
+            SQLBotLogUtil.error(f"Cancel queued chat task failed: {e}")
+        finally:
+            self.close()
+
+    def cancel(self):
+        if self.cancel_event.is_set():
+            return
+        self.cancel_event.set()
+        if getattr(self, 'future', None) is not None and chat_task_scheduler.cancel(self.future):
+            # 任务仍在排队，移出队列后不会再执行，在后台标记记录并释放资源
+            context_executor.submit(self.cancel_queued_task)
+            return
+        # 取消正在执行的查询可能需要建立新连接（KILL QUERY），不阻塞事件循环
+        context_executor.submit(self.query_canceller.cancel)
+
+    def is_cancelled(self) -> bool:
+        return self.cancel_event.is_set()
 
     def run_task_async(self, in_chat: bool = True, stream: bool = True,
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         if in_chat:
             stream = True
-        self.future = executor.submit(self.run_task_cache, in_chat, stream, finish_step)
-
-    def run_task_cache(self, in_chat: bool = True, stream: bool = True,
-                       finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
-        for chunk in self.run_task(in_chat, stream, finish_step):
-            self.chunk_list.append(chunk)
+        self.submit_task(self.run_task, in_chat, stream, finish_step)
 
     def run_task(self, in_chat: bool = True, stream: bool = True,
                  finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         # 初始化返回结果
         json_result: Dict[str, Any] = {'success': True}
         try:
-            # 检查是否存在数据源
+            # 连接检查和会话改名在后台执行，连接检查与上下文准备并发，在调用 LLM 之前取结果
+            connection_future: Optional[Future] = None
             if self.ds:
-                # 获取数据源的OID和ID
-                oid = self.ds.oid if isinstance(self.ds, CoreDatasource) else 1
-                ds_id = self.ds.id if isinstance(self.ds, CoreDatasource) else None
-                # 获取术语模板
-                self.chat_question.terminologies = get_terminology_template(self.session, self.chat_question.question,
-                                                                            oid, ds_id)
-                # 获取训练模板
-                self.chat_question.data_training = get_training_template(self.session, self.chat_question.question,
-                                                                         ds_id, oid)
-                # 检查SQLBot许可证是否有效
-                if SQLBotLicenseUtil.valid():
-                    # 获取自定义提示
-                    self.chat_question.custom_prompt = find_custom_prompts(self.session, CustomPromptTypeEnum.GENERATE_SQL,
-                                                                       oid, ds_id)
-
-            # 初始化消息
-            self.init_messages()
+                connection_future = self.submit_context_step('check_connection', check_connection, None, self.ds)
+
+            brief = None
+            if self.change_title:
+                if self.chat_question.question and self.chat_question.question.strip():
+                    # 标题直接在本地计算，不等待改名结果
+                    brief = get_chat_brief(self.chat_question.question)
+                    self.submit_context_step('rename_chat', rename_chat,
+                                             RenameChat(id=self.get_record().chat_id, brief=brief), with_session=True)
+
+            # 并发获取术语、数据训练、自定义提示词并初始化消息
+            self.assemble_context()
 
             # return id
             if in_chat:
@@ -988,22 +1252,22 @@ class LLMService:
 
             # return title
             if self.change_title:
-                if self.chat_question.question or self.chat_question.question.strip() != '':
-                    brief = rename_chat(session=self.session,
-                                        rename_object=RenameChat(id=self.get_record().chat_id,
-                                                                 brief=self.chat_question.question.strip()[:20]))
+                if brief is not None:
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'brief', 'brief': brief}).decode() + '\n\n'
                     if not stream:
                         json_result['title'] = brief
 
-                # select datasource if datasource is none
+            # 已有数据源时，连接检查与上下文准备并发执行，数据源不可用时在调用 LLM 之前失败，不消耗 token
+            if connection_future is not None and not connection_future.result():
+                raise SQLBotDBConnectionError('Connect DB failed')
+
+            # select datasource if datasource is none
             # 如果数据源为空，选择数据源
             if not self.ds:
                 ds_res = self.select_datasource()
 
                 for chunk in ds_res:
-                    SQLBotLogUtil.info(chunk)
                     if in_chat:
                         yield 'data:' + orjson.dumps(
                             {'content': chunk.get('content'), 'reasoning_content': chunk.get('reasoning_content'),
@@ -1013,21 +1277,28 @@ class LLMService:
                                                   'engine_type': self.ds.type_name or self.ds.type,
                                                   'type': 'datasource'}).decode() + '\n\n'
 
+                connection_future = self.submit_context_step('check_connection', check_connection, None, self.ds)
                 # 获取数据库模式
                 self.chat_question.db_schema = self.out_ds_instance.get_db_schema(
                     self.ds.id) if self.out_ds_instance else get_table_schema(session=self.session,
                                                                               current_user=self.current_user,
                                                                               ds=self.ds,
-                                                                              question=self.chat_question.question)
+                                                                              question=self.chat_question.question,
+                                                                              token_budget=self.schema_token_budget)
+                if not connection_future.result():
+                    raise SQLBotDBConnectionError('Connect DB failed')
             else:
                 # 验证历史数据源
                 self.validate_history_ds()
 
-            # check connection
-            # 检查数据库连接
-            connected = check_connection(ds=self.ds, trans=None)
-            if not connected:
-                raise SQLBotDBConnectionError('Connect DB failed')
+            SQLBotLogUtil.info(f"Chat context ready for record {self.get_record().id}: {self.context_timings}")
+            if in_chat:
+                yield 'data:' + orjson.dumps(
+                    {'type': 'info', 'msg': 'context ready', 'timings': dict(self.context_timings)}).decode() + '\n\n'
+
+            # 问题 -> SQL 缓存
+            self.lookup_sql_cache()
+            llm_start = time.perf_counter()
 
             # generate sql
             # 生成SQL
@@ -1054,8 +1325,13 @@ class LLMService:
             dynamic_sql_result = None
             sqlbot_temp_sql_text = None
             assistant_dynamic_sql = None
+            sql_res_text = full_sql_text
             # todo row permission
-            if ((not self.current_assistant or is_page_embedded) and is_normal_user(
+            if self.sql_cache_hit:
+                # 缓存中保存的是已按当前权限过滤后的 SQL
+                sql_res_text = self.sql_cache_hit.get('sql')
+                sql = self.check_save_sql(res=sql_res_text)
+            elif ((not self.current_assistant or is_page_embedded) and is_normal_user(
                     self.current_user)) or use_dynamic_ds:
                 sql, tables = self.check_sql(res=full_sql_text)
                 sql_result = None
@@ -1070,6 +1346,7 @@ class LLMService:
 
                 if sql_result:
                     SQLBotLogUtil.info(sql_result)
+                    sql_res_text = sql_result
                     sql = self.check_save_sql(res=sql_result)
                 elif dynamic_sql_result and sqlbot_temp_sql_text:
                     assistant_dynamic_sql = self.check_save_sql(res=sqlbot_temp_sql_text)
@@ -1080,6 +1357,7 @@ class LLMService:
 
             # 记录SQL日志
             SQLBotLogUtil.info('sql: ' + sql)
+            sql_cost = time.perf_counter() - llm_start
 
             if not stream:
                 json_result['sql'] = sql
@@ -1100,6 +1378,8 @@ class LLMService:
                     assistant_dynamic_sql = assistant_dynamic_sql.replace(f'{dynamic_subsql_prefix}{origin_table}',
                                                                           subsql)
                 real_execute_sql = assistant_dynamic_sql
+            elif dynamic_sql_result and dynamic_sql_result.get('sqlbot_dynamic_sql'):
+                real_execute_sql = dynamic_sql_result.get('sqlbot_dynamic_sql')
 
             if finish_step.value <= ChatFinishStep.GENERATE_SQL.value:
                 if in_chat:
@@ -1116,6 +1396,7 @@ class LLMService:
                 json_result['data'] = result.get('data')
 
             if finish_step.value <= ChatFinishStep.QUERY_DATA.value:
+                self.save_sql_cache(sql_res_text, full_sql_text, None, chart_type, sql_cost)
                 if stream:
                     if in_chat:
                         yield 'data:' + orjson.dumps({'type': 'finish'}).decode() + '\n\n'
@@ -1143,6 +1424,7 @@ class LLMService:
                 return
 
             # generate chart
+            chart_start = time.perf_counter()
             chart_res = self.generate_chart(chart_type)
             full_chart_text = ''
             for chunk in chart_res:
@@ -1158,6 +1440,8 @@ class LLMService:
             SQLBotLogUtil.info(full_chart_text)
             chart = self.check_save_chart(res=full_chart_text)
             SQLBotLogUtil.info(chart)
+            self.save_sql_cache(sql_res_text, full_sql_text, full_chart_text, chart_type,
+                                sql_cost + time.perf_counter() - chart_start)
 
             if not stream:
                 json_result['chart'] = chart
@@ -1245,12 +1529,7 @@ class LLMService:
                        finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
         if in_chat:
             stream = True
-        self.future = executor.submit(self.execute_direct_sql_cache, in_chat, stream, finish_step)
-
-    def execute_direct_sql_cache(self, in_chat: bool = True, stream: bool = True,
-                       finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
-        for chunk in self.execute_direct_sql_task(in_chat, stream, finish_step):
-            self.chunk_list.append(chunk)
+        self.submit_task(self.execute_direct_sql_task, in_chat, stream, finish_step)
 
     def execute_direct_sql_task(self, in_chat: bool = True, stream: bool = True,
                                finish_step: ChatFinishStep = ChatFinishStep.GENERATE_CHART):
@@ -1342,7 +1621,8 @@ class LLMService:
                 'columns': [{'name': field, 'value': field} for field in result.get('fields', [])]
             }
 
-            save_chart(session=self.session, chart=orjson.dumps(chart).decode(), record_id=self.record.id)
+            save_chart(session=self.session, chart=orjson.dumps(chart).decode(), record_id=self.record.id,
+                       buffer=self.get_record_buffer())
 
             if not stream:
                 json_result['chart'] = chart
@@ -1428,7 +1708,8 @@ class LLMService:
 
             # 系统函数
             'pg_read_file', 'pg_ls_dir', 'pg_stat_file',
-            'system(', 'dblink_', 'pg_sleep',
+            'system(', 'dblink_', 'pg_sleep', 'query_to_xml', 'pg_terminate_backend', 'pg_cancel_backend',
+            'set_config', 'sleep(', 'benchmark(',
 
             # 事务和锁
             'begin', 'commit', 'rollback', 'savepoint', 'lock table',
@@ -1442,36 +1723,17 @@ class LLMService:
             # 其他
             'set ', 'reset ', 'explain', 'analyze'
         ]
+        # 先解析语法树校验，再做关键字校验（函数参数中的字符串同样可能被执行）；行数上限在执行时按方言自动加上
+        reason = check_read_only(sql, self.ds.type)
+        if reason:
+            raise SingleMessageError(reason)
         sql_lower = sql.lower()
         if any(keyword in sql_lower for keyword in ddl_keywords):
             raise SingleMessageError('Dangerous keywords are not allowed')
 
-        # Check for LIMIT clause
-        if 'limit' not in sql_lower:
-            raise SingleMessageError('SQL must include LIMIT clause with maximum 1000 rows')
-
-        # Parse LIMIT value
-        limit_index = sql_lower.find('limit')
-        if limit_index != -1:
-            # 使用正则匹配LIMIT后的数字（忽略大小写，允许任意非数字字符后）
-            limit_part = re.search(r'limit\s*(\d+)', sql_lower, flags=re.IGNORECASE)
-            if limit_part:
-                limit_value = int(limit_part.group(1))
-                if limit_value <= 0:
-                    raise SingleMessageError('LIMIT value must be a positive integer')
-                if limit_value > 1000:
-                    raise SingleMessageError('Maximum allowed LIMIT is 1000')
-            else:
-                raise SingleMessageError('Invalid LIMIT clause: unable to extract numeric value')
-        else:
-            raise SingleMessageError('Invalid LIMIT clause: unable to find LIMIT keyword')
-
     def run_recommend_questions_task_async(self):
-        self.future = executor.submit(self.run_recommend_questions_task_cache)
-
-    def run_recommend_questions_task_cache(self):
-        for chunk in self.run_recommend_questions_task():
-            self.chunk_list.append(chunk)
+        self.mark_record_cancelled = False
+        self.submit_task(self.run_recommend_questions_task)
 
     def run_recommend_questions_task(self):
         res = self.generate_recommend_questions_task()
@@ -1487,11 +1749,7 @@ class LLMService:
 
     def run_analysis_or_predict_task_async(self, action_type: str, base_record: ChatRecord):
         self.set_record(save_analysis_predict_record(self.session, base_record, action_type))
-        self.future = executor.submit(self.run_analysis_or_predict_task_cache, action_type)
-
-    def run_analysis_or_predict_task_cache(self, action_type: str):
-        for chunk in self.run_analysis_or_predict_task(action_type):
-            self.chunk_list.append(chunk)
+        self.submit_task(self.run_analysis_or_predict_task, action_type)
 
     def run_analysis_or_predict_task(self, action_type: str):
         try:
@@ -1639,6 +1897,64 @@ def process_stream(res: Iterator[BaseMessageChunk],
                    start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
                    end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
                    ):
+    return coalesce_chunks(parse_stream(res, token_usage, enable_tag_parsing, start_tag, end_tag))
+
+
+def coalesce_chunks(chunks: Iterator[Dict[str, str]], interval_ms: int = settings.SSE_COALESCE_INTERVAL_MS,
+                    max_chars: int = settings.SSE_COALESCE_MAX_CHARS) -> Iterator[Dict[str, str]]:
+    """
+    合并连续的同类分片（正文 / 思考过程），减少 SSE 帧数，interval_ms 为 0 时不合并。
+    距上次输出已超过 interval_ms 毫秒的分片立即输出（模型停顿后的首个分片不等待），
+    否则缓冲到超过 interval_ms、字符数超过 max_chars、分片类型变化或流结束时输出；
+    模型停顿时最多滞留停顿前 interval_ms 内到达的内容。
+    在调用方线程中同步读取上游，关闭时立即逐层关闭 LLM 流
+    """
+    if interval_ms <= 0:
+        yield from chunks
+        return
+    pending: Optional[Dict[str, str]] = None
+    pending_kind = None
+    last_flush: Optional[float] = None
+    try:
+        for chunk in chunks:
+            content = chunk.get('content') or ''
+            reasoning_content = chunk.get('reasoning_content') or ''
+            if not content and not reasoning_content:
+                continue
+            # 同时带正文和思考过程的分片（思考块结束处）不合并
+            kind = None if content and reasoning_content else ('content' if content else 'reasoning')
+            if pending is not None and kind != pending_kind:
+                yield pending
+                pending = None
+            if kind is None:
+                last_flush = time.monotonic()
+                yield {'content': content, 'reasoning_content': reasoning_content}
+                continue
+            if pending is None:
+                pending = {'content': '', 'reasoning_content': ''}
+                pending_kind = kind
+            pending['content'] += content
+            pending['reasoning_content'] += reasoning_content
+            now = time.monotonic()
+            if len(pending['content']) + len(pending['reasoning_content']) >= max_chars or \
+                    last_flush is None or (now - last_flush) * 1000 >= interval_ms:
+                last_flush = now
+                yield pending
+                pending = None
+        if pending is not None:
+            yield pending
+    finally:
+        # 提前结束时逐层关闭上游生成器（LLM 流）
+        chunks.close()
+
+
+def parse_stream(res: Iterator[BaseMessageChunk],
+                 token_usage: Dict[str, Any] = None,
+                 enable_tag_parsing: bool = settings.PARSE_REASONING_BLOCK_ENABLED,
+                 start_tag: str = settings.DEFAULT_REASONING_CONTENT_START,
+                 end_tag: str = settings.DEFAULT_REASONING_CONTENT_END
+                 ):
+    """逐个分片解析思考过程（reasoning_content 或 start_tag/end_tag 包裹的内容）并统计 token 用量"""
     if token_usage is None:
         token_usage = {}
     in_thinking_block = False  # 标记是否在思考过程块中
@@ -1646,7 +1962,6 @@ def process_stream(res: Iterator[BaseMessageChunk],
     pending_start_tag = ''  # 用于缓存可能被截断的开始标签部分
 
     for chunk in res:
-        SQLBotLogUtil.info(chunk)
         reasoning_content_chunk = ''
         content = chunk.content
         output_content = ''  # 实际要输出的内容
@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from common.core.config import settings
+from common.error import ChatTaskRejectedError
+from common.utils.utils import SQLBotLogUtil
+
+
+class _ChatJob:
+    def __init__(self, oid: int, user_id: int, fn: Callable, args: tuple):
+        self.oid = oid
+        self.user_id = user_id
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+        self.enqueue_time = time.monotonic()
+
+
+class ChatTaskScheduler:
+    """
+    对话任务的准入控制与公平调度
+
+    - 全局、每个工作空间(oid)、每个用户同时运行的任务数各自有上限
+    - 超出上限的任务按工作空间分队列排队，空出执行槽位时在各工作空间之间轮询取任务，避免单个空间占满执行器
+    - 排队总数有上限，队列已满时直接拒绝（ChatTaskRejectedError，接口层返回 429）
+    - 客户端在排队期间断开时调用 cancel 把任务移出队列
+    """
+
+    def __init__(self, max_running: int, max_per_oid: int, max_per_user: int, max_queue: int,
+                 retry_after: int):
+        self.max_running = max_running
+        self.max_per_oid = max_per_oid
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_running)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._running_oid: dict[int, int] = {}
+        self._running_user: dict[int, int] = {}
+        # oid -> pending jobs, iterated in round-robin order
+        self._queues: OrderedDict[int, deque[_ChatJob]] = OrderedDict()
+        self._queued = 0
+        self._rejected = 0
+        self._started = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, oid: Optional[int], user_id: Optional[int], fn: Callable, *args) -> Future:
+        job = _ChatJob(oid if oid is not None else 1, user_id if user_id is not None else -1, fn, args)
+        with self._lock:
+            if self._can_run(job):
+                self._start(job)
+            elif self._queued >= self.max_queue:
+                self._rejected += 1
+                SQLBotLogUtil.warning(
+                    f"Chat task rejected, oid: {job.oid}, user: {job.user_id}, queued: {self._queued}")
+                raise ChatTaskRejectedError(self.retry_after)
+            else:
+                self._queues.setdefault(job.oid, deque()).append(job)
+                self._queued += 1
+        return job.future
+
+    def cancel(self, future: Future) -> bool:
+        """
+        把仍在排队的任务移出队列并取消其 Future
+
+        :return: 任务已移出队列（不会再执行）时返回 True；任务已开始或已结束时返回 False
+        """
+        with self._lock:
+            for oid, queue in self._queues.items():
+                job = next((j for j in queue if j.future is future), None)
+                if job is None:
+                    continue
+                queue.remove(job)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[oid]
+                job.future.cancel()
+                return True
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": self._queued,
+                "rejected": self._rejected,
+                "started": self._started,
+                "running_by_oid": dict(self._running_oid),
+                "queued_by_oid": {oid: len(q) for oid, q in self._queues.items()},
+                "avg_queue_seconds": self._total_wait / self._started if self._started else 0.0,
+                "max_queue_seconds": self._max_wait,
+            }
+
+    def _can_run(self, job: _ChatJob) -> bool:
+        return (self._running < self.max_running
+                and self._running_oid.get(job.oid, 0) < self.max_per_oid
+                and self._running_user.get(job.user_id, 0) < self.max_per_user)
+
+    def _start(self, job: _ChatJob):
+        # called with self._lock held
+        wait = time.monotonic() - job.enqueue_time
+        self._started += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+        self._running += 1
+        self._running_oid[job.oid] = self._running_oid.get(job.oid, 0) + 1
+        self._running_user[job.user_id] = self._running_user.get(job.user_id, 0) + 1
+        if wait > 0.001:
+            SQLBotLogUtil.info(f"Chat task of oid {job.oid} started after {wait:.3f}s in queue")
+        self._executor.submit(self._run, job)
+
+    def _run(self, job: _ChatJob):
+        if not job.future.set_running_or_notify_cancel():
+            self._finish(job)
+            return
+        try:
+            job.future.set_result(job.fn(*job.args))
+        except BaseException as e:
+            job.future.set_exception(e)
+        finally:
+            self._finish(job)
+
+    def _finish(self, job: _ChatJob):
+        with self._lock:
+            self._running -= 1
+            self._release(self._running_oid, job.oid)
+            self._release(self._running_user, job.user_id)
+            self._dispatch()
+
+    @staticmethod
+    def _release(counter: dict[int, int], key: int):
+        count = counter.get(key, 0) - 1
+        if count > 0:
+            counter[key] = count
+        else:
+            counter.pop(key, None)
+
+    def _dispatch(self):
+        # called with self._lock held: walk the oid queues round-robin and start every job that fits
+        progressed = True
+        while progressed and self._queued > 0 and self._running < self.max_running:
+            progressed = False
+            for oid in list(self._queues.keys()):
+                queue = self._queues[oid]
+                job = next((j for j in queue if self._can_run(j)), None)
+                if job is None:
+                    continue
+                queue.remove(job)
+                self._queued -= 1
+                # move this oid to the back so the next free slot goes to another workspace
+                self._queues.move_to_end(oid)
+                if not queue:
+                    del self._queues[oid]
+                self._start(job)
+                progressed = True
+                if self._running >= self.max_running:
+                    break
+
+
+chat_task_scheduler = ChatTaskScheduler(max_running=settings.CHAT_TASK_MAX_RUNNING,
+                                        max_per_oid=settings.CHAT_TASK_MAX_PER_OID,
+                                        max_per_user=settings.CHAT_TASK_MAX_PER_USER,
+                                        max_queue=settings.CHAT_TASK_MAX_QUEUE,
+                                        retry_after=settings.CHAT_TASK_RETRY_AFTER)
@@ -0,0 +1,202 @@
+"""
+问题 -> SQL 缓存
+
+同一数据源下重复（或语义相近）的问题直接复用已经校验并执行成功的 SQL 与图表配置，跳过 LLM 调用。
+
+- scope：数据源 id + 数据源/工作空间版本号 + 用户权限指纹，表/字段备注、术语、数据训练变更时递增版本号使缓存整体失效
+- 精确匹配：scope + 归一化问题 + 上下文指纹（db_schema、术语、数据训练、自定义提示词、当天日期）。
+  提示词带有当前时间，"本月/今天/上周" 之类的问题生成的 SQL 里是当天的日期字面量，跨天不能复用
+- 相似匹配（默认关闭，SQL_CACHE_SIMILARITY < 1 时开启）：scope 下保存最近若干问题的向量，余弦相似度超过阈值，
+  且两个问题中的数字、日期、引号内的值和相对时间词完全一致时命中（"2023 年销售额" 与 "2024 年销售额" 向量很接近，但 SQL 不同）
+"""
+
+import hashlib
+import re
+import threading
+import time
+import traceback
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from apps.datasource.embedding.utils import cosine_similarity
+from common.core.config import settings
+from common.core.sqlbot_cache import SyncCache
+from common.utils.utils import SQLBotLogUtil
+
+sql_cache = SyncCache('sql', max_memory_bytes=settings.SQL_CACHE_MAX_MEMORY_MB * 1024 * 1024)
+
+_punctuation = re.compile(r'[\s,.!?;:，。！？；：、"\'“”‘’()（）]+')
+# 决定 SQL 条件取值的部分：引号内的值、数字/日期、中文数字、相对时间词
+_literal_patterns = re.compile(
+    r'"[^"]*"|\'[^\']*\'|“[^”]*”|‘[^’]*’|「[^」]*」|《[^》]*》'
+    r'|\d+(?:[.\-/:年月日号]\d+)*'
+    r'|[零〇一二两三四五六七八九十百千万亿]+'
+    r'|今天|昨天|前天|明天|今年|去年|前年|明年|本季度|上季度|本月|上月|上个月|下个月|本周|上周|下周|近|最近'
+    r'|\b(?:today|yesterday|tomorrow|this|last|next|previous|current)\b',
+    re.IGNORECASE)
+
+
+class _SqlCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.saved_seconds = 0.0
+
+    def hit(self, similar: bool, saved_seconds: float):
+        with self._lock:
+            if similar:
+                self.similar_hits += 1
+            else:
+                self.exact_hits += 1
+            self.saved_seconds += saved_seconds
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def store(self):
+        with self._lock:
+            self.stores += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "enabled": is_sql_cache_enabled(),
+                "lookups": lookups,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "storage": sql_cache.stats(),
+            }
+
+
+_stats = _SqlCacheStats()
+
+
+def is_sql_cache_enabled() -> bool:
+    return settings.SQL_CACHE_ENABLED and sql_cache.enabled
+
+
+def normalize_question(question: str) -> str:
+    return _punctuation.sub(' ', (question or '').strip().lower()).strip()
+
+
+def question_literals(question: str) -> List[str]:
+    return sorted(m.lower() for m in _literal_patterns.findall(question or ''))
+
+
+def _hash(*parts: Any) -> str:
+    md5 = hashlib.md5()
+    for part in parts:
+        md5.update(str(part if part is not None else '').encode('utf-8'))
+        md5.update(b'\x00')
+    return md5.hexdigest()
+
+
+def get_scope(ds_id: int, oid: int, permission_fingerprint: str) -> str:
+    return _hash(ds_id, sql_cache.get_version(f'ds:{ds_id}'), sql_cache.get_version(f'oid:{oid}'),
+                 permission_fingerprint)
+
+
+def get_context_fingerprint(engine: str, db_schema: str, terminologies: str, data_training: str,
+                            custom_prompt: str) -> str:
+    return _hash(engine, db_schema, terminologies, data_training, custom_prompt, date.today().isoformat())
+
+
+def _embed(question: str) -> Optional[List[float]]:
+    if not settings.EMBEDDING_ENABLED or settings.SQL_CACHE_SIMILARITY >= 1:
+        return None
+    try:
+        from apps.ai_model.embedding import EmbeddingModelCache
+        return EmbeddingModelCache.get_model().embed_query(question)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+def lookup(scope: str, question: str, context_fingerprint: str) -> Optional[Dict[str, Any]]:
+    """
+    查找缓存，返回 {'sql_answer', 'sql', 'chart_answer', 'chart_type', 'cost', 'similar'}，未命中返回 None
+    """
+    if not is_sql_cache_enabled():
+        return None
+    normalized = normalize_question(question)
+    entry = sql_cache.get_json(f'entry:{scope}:{_hash(normalized, context_fingerprint)}')
+    if entry:
+        _stats.hit(False, entry.get('cost', 0.0))
+        return {**entry, 'similar': False}
+
+    index: List[dict] = sql_cache.get_json(f'index:{scope}') or []
+    if index:
+        q_embedding = _embed(normalized)
+        if q_embedding:
+            best, best_score = None, 0.0
+            literals = question_literals(question)
+            for item in index:
+                if item.get('context') != context_fingerprint or question_literals(item.get('question')) != literals:
+                    continue
+                try:
+                    score = cosine_similarity(q_embedding, item.get('embedding'))
+                except ValueError:
+                    continue
+                if score > best_score:
+                    best, best_score = item, score
+            if best and best_score >= settings.SQL_CACHE_SIMILARITY:
+                entry = sql_cache.get_json(f'entry:{scope}:{best.get("key")}')
+                if entry:
+                    SQLBotLogUtil.info(
+                        f"SQL cache similar hit: '{question}' ~ '{best.get('question')}' ({best_score:.4f})")
+                    _stats.hit(True, entry.get('cost', 0.0))
+                    return {**entry, 'similar': True}
+    _stats.miss()
+    return None
+
+
+def store(scope: str, question: str, context_fingerprint: str, sql_answer: str, sql: str,
+          chart_answer: Optional[str], chart_type: Optional[str], cost: float):
+    if not is_sql_cache_enabled():
+        return
+    try:
+        normalized = normalize_question(question)
+        key = _hash(normalized, context_fingerprint)
+        expire = settings.SQL_CACHE_EXPIRE
+        sql_cache.set_json(f'entry:{scope}:{key}', {
+            'question': question,
+            'sql_answer': sql_answer,
+            'sql': sql,
+            'chart_answer': chart_answer,
+            'chart_type': chart_type,
+            'cost': cost,
+            'create_time': time.time(),
+        }, expire)
+
+        q_embedding = _embed(normalized)
+        if q_embedding:
+            index: List[dict] = sql_cache.get_json(f'index:{scope}') or []
+            index = [item for item in index if item.get('key') != key]
+            index.append({'key': key, 'question': question, 'context': context_fingerprint, 'embedding': q_embedding})
+            sql_cache.set_json(f'index:{scope}', index[-settings.SQL_CACHE_INDEX_SIZE:], expire)
+        _stats.store()
+    except Exception:
+        traceback.print_exc()
+
+
+def invalidate_datasource(ds_id: Optional[int]):
+    if ds_id is not None and sql_cache.enabled:
+        sql_cache.bump_version(f'ds:{ds_id}')
+
+
+def invalidate_workspace(oid: Optional[int]):
+    if sql_cache.enabled:
+        sql_cache.bump_version(f'oid:{oid if oid is not None else 1}')
+
+
+def get_sql_cache_stats() -> dict:
+    return _stats.to_dict()
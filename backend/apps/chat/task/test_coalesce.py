@@ -0,0 +1,52 @@
+import threading
+import time
+
+from apps.chat.task.llm import coalesce_chunks
+
+
+class TestCoalesceChunks:
+
+    def test_merge_burst(self):
+        """测试连续到达的同类分片合并输出，类型变化和流结束时输出缓冲内容"""
+        chunks = (c for c in [{'content': 'a'}, {'content': 'b'}, {'content': 'c'}, {'reasoning_content': 'r'}])
+        assert list(coalesce_chunks(chunks, interval_ms=10000)) == [
+            {'content': 'a', 'reasoning_content': ''},
+            {'content': 'bc', 'reasoning_content': ''},
+            {'content': '', 'reasoning_content': 'r'},
+        ]
+
+    def test_flush_after_pause(self):
+        """测试停顿超过间隔后到达的分片立即输出，不等待下一个分片"""
+
+        def upstream():
+            yield {'content': 'a'}
+            time.sleep(0.1)
+            yield {'content': 'b'}
+            time.sleep(5)
+            yield {'content': 'c'}
+
+        gen = coalesce_chunks(upstream(), interval_ms=50)
+        assert next(gen)['content'] == 'a'
+        started = time.monotonic()
+        assert next(gen)['content'] == 'b'
+        assert time.monotonic() - started < 1
+        gen.close()
+
+    def test_close_while_upstream_stalled(self):
+        """测试上游停顿时关闭，上游的 finally 立即执行（关闭 LLM 流）"""
+        closed = threading.Event()
+
+        def upstream():
+            try:
+                yield {'content': 'a'}
+                time.sleep(5)
+                yield {'content': 'b'}
+            finally:
+                closed.set()
+
+        gen = coalesce_chunks(upstream(), interval_ms=50)
+        next(gen)
+        started = time.monotonic()
+        gen.close()
+        assert closed.is_set()
+        assert time.monotonic() - started < 1
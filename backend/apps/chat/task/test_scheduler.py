@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from apps.chat.task.scheduler import ChatTaskScheduler
+from common.error import ChatTaskRejectedError
+
+
+class _Gate:
+    """阻塞任务直到 release，用于占住执行槽位"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self._release = threading.Event()
+
+    def __call__(self, value=None):
+        self.started.set()
+        self._release.wait(5)
+        return value
+
+    def release(self):
+        self._release.set()
+
+
+def _scheduler(max_running=1, max_per_oid=1, max_per_user=1, max_queue=10) -> ChatTaskScheduler:
+    return ChatTaskScheduler(max_running=max_running, max_per_oid=max_per_oid, max_per_user=max_per_user,
+                             max_queue=max_queue, retry_after=3)
+
+
+class TestChatTaskScheduler:
+
+    def test_run_immediately(self):
+        """测试未达上限时直接执行并返回结果"""
+        scheduler = _scheduler()
+        assert scheduler.submit(1, 1, lambda x: x * 2, 21).result(5) == 42
+        assert scheduler.stats()['started'] == 1
+
+    def test_per_user_cap(self):
+        """测试同一用户超过上限的任务排队，其他用户的任务不受影响"""
+        scheduler = _scheduler(max_running=4, max_per_oid=4, max_per_user=1)
+        gate = _Gate()
+        first = scheduler.submit(1, 1, gate)
+        assert gate.started.wait(5)
+        second = scheduler.submit(1, 1, lambda: 'second')
+        other = scheduler.submit(1, 2, lambda: 'other')
+        assert other.result(5) == 'other'
+        assert scheduler.stats()['queued'] == 1
+        gate.release()
+        first.result(5)
+        assert second.result(5) == 'second'
+
+    def test_round_robin_between_workspaces(self):
+        """测试空出槽位时在各工作空间之间轮询，不被先排队的工作空间占满"""
+        scheduler = _scheduler(max_running=1, max_per_oid=1, max_per_user=10)
+        gate = _Gate()
+        order = []
+        scheduler.submit(1, 1, gate)
+        assert gate.started.wait(5)
+        futures = [scheduler.submit(1, 1, order.append, 'oid1-a'),
+                   scheduler.submit(1, 1, order.append, 'oid1-b'),
+                   scheduler.submit(2, 2, order.append, 'oid2-a')]
+        gate.release()
+        for future in futures:
+            future.result(5)
+        assert order == ['oid1-a', 'oid2-a', 'oid1-b']
+
+    def test_reject_when_queue_full(self):
+        """测试排队已满时拒绝（接口层返回 429）"""
+        scheduler = _scheduler(max_queue=1)
+        gate = _Gate()
+        scheduler.submit(1, 1, gate)
+        assert gate.started.wait(5)
+        scheduler.submit(1, 1, lambda: None)
+        with pytest.raises(ChatTaskRejectedError) as e:
+            scheduler.submit(1, 1, lambda: None)
+        assert e.value.retry_after == 3
+        assert scheduler.stats()['rejected'] == 1
+        gate.release()
+
+    def test_cancel_queued(self):
+        """测试取消仍在排队的任务后不再执行，已开始的任务不能取消"""
+        scheduler = _scheduler()
+        gate = _Gate()
+        ran = []
+        running = scheduler.submit(1, 1, gate)
+        assert gate.started.wait(5)
+        queued = scheduler.submit(1, 1, ran.append, 'queued')
+        assert scheduler.cancel(queued)
+        assert not scheduler.cancel(running)
+        assert scheduler.stats()['queued'] == 0
+        gate.release()
+        running.result(5)
+        assert queued.cancelled()
+        assert ran == []
+
+    def test_exception(self):
+        """测试任务异常通过 Future 返回，并释放槽位"""
+        scheduler = _scheduler()
+
+        def fail():
+            raise ValueError('boom')
+
+        with pytest.raises(ValueError):
+            scheduler.submit(1, 1, fail).result(5)
+        assert scheduler.submit(1, 1, lambda: 'ok').result(5) == 'ok'
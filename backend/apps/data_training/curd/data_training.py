@@ -10,6 +10,7 @@ from sqlalchemy import text
 from sqlalchemy.orm.session import Session
 
 from apps.ai_model.embedding import EmbeddingModelCache
+from apps.chat.task.sql_cache import invalidate_datasource
 from apps.data_training.models.data_training_model import DataTrainingInfo, DataTraining
 from apps.datasource.models.datasource import CoreDatasource
 from apps.template.generate_chart.generator import get_base_data_training_template
@@ -110,6 +111,7 @@ def create_training(session: SessionDep, info: DataTrainingInfo, oid: int, trans
 
     # embedding
     run_save_data_training_embeddings([result.id])
+    invalidate_datasource(info.datasource)
 
     return result.id
 
@@ -142,14 +144,18 @@ def update_training(session: SessionDep, info: DataTrainingInfo, oid: int, trans
 
     # embedding
     run_save_data_training_embeddings([info.id])
+    invalidate_datasource(info.datasource)
 
     return info.id
 
 
 def delete_training(session: SessionDep, ids: list[int]):
+    datasource_ids = session.query(DataTraining.datasource).filter(DataTraining.id.in_(ids)).distinct().all()
     stmt = delete(DataTraining).where(and_(DataTraining.id.in_(ids)))
     session.execute(stmt)
     session.commit()
+    for (datasource_id,) in datasource_ids:
+        invalidate_datasource(datasource_id)
 
 
 # def run_save_embeddings(ids: List[int]):
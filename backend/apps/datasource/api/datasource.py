@@ -21,6 +21,7 @@ from sqlalchemy.types import Date, Text
 
 from apps.db.db import get_schema
 from apps.db.engine import get_engine_conn
+from apps.db.result_cache import invalidate_table_results
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
 from common.utils.utils import SQLBotLogUtil
@@ -1208,3 +1209,5 @@ def insert_pg(df, tableName, engine, mode: str = 'replace', preserve_columns: bo
     finally:
         cursor.close()
         conn.close()
+        # 表数据已变化，清理引用该表的查询结果缓存
+        invalidate_table_results(tableName)
@@ -1,18 +1,24 @@
 import datetime
 import json
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from fastapi import HTTPException
 from sqlalchemy import and_, text
-from sqlbot_xpack.permissions.models.ds_rules import DsRules
 from sqlmodel import select
 
-from apps.datasource.crud.permission import get_column_permission_fields, get_row_permission_filters, is_normal_user
+from apps.chat.task.sql_cache import invalidate_datasource
+from apps.datasource.crud.permission import get_column_permission_fields, get_row_permission_filters, is_normal_user, \
+    get_permission_fingerprint, get_permission_index
+from apps.datasource.crud.schema_cache import is_schema_cache_enabled, get_schema_key, load_schema_tables, \
+    save_schema_tables, invalidate_schema
+from apps.datasource.embedding.schema_budget import build_budgeted_schema, render_table_schema
 from apps.datasource.embedding.table_embedding import get_table_embedding
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB
 from apps.db.db import get_tables, get_fields, exec_sql, check_connection
 from apps.db.engine import get_engine_config, get_engine_conn
+from apps.db.pool import engine_registry, connection_pool_registry
+from apps.db.result_cache import invalidate_datasource_results
 from common.core.config import settings
 from common.core.deps import SessionDep, CurrentUser, Trans
 from common.utils.utils import deepcopy_ignore_extra
@@ -104,6 +110,11 @@ def update_ds(session: SessionDep, trans: Trans, user: CurrentUser, ds: CoreData
         setattr(record, field, value)
     session.add(record)
     session.commit()
+    invalidate_datasource(ds.id)
+    invalidate_datasource_results(ds.id)
+    invalidate_schema(ds.id)
+    engine_registry.dispose(f'ds:{ds.id}')
+    connection_pool_registry.dispose(f'ds:{ds.id}')
     return ds
 
 
@@ -148,6 +159,11 @@ def delete_ds(session: SessionDep, id: int):
     session.commit()
     delete_table_by_ds_id(session, id)
     delete_field_by_ds_id(session, id)
+    invalidate_datasource(id)
+    invalidate_datasource_results(id)
+    invalidate_schema(id)
+    engine_registry.dispose(f'ds:{id}')
+    connection_pool_registry.dispose(f'ds:{id}')
     return {
         "message": f"Datasource with ID {id} deleted successfully."
     }
@@ -219,6 +235,8 @@ def sync_table(session: SessionDep, ds: CoreDatasource, tables: List[CoreTable])
         session.query(CoreTable).filter(CoreTable.ds_id == ds.id).delete(synchronize_session=False)
         session.query(CoreField).filter(CoreField.ds_id == ds.id).delete(synchronize_session=False)
         session.commit()
+    invalidate_datasource(ds.id)
+    invalidate_schema(ds.id)
 
 
 def sync_fields(session: SessionDep, ds: CoreDatasource, table: CoreTable, fields: List[ColumnSchema]):
@@ -251,6 +269,7 @@ def sync_fields(session: SessionDep, ds: CoreDatasource, table: CoreTable, field
         session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.id.not_in(id_list))).delete(
             synchronize_session=False)
         session.commit()
+    invalidate_schema(ds.id)
 
 
 def update_table_and_fields(session: SessionDep, data: TableObj):
@@ -278,9 +297,8 @@ def preview(session: SessionDep, current_user: CurrentUser, id: int, data: Table
     f_list = [f for f in data.fields if f.checked]
     if is_normal_user(current_user):
         # column is checked, and, column permission for data.fields
-        contain_rules = session.query(DsRules).all()
         f_list = get_column_permission_fields(session=session, current_user=current_user, table=data.table,
-                                              fields=f_list, contain_rules=contain_rules)
+                                              fields=f_list)
 
         # row permission tree
         where_str = ''
@@ -378,52 +396,53 @@ def get_table_obj_by_ds(session: SessionDep, current_user: CurrentUser, ds: Core
         else:
             fields_dict[field.table_id] = [field]
 
-    contain_rules = session.query(DsRules).all()
+    permission_index = get_permission_index(session, current_user) if is_normal_user(current_user) else None
     for table in tables:
         # fields = session.query(CoreField).filter(and_(CoreField.table_id == table.id, CoreField.checked == True)).all()
         fields = fields_dict.get(table.id)
 
         # do column permissions, filter fields
         fields = get_column_permission_fields(session=session, current_user=current_user, table=table, fields=fields,
-                                              contain_rules=contain_rules)
+                                              index=permission_index)
         _list.append(TableAndFields(schema=schema, table=table, fields=fields))
     return _list
 
 
+def get_schema_tables(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource) -> Tuple[
+    List[TableAndFields], List[str]]:
+    """
+    列权限过滤后的表与字段，以及各表的 M-Schema 文本，优先从 schema 缓存读取
+    """
+    key = None
+    if is_schema_cache_enabled():
+        key = get_schema_key(ds.id, get_permission_fingerprint(session, current_user, ds, 'column'))
+        cached = load_schema_tables(key)
+        if cached is not None:
+            return cached
+    table_objs = get_table_obj_by_ds(session=session, current_user=current_user, ds=ds)
+    db_name = table_objs[0].schema if table_objs else None
+    schema_tables = [render_table_schema(ds, db_name, obj.table, obj.fields) for obj in table_objs]
+    if key is not None:
+        save_schema_tables(key, table_objs, schema_tables)
+    return table_objs, schema_tables
+
+
 def get_table_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource, question: str,
-                     embedding: bool = True) -> str:
+                     embedding: bool = True, token_budget: int = 0) -> str:
+    """
+    :param token_budget: 大于 0 时按与问题的相关度裁剪表和字段，使 schema 不超过该 token 数
+    """
     schema_str = ""
-    table_objs = get_table_obj_by_ds(session=session, current_user=current_user, ds=ds)
+    table_objs, schema_tables = get_schema_tables(session=session, current_user=current_user, ds=ds)
     if len(table_objs) == 0:
         return schema_str
+    if token_budget > 0:
+        return build_budgeted_schema(session, current_user, ds, table_objs, question, token_budget, embedding)
     db_name = table_objs[0].schema
     schema_str += f"【DB_ID】 {db_name}\n【Schema】\n"
     tables = []
     all_tables = []  # temp save all tables
-    for obj in table_objs:
-        schema_table = ''
-        schema_table += f"# Table: {db_name}.{obj.table.table_name}" if ds.type != "mysql" and ds.type != "es" else f"# Table: {obj.table.table_name}"
-        table_comment = ''
-        if obj.table.custom_comment:
-            table_comment = obj.table.custom_comment.strip()
-        if table_comment == '':
-            schema_table += '\n[\n'
-        else:
-            schema_table += f", {table_comment}\n[\n"
-
-        if obj.fields:
-            field_list = []
-            for field in obj.fields:
-                field_comment = ''
-                if field.custom_comment:
-                    field_comment = field.custom_comment.strip()
-                if field_comment == '':
-                    field_list.append(f"({field.field_name}:{field.field_type})")
-                else:
-                    field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
-            schema_table += ",\n".join(field_list)
-        schema_table += '\n]\n'
-
+    for obj, schema_table in zip(table_objs, schema_tables):
         t_obj = {"id": obj.table.id, "schema_table": schema_table}
         tables.append(t_obj)
         all_tables.append(t_obj)
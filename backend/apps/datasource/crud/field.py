@@ -1,3 +1,5 @@
+from apps.chat.task.sql_cache import invalidate_datasource
+from apps.datasource.crud.schema_cache import invalidate_schema
 from common.core.deps import SessionDep
 from ..models.datasource import CoreField
 
@@ -17,3 +19,5 @@ def update_field(session: SessionDep, item: CoreField):
     record.custom_comment = item.custom_comment
     session.add(record)
     session.commit()
+    invalidate_datasource(record.ds_id)
+    invalidate_schema(record.ds_id)
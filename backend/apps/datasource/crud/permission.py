@@ -1,14 +1,119 @@
+import hashlib
 import json
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from sqlalchemy import and_
+from sqlalchemy import and_, event
+from sqlalchemy.orm import Session, object_session
 from sqlbot_xpack.permissions.api.permission import transRecord2DTO
-from sqlbot_xpack.permissions.models.ds_permission import DsPermission, PermissionDTO
+from sqlbot_xpack.permissions.models.ds_permission import DsPermission
 from sqlbot_xpack.permissions.models.ds_rules import DsRules
 
-from apps.datasource.crud.row_permission import transFilterTree
+from apps.datasource.crud.row_permission import load_tree_fields, transTreeToWhere
+from apps.datasource.crud.schema_cache import get_metadata_version
 from apps.datasource.models.datasource import CoreDatasource, CoreField, CoreTable
+from common.core.config import settings
 from common.core.deps import CurrentUser, SessionDep
+from common.core.sqlbot_cache import SyncCache
+from common.utils.utils import SQLBotLogUtil
+
+# 权限索引：用户 -> 表 -> (行权限条件树, 列权限屏蔽字段)
+# 规则组或权限变更并提交后递增版本号，各用户的索引在下次使用时重新编译一次并放入共享缓存（CACHE_TYPE），
+# 提问时按表直接查找，不再逐表查询 DsPermission、逐条解析规则组的 permission_list / user_list
+permission_cache = SyncCache('permission', max_memory_bytes=settings.PERMISSION_INDEX_MAX_MEMORY_MB * 1024 * 1024)
+
+_changed_flag = 'sqlbot_permission_changed'
+
+
+def _parse_list(value) -> Optional[list]:
+    try:
+        return json.loads(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _build_permission_index(session: SessionDep, user_id: int) -> Dict[str, dict]:
+    # permissions in same rules with user
+    permission_ids = set()
+    for r in session.query(DsRules).all():
+        p_list = _parse_list(r.permission_list)
+        u_list = _parse_list(r.user_list)
+        if p_list is not None and u_list is not None and (user_id in u_list or f'{user_id}' in u_list):
+            permission_ids.update(p for p in p_list if isinstance(p, int))
+
+    index: Dict[str, dict] = {}
+    if not permission_ids:
+        return index
+    permissions = session.query(DsPermission).filter(DsPermission.id.in_(list(permission_ids))).order_by(
+        DsPermission.id).all()
+    for permission in permissions:
+        if permission.type not in ('row', 'column'):
+            continue
+        entry = index.setdefault(str(permission.table_id), {'row': [], 'column': []})
+        if permission.type == 'row':
+            entry['row'].append({'id': permission.id, 'tree': transRecord2DTO(session, permission).tree})
+        else:
+            disabled = [b['field_id'] for b in (_parse_list(permission.permissions) or []) if not b['enable']]
+            entry['column'].append({'id': permission.id, 'disabled': disabled})
+    return index
+
+
+def _index_expire() -> int:
+    return permission_cache.shared_expire(settings.PERMISSION_INDEX_EXPIRE, settings.PERMISSION_INDEX_MEMORY_EXPIRE)
+
+
+def get_permission_index(session: SessionDep, current_user: CurrentUser) -> Dict[str, dict]:
+    """
+    :return: {str(table_id): {'row': [{'id', 'tree'}], 'column': [{'id', 'disabled': [field_id]}]}}，
+             只包含对该用户生效的权限
+    """
+    if not permission_cache.enabled:
+        return _build_permission_index(session, current_user.id)
+    key = f'index:{permission_cache.get_version("rules")}:{current_user.id}'
+    index = permission_cache.get_json(key)
+    if index is None:
+        index = _build_permission_index(session, current_user.id)
+        try:
+            permission_cache.set_json(key, index, _index_expire())
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Cache permission index of user {current_user.id} failed: {e}")
+    return index
+
+
+def invalidate_permission_index():
+    if permission_cache.enabled:
+        permission_cache.bump_version('rules')
+
+
+def _mark_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[_changed_flag] = True
+
+
+for _model in (DsRules, DsPermission):
+    for _identifier in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _identifier, _mark_changed)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _on_orm_execute(orm_execute_state):
+    # session.execute(insert(...)) and query(...).update() / delete() do not trigger mapper events
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (DsRules, DsPermission):
+            orm_execute_state.session.info[_changed_flag] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _on_commit(session):
+    # bump after commit, otherwise other workers may rebuild the index from uncommitted data
+    if session.info.pop(_changed_flag, False):
+        invalidate_permission_index()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop(_changed_flag, None)
 
 
 def get_row_permission_filters(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource,
@@ -22,64 +127,93 @@ def get_row_permission_filters(session: SessionDep, current_user: CurrentUser, d
 
     filters = []
     if is_normal_user(current_user):
-        contain_rules = session.query(DsRules).all()
+        index = get_permission_index(session, current_user)
+        row_permissions = {}
+        for table in table_list:
+            entry = index.get(str(table.id))
+            row_permissions[table.id] = entry.get('row') if entry else []
+        compiled = compile_row_permissions(session, ds, [p for items in row_permissions.values() for p in items])
         for table in table_list:
-            row_permissions = session.query(DsPermission).filter(
-                and_(DsPermission.table_id == table.id, DsPermission.type == 'row')).all()
-            res: List[PermissionDTO] = []
-            if row_permissions is not None:
-                for permission in row_permissions:
-                    # check permission and user in same rules
-                    flag = False
-                    for r in contain_rules:
-                        p_list = json.loads(r.permission_list)
-                        u_list = json.loads(r.user_list)
-                        if p_list is not None and u_list is not None and permission.id in p_list and (
-                                current_user.id in u_list or f'{current_user.id}' in u_list):
-                            flag = True
-                            break
-                    if flag:
-                        res.append(transRecord2DTO(session, permission))
-            where_str = transFilterTree(session, res, ds)
-            filters.append({"table": table.table_name, "filter": where_str})
+            res = [compiled.get(p.get('id')) for p in row_permissions[table.id] if compiled.get(p.get('id'))]
+            filters.append({"table": table.table_name, "filter": " AND ".join(res)})
     return filters
 
 
+def compile_row_permissions(session: SessionDep, ds: CoreDatasource, permissions: List[dict]) -> Dict[int, str]:
+    """
+    把行权限条件树编译为该数据源方言的 WHERE 条件，引用的字段一次查询加载；
+    结果按 权限版本号 + 数据源元数据版本号 缓存（字段改名、权限变化后重新编译）
+
+    :param permissions: 权限索引中的 [{'id', 'tree'}]
+    :return: {permission id: 条件}，条件为空的不返回
+    """
+    compiled: Dict[int, str] = {}
+    if not permissions:
+        return compiled
+    prefix = f'row:{permission_cache.get_version("rules")}:{ds.id}:{get_metadata_version(ds.id)}'
+    missing = []
+    for permission in permissions:
+        if permission.get('id') in compiled:
+            continue
+        cached = permission_cache.get_json(f'{prefix}:{permission.get("id")}') if permission_cache.enabled else None
+        if cached is not None:
+            if cached:
+                compiled[permission.get('id')] = cached
+        else:
+            missing.append(permission)
+    if missing:
+        fields = load_tree_fields(session, [p.get('tree') for p in missing])
+        for permission in missing:
+            where = transTreeToWhere(session, permission.get('tree'), ds, fields) or ''
+            if where:
+                compiled[permission.get('id')] = where
+            if permission_cache.enabled:
+                permission_cache.set_json(f'{prefix}:{permission.get("id")}', where, _index_expire())
+    return compiled
+
+
 def get_column_permission_fields(session: SessionDep, current_user: CurrentUser, table: CoreTable,
-                                 fields: list[CoreField], contain_rules: list[DsRules]):
+                                 fields: list[CoreField], index: Optional[Dict[str, dict]] = None):
+    """
+    :param index: get_permission_index 的结果，逐表调用时由调用方获取一次后传入
+    """
     if is_normal_user(current_user):
-        column_permissions = session.query(DsPermission).filter(
-            and_(DsPermission.table_id == table.id, DsPermission.type == 'column')).all()
-        if column_permissions is not None:
-            for permission in column_permissions:
-                # check permission and user in same rules
-                # obj = session.query(DsRules).filter(
-                #     and_(DsRules.permission_list.op('@>')(cast([permission.id], JSONB)),
-                #          or_(DsRules.user_list.op('@>')(cast([f'{current_user.id}'], JSONB)),
-                #              DsRules.user_list.op('@>')(cast([current_user.id], JSONB))))
-                # ).first()
-                flag = False
-                for r in contain_rules:
-                    p_list = json.loads(r.permission_list)
-                    u_list = json.loads(r.user_list)
-                    if p_list is not None and u_list is not None and permission.id in p_list and (
-                            current_user.id in u_list or f'{current_user.id}' in u_list):
-                        flag = True
-                        break
-                if flag:
-                    permission_list = json.loads(permission.permissions)
-                    fields = filter_list(fields, permission_list)
+        if index is None:
+            index = get_permission_index(session, current_user)
+        entry = index.get(str(table.id))
+        if entry and entry.get('column') and fields is not None:
+            disabled = set()
+            for permission in entry.get('column'):
+                disabled.update(permission.get('disabled'))
+            fields = [f for f in fields if f.id not in disabled]
     return fields
 
 
-def is_normal_user(current_user: CurrentUser):
-    return current_user.id != 1
+def get_permission_fingerprint(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource,
+                               permission_type: Optional[str] = None) -> str:
+    """
+    当前用户在该数据源上生效的行/列权限指纹，用于区分按权限生成的缓存
 
+    :param permission_type: 'row' / 'column'，只计算该类型的权限，None 为全部
+    """
+    if not is_normal_user(current_user):
+        return 'admin'
+    index = get_permission_index(session, current_user)
+    if not index:
+        return hashlib.md5(b'').hexdigest()
+    table_ids = sorted(t.id for t in session.query(CoreTable.id).filter(CoreTable.ds_id == ds.id).all())
+    parts = []
+    for table_id in table_ids:
+        entry = index.get(str(table_id))
+        if not entry:
+            continue
+        for t in ('row', 'column'):
+            if permission_type and t != permission_type:
+                continue
+            for permission in entry.get(t):
+                parts.append(f'{table_id}:{t}:{json.dumps(permission, sort_keys=True, default=str)}')
+    return hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
 
-def filter_list(list_a, list_b):
-    id_to_invalid = {}
-    for b in list_b:
-        if not b['enable']:
-            id_to_invalid[b['field_id']] = True
 
-    return [a for a in list_a if not id_to_invalid.get(a.id, False)]
+def is_normal_user(current_user: CurrentUser):
+    return current_user.id != 1
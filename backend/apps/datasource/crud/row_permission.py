@@ -1,29 +1,60 @@
 # Author: Junjun
 # Date: 2025/6/25
 
-from typing import List, Dict
+from typing import List, Dict, Optional
 from apps.datasource.models.datasource import CoreField, CoreDatasource
 from apps.db.constant import DB
 from common.core.deps import SessionDep
 
+# 字符串字面量中反斜杠也是转义符的数据源
+_backslash_escape_types = {'mysql', 'doris', 'ck'}
+_national_types = {'nchar', 'nvarchar'}
 
-def transFilterTree(session: SessionDep, tree_list: List[any], ds: CoreDatasource) -> str | None:
+
+def collect_field_ids(tree: any, ids: set) -> set:
+    if tree is None:
+        return ids
+    for item in tree.get('items') or []:
+        if item['type'] == 'item':
+            ids.add(int(item['field_id']))
+        elif item['type'] == 'tree':
+            collect_field_ids(item['sub_tree'], ids)
+    return ids
+
+
+def load_tree_fields(session: SessionDep, trees: List[any]) -> Dict[int, CoreField]:
+    """一次查询出条件树中引用的全部字段"""
+    ids = set()
+    for tree in trees:
+        collect_field_ids(tree, ids)
+    if not ids:
+        return {}
+    return {field.id: field for field in session.query(CoreField).filter(CoreField.id.in_(list(ids))).all()}
+
+
+def transFilterTree(session: SessionDep, tree_list: List[any], ds: CoreDatasource,
+                    fields: Optional[Dict[int, CoreField]] = None) -> str | None:
     if tree_list is None:
         return None
+    if fields is None:
+        fields = load_tree_fields(session, [dto.tree for dto in tree_list])
     res: List[str] = []
     for dto in tree_list:
         tree = dto.tree
         if tree is None:
             continue
-        tree_exp = transTreeToWhere(session, tree, ds)
+        tree_exp = transTreeToWhere(session, tree, ds, fields)
         if tree_exp is not None:
             res.append(tree_exp)
     return " AND ".join(res)
 
 
-def transTreeToWhere(session: SessionDep, tree: any, ds: CoreDatasource) -> str | None:
+def transTreeToWhere(session: SessionDep, tree: any, ds: CoreDatasource,
+                     fields: Optional[Dict[int, CoreField]] = None) -> str | None:
     if tree is None:
         return None
+    if fields is None:
+        fields = load_tree_fields(session, [tree])
     logic = tree['logic']
 
     items = tree['items']
@@ -32,30 +63,44 @@ def transTreeToWhere(session: SessionDep, tree: any, ds: CoreDatasource) -> str
         for item in items:
             exp: str = None
             if item['type'] == 'item':
-                exp = transTreeItem(session, item, ds)
+                exp = transTreeItem(session, item, ds, fields)
             elif item['type'] == 'tree':
-                exp = transTreeToWhere(session, item['sub_tree'], ds)
+                exp = transTreeToWhere(session, item['sub_tree'], ds, fields)
 
             if exp is not None:
                 list.append(exp)
     return '(' + f' {logic} '.join(list) + ')' if len(list) > 0 else None
 
 
-def transTreeItem(session: SessionDep, item: Dict, ds: CoreDatasource) -> str | None:
+def quote_identifier(ds_type: str, name: str) -> str:
+    db = DB.get_db(ds_type)
+    return db.prefix + name.replace(db.suffix, db.suffix * 2) + db.suffix
+
+
+def quote_literal(ds_type: str, field: CoreField, value: any) -> str:
+    """按数据源方言生成字符串字面量，转义其中的引号（及反斜杠），sqlServer 的 nchar/nvarchar 字段加 N 前缀"""
+    value = str(value)
+    if ds_type in _backslash_escape_types:
+        value = value.replace('\\', '\\\\')
+    value = value.replace("'", "''")
+    national = ds_type == 'sqlServer' and (field.field_type or '').lower() in _national_types
+    return f"{'N' if national else ''}'{value}'"
+
+
+def transTreeItem(session: SessionDep, item: Dict, ds: CoreDatasource,
+                  fields: Optional[Dict[int, CoreField]] = None) -> str | None:
     res: str = None
-    field = session.query(CoreField).filter(CoreField.id == int(item['field_id'])).first()
+    if fields is not None:
+        field = fields.get(int(item['field_id']))
+    else:
+        field = session.query(CoreField).filter(CoreField.id == int(item['field_id'])).first()
     if field is None:
         return None
 
-    db = DB.get_db(ds.type)
-    whereName = db.prefix + field.field_name + db.suffix
+    whereName = quote_identifier(ds.type, field.field_name)
     if item['filter_type'] == 'enum':
         if len(item['enum_value']) > 0:
-            if ds['type'] == 'sqlServer' and (
-                    field.field_type == 'nchar' or field.field_type == 'NCHAR' or field.field_type == 'nvarchar' or field.field_type == 'NVARCHAR'):
-                res = "(" + whereName + " IN (N'" + "',N'".join(item['enum_value']) + "'))"
-            else:
-                res = "(" + whereName + " IN ('" + "','".join(item['enum_value']) + "'))"
+            res = "(" + whereName + " IN (" + ",".join(quote_literal(ds.type, field, v) for v in item['enum_value']) + "))"
     else:
         value = item['value']
         whereTerm = transFilterTerm(item['term'])
@@ -70,23 +115,11 @@ def transTreeItem(session: SessionDep, item: Dict, ds: CoreDatasource) -> str |
         elif item['term'] == 'not_empty':
             whereValue = "''"
         elif item['term'] == 'in' or item['term'] == 'not in':
-            if ds.type == 'sqlServer' and (
-                    field.field_type == 'nchar' or field.field_type == 'NCHAR' or field.field_type == 'nvarchar' or field.field_type == 'NVARCHAR'):
-                whereValue = "(N'" + "', N'".join(value.split(",")) + "')"
-            else:
-                whereValue = "('" + "', '".join(value.split(",")) + "')"
+            whereValue = "(" + ", ".join(quote_literal(ds.type, field, v) for v in value.split(",")) + ")"
         elif item['term'] == 'like' or item['term'] == 'not like':
-            if ds.type == 'sqlServer' and (
-                    field.field_type == 'nchar' or field.field_type == 'NCHAR' or field.field_type == 'nvarchar' or field.field_type == 'NVARCHAR'):
-                whereValue = f"N'%{value}%'"
-            else:
-                whereValue = f"'%{value}%'"
+            whereValue = quote_literal(ds.type, field, f"%{value}%")
         else:
-            if ds.type == 'sqlServer' and (
-                    field.field_type == 'nchar' or field.field_type == 'NCHAR' or field.field_type == 'nvarchar' or field.field_type == 'NVARCHAR'):
-                whereValue = f"N'{value}'"
-            else:
-                whereValue = f"'{value}'"
+            whereValue = quote_literal(ds.type, field, value)
 
         res = whereName + whereTerm + whereValue
     return res
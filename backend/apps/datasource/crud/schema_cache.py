@@ -0,0 +1,70 @@
+"""
+数据源 schema 缓存
+
+每次提问生成 schema 都要查询 CoreTable / CoreField、按列权限过滤字段并拼接各表的 M-Schema，而元数据很少变化。
+这里缓存列权限过滤后的表、字段及各表的 M-Schema 文本，与 CACHE_TYPE 一致（redis 时所有 worker 共享）。
+memory 时版本号只在本进程递增，其他进程只能等条目过期，过期时间取 SCHEMA_CACHE_MEMORY_EXPIRE。
+
+键：数据源 id + 元数据版本号 + 列权限指纹。同步表/字段、修改表/字段的勾选和备注、修改/删除数据源时递增版本号；
+权限规则变化会改变列权限指纹，不需要显式失效。
+"""
+
+from typing import List, Optional, Tuple
+
+from apps.datasource.models.datasource import CoreField, CoreTable, TableAndFields
+from common.core.config import settings
+from common.core.sqlbot_cache import SyncCache
+from common.utils.utils import SQLBotLogUtil
+
+schema_cache = SyncCache('schema', max_memory_bytes=settings.SCHEMA_CACHE_MAX_MEMORY_MB * 1024 * 1024)
+
+
+def is_schema_cache_enabled() -> bool:
+    return settings.SCHEMA_CACHE_ENABLED and schema_cache.enabled
+
+
+def get_metadata_version(ds_id: int) -> int:
+    return schema_cache.get_version(f'ds:{ds_id}')
+
+
+def get_schema_key(ds_id: int, permission_fingerprint: str) -> str:
+    """在读取元数据之前获取，避免读取期间版本号变化后把旧数据写到新版本号下"""
+    return f'{ds_id}:{get_metadata_version(ds_id)}:{permission_fingerprint}'
+
+
+def load_schema_tables(key: str) -> Optional[Tuple[List[TableAndFields], List[str]]]:
+    """
+    :return: (表与字段, 各表的 M-Schema 文本)，未命中返回 None
+    """
+    cached = schema_cache.get_json(key)
+    if cached is None:
+        return None
+    try:
+        table_objs = []
+        for item in cached.get('tables'):
+            fields = item.get('fields')
+            table_objs.append(TableAndFields(schema=cached.get('schema'), table=CoreTable(**item.get('table')),
+                                             fields=[CoreField(**f) for f in fields] if fields is not None else None))
+        return table_objs, cached.get('schema_tables')
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Load cached schema {key} failed: {e}")
+        return None
+
+
+def save_schema_tables(key: str, table_objs: List[TableAndFields], schema_tables: List[str]):
+    try:
+        schema_cache.set_json(key, {
+            'schema': table_objs[0].schema if table_objs else None,
+            'tables': [{
+                'table': obj.table.model_dump(),
+                'fields': [f.model_dump() for f in obj.fields] if obj.fields is not None else None,
+            } for obj in table_objs],
+            'schema_tables': schema_tables,
+        }, schema_cache.shared_expire(settings.SCHEMA_CACHE_EXPIRE, settings.SCHEMA_CACHE_MEMORY_EXPIRE))
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Cache schema {key} failed: {e}")
+
+
+def invalidate_schema(ds_id: Optional[int]):
+    if ds_id is not None and schema_cache.enabled:
+        schema_cache.bump_version(f'ds:{ds_id}')
@@ -1,3 +1,5 @@
+from apps.chat.task.sql_cache import invalidate_datasource
+from apps.datasource.crud.schema_cache import invalidate_schema
 from common.core.deps import SessionDep
 from ..models.datasource import CoreDatasource, CreateDatasource, CoreTable, CoreField, ColumnSchema
 from sqlalchemy import and_
@@ -19,3 +21,5 @@ def update_table(session: SessionDep, item: CoreTable):
     record.custom_comment = item.custom_comment
     session.add(record)
     session.commit()
+    invalidate_datasource(record.ds_id)
+    invalidate_schema(record.ds_id)
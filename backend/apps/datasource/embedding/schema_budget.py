@@ -0,0 +1,193 @@
+"""
+按 token 预算裁剪 M-Schema
+
+表和字段按与问题的相关度排序（字面匹配 + 表向量相似度 + 外键关联），在预算内依次加入：
+1. 相关的表（及其外键关联的表，保证 JOIN 路径完整）先加入键字段（关联关系中的字段、id / *_id）和相关字段
+2. 预算有剩余时按表的相关度补全其余字段
+3. 仍有剩余时加入其他表的部分字段
+字段按原有顺序输出
+"""
+
+import math
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from apps.datasource.embedding.table_embedding import get_table_embedding
+from apps.datasource.models.datasource import CoreDatasource, CoreField, CoreTable, TableAndFields
+from common.core.config import settings
+from common.core.deps import CurrentUser, SessionDep
+
+_word = re.compile(r'[a-z0-9]+')
+_cjk = re.compile(r'[一-鿿]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文每字约 1 个 token，其余约 3.5 个字符 1 个 token"""
+    if not text:
+        return 0
+    cjk = len(_cjk.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 3.5)
+
+
+def _terms(text: Optional[str]) -> Set[str]:
+    if not text:
+        return set()
+    text = text.lower()
+    terms = {w for w in _word.findall(text.replace('_', ' ')) if len(w) > 1}
+    chars = _cjk.findall(text)
+    terms.update(chars[i] + chars[i + 1] for i in range(len(chars) - 1))
+    return terms
+
+
+def _field_comment(field: CoreField) -> str:
+    return field.custom_comment.strip() if field.custom_comment else ''
+
+
+def _table_comment(table: CoreTable) -> str:
+    return table.custom_comment.strip() if table.custom_comment else ''
+
+
+def render_table_schema(ds: CoreDatasource, db_name: str, table: CoreTable, fields: Optional[List[CoreField]]) -> str:
+    schema_table = f"# Table: {db_name}.{table.table_name}" if ds.type != "mysql" and ds.type != "es" \
+        else f"# Table: {table.table_name}"
+    table_comment = _table_comment(table)
+    if table_comment == '':
+        schema_table += '\n[\n'
+    else:
+        schema_table += f", {table_comment}\n[\n"
+
+    if fields:
+        field_list = []
+        for field in fields:
+            field_comment = _field_comment(field)
+            if field_comment == '':
+                field_list.append(f"({field.field_name}:{field.field_type})")
+            else:
+                field_list.append(f"({field.field_name}:{field.field_type}, {field_comment})")
+        schema_table += ",\n".join(field_list)
+    schema_table += '\n]\n'
+    return schema_table
+
+
+def _is_key(field: CoreField, relation_fields: Set[int]) -> bool:
+    name = (field.field_name or '').lower()
+    return field.id in relation_fields or name == 'id' or name.endswith('_id')
+
+
+def _relations(ds: CoreDatasource) -> List[Tuple[int, int, int, int]]:
+    """[(源表 id, 源字段 id, 目标表 id, 目标字段 id)]"""
+    result = []
+    for edge in ds.table_relation or []:
+        if edge.get('shape') != 'edge':
+            continue
+        try:
+            source, target = edge.get('source'), edge.get('target')
+            result.append((int(source.get('cell')), int(source.get('port')), int(target.get('cell')),
+                           int(target.get('port'))))
+        except (TypeError, ValueError, AttributeError):
+            continue
+    return result
+
+
+def build_budgeted_schema(session: SessionDep, current_user: CurrentUser, ds: CoreDatasource,
+                          table_objs: List[TableAndFields], question: str, token_budget: int,
+                          embedding: bool = True) -> str:
+    db_name = table_objs[0].schema
+    header = f"【DB_ID】 {db_name}\n【Schema】\n"
+    remaining = token_budget - estimate_tokens(header)
+    q_terms = _terms(question)
+    relations = _relations(ds)
+    relation_fields = {r[1] for r in relations} | {r[3] for r in relations}
+    neighbours: Dict[int, Set[int]] = {}
+    for s_table, _, t_table, _ in relations:
+        neighbours.setdefault(s_table, set()).add(t_table)
+        neighbours.setdefault(t_table, set()).add(s_table)
+
+    # 字面相关度
+    field_scores: Dict[int, float] = {}
+    table_scores: Dict[int, float] = {}
+    for obj in table_objs:
+        t_terms = _terms(obj.table.table_name) | _terms(_table_comment(obj.table))
+        score = 2.0 * len(q_terms & t_terms)
+        for field in obj.fields or []:
+            f_score = len(q_terms & (_terms(field.field_name) | _terms(_field_comment(field))))
+            field_scores[field.id] = f_score
+            score += 0.5 * f_score
+        table_scores[obj.table.id] = score
+
+    # 向量相似度
+    if embedding and settings.TABLE_EMBEDDING_ENABLED:
+        docs = [{"id": obj.table.id, "schema_table": render_table_schema(ds, db_name, obj.table, obj.fields)}
+                for obj in table_objs]
+        for item in get_table_embedding(session, current_user, docs, question, count=0):
+            table_scores[item.get('id')] = table_scores.get(item.get('id'), 0.0) + 4.0 * item.get(
+                'cosine_similarity', 0.0)
+
+    objs = {obj.table.id: obj for obj in table_objs}
+    ranked = sorted(table_objs, key=lambda o: table_scores.get(o.table.id, 0.0), reverse=True)
+
+    selected: Dict[int, List[CoreField]] = {}
+    order: List[int] = []
+
+    def add_table(obj: TableAndFields, minimal_count: int) -> bool:
+        """加入表的键字段和与问题相关的字段（都没有时取前 minimal_count 个字段）"""
+        nonlocal remaining
+        fields = obj.fields or []
+        chosen = [f for f in fields if _is_key(f, relation_fields) or field_scores.get(f.id, 0) > 0]
+        if not chosen:
+            chosen = fields[:minimal_count]
+        cost = estimate_tokens(render_table_schema(ds, db_name, obj.table, chosen))
+        if cost > remaining:
+            return False
+        remaining -= cost
+        selected[obj.table.id] = chosen
+        order.append(obj.table.id)
+        return True
+
+    def fill_table(table_id: int):
+        """预算有剩余时补充其余字段"""
+        nonlocal remaining
+        obj = objs[table_id]
+        chosen_ids = {f.id for f in selected[table_id]}
+        for field in obj.fields or []:
+            if field.id in chosen_ids:
+                continue
+            field_cost = estimate_tokens(f"({field.field_name}:{field.field_type}, {_field_comment(field)}),\n")
+            if field_cost > remaining:
+                continue
+            selected[table_id].append(field)
+            remaining -= field_cost
+        index = {f.id: i for i, f in enumerate(obj.fields or [])}
+        selected[table_id].sort(key=lambda f: index.get(f.id, 0))
+
+    # 1. 相关的表及其外键关联表
+    for obj in ranked:
+        if table_scores.get(obj.table.id, 0.0) <= 0 or obj.table.id in selected:
+            continue
+        if not add_table(obj, 5):
+            continue
+        for neighbour in sorted(neighbours.get(obj.table.id, set()),
+                                key=lambda t: table_scores.get(t, 0.0), reverse=True):
+            if neighbour not in selected and neighbour in objs:
+                add_table(objs[neighbour], 5)
+    # 2. 补全已选表的其余字段
+    for table_id in list(order):
+        fill_table(table_id)
+    # 3. 剩余预算放入其他表的部分字段
+    for obj in ranked:
+        if obj.table.id not in selected:
+            add_table(obj, 5)
+
+    schema_str = header
+    for table_id in order:
+        schema_str += render_table_schema(ds, db_name, objs[table_id].table, selected[table_id])
+
+    # 只保留两端字段都在结果中的外键
+    field_names = {f.id: f.field_name for fields in selected.values() for f in fields}
+    fks = [r for r in relations if r[0] in selected and r[2] in selected and r[1] in field_names and r[3] in field_names]
+    if fks:
+        schema_str += '【Foreign keys】\n'
+        for s_table, s_field, t_table, t_field in fks:
+            schema_str += f"{objs[s_table].table.table_name}.{field_names[s_field]}=" \
+                          f"{objs[t_table].table.table_name}.{field_names[t_field]}\n"
+    return schema_str
@@ -11,7 +11,9 @@ from common.core.deps import SessionDep, CurrentUser
 from common.utils.utils import SQLBotLogUtil
 
 
-def get_table_embedding(session: SessionDep, current_user: CurrentUser, tables: list[dict], question: str):
+def get_table_embedding(session: SessionDep, current_user: CurrentUser, tables: list[dict], question: str,
+                        count: int = None):
+    """按与问题的向量相似度排序，返回前 count 个（默认 TABLE_EMBEDDING_COUNT，0 为全部）"""
     _list = []
     for table in tables:
         _list.append({"id": table.get('id'), "schema_table": table.get('schema_table'), "cosine_similarity": 0.0})
@@ -32,7 +34,9 @@ def get_table_embedding(session: SessionDep, current_user: CurrentUser, tables:
                 _list[index]['cosine_similarity'] = cosine_similarity(q_embedding, item)
 
             _list.sort(key=lambda x: x['cosine_similarity'], reverse=True)
-            _list = _list[:settings.TABLE_EMBEDDING_COUNT]
+            count = settings.TABLE_EMBEDDING_COUNT if count is None else count
+            if count > 0:
+                _list = _list[:count]
             # print(len(_list))
             SQLBotLogUtil.info(json.dumps(_list))
             return _list
@@ -81,6 +81,10 @@ class DatasourceConf(BaseModel):
     sheets: List = ''
     mode: str = ''
     timeout: int = 30
+    cacheTtl: Optional[int] = None
+    queryTimeout: Optional[int] = None
+    maxEstimatedRows: Optional[int] = None
+    maxEstimatedCost: Optional[float] = None
 
     def to_dict(self):
         return {
@@ -95,7 +99,11 @@ class DatasourceConf(BaseModel):
             "filename": self.filename,
             "sheets": self.sheets,
             "mode": self.mode,
-            "timeout": self.timeout
+            "timeout": self.timeout,
+            "cacheTtl": self.cacheTtl,
+            "queryTimeout": self.queryTimeout,
+            "maxEstimatedRows": self.maxEstimatedRows,
+            "maxEstimatedCost": self.maxEstimatedCost
         }
 
 
@@ -0,0 +1,145 @@
+"""
+执行前的 EXPLAIN 代价检查与语句超时
+
+按数据源方言执行 EXPLAIN，估算行数或代价超过阈值（数据源配置 maxEstimatedRows / maxEstimatedCost，
+未配置时使用 SQL_EXPLAIN_MAX_ROWS / SQL_EXPLAIN_MAX_COST，0 为不检查）时拒绝执行，
+错误信息会作为执行错误反馈给下一次 SQL 生成。
+"""
+
+import json
+import re
+from typing import Callable, List, Optional, Tuple
+
+from apps.datasource.models.datasource import DatasourceConf
+from common.core.config import settings
+from common.error import SQLCostExceededError
+from common.utils.utils import SQLBotLogUtil
+
+_redshift_plan = re.compile(r'cost=[\d.]+\.\.([\d.]+)\s+rows=(\d+)')
+_doris_cardinality = re.compile(r'cardinality=(\d+)')
+
+
+def get_statement_timeout(conf: Optional[DatasourceConf]) -> int:
+    """单条查询的超时秒数，0 为不限制"""
+    if conf is not None and conf.queryTimeout is not None and conf.queryTimeout >= 0:
+        return conf.queryTimeout
+    return settings.SQL_STATEMENT_TIMEOUT
+
+
+def get_thresholds(conf: Optional[DatasourceConf]) -> Tuple[float, float]:
+    max_rows = settings.SQL_EXPLAIN_MAX_ROWS
+    max_cost = settings.SQL_EXPLAIN_MAX_COST
+    if conf is not None:
+        if conf.maxEstimatedRows is not None:
+            max_rows = conf.maxEstimatedRows
+        if conf.maxEstimatedCost is not None:
+            max_cost = conf.maxEstimatedCost
+    return max_rows, max_cost
+
+
+def get_explain_sql(ds_type: str, sql: str) -> Optional[str]:
+    if ds_type in ('pg', 'excel', 'kingbase'):
+        return f'EXPLAIN (FORMAT JSON) {sql}'
+    if ds_type == 'mysql':
+        return f'EXPLAIN FORMAT=JSON {sql}'
+    if ds_type in ('redshift', 'doris'):
+        # Redshift 不支持 JSON 格式，Doris 的 JSON 格式不含基数估算，解析文本计划
+        return f'EXPLAIN {sql}'
+    if ds_type == 'ck':
+        return f'EXPLAIN ESTIMATE {sql}'
+    # sqlServer、oracle、dm 需要写计划表或开启会话级 SHOWPLAN，es 无 EXPLAIN，不做检查
+    return None
+
+
+def _load_json(value):
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def _walk_mysql(node, rows: List[float]):
+    if isinstance(node, dict):
+        for key in ('rows_examined_per_scan', 'rows_produced_per_join'):
+            if key in node:
+                try:
+                    rows.append(float(node.get(key)))
+                except (TypeError, ValueError):
+                    pass
+        for value in node.values():
+            _walk_mysql(value, rows)
+    elif isinstance(node, list):
+        for value in node:
+            _walk_mysql(value, rows)
+
+
+def _walk_pg(node, rows: List[float], costs: List[float]):
+    if not isinstance(node, dict):
+        return
+    if node.get('Plan Rows') is not None:
+        rows.append(float(node.get('Plan Rows')))
+    if node.get('Total Cost') is not None:
+        costs.append(float(node.get('Total Cost')))
+    for child in node.get('Plans') or []:
+        _walk_pg(child, rows, costs)
+
+
+def parse_explain(ds_type: str, result: list) -> Tuple[Optional[float], Optional[float]]:
+    """
+    返回 (估算行数, 估算代价)，无法得到的项为 None
+
+    取计划中所有节点的最大值：执行前已为 SQL 加上行数上限，顶层 Limit 节点的估算不反映实际扫描量
+    """
+    if not result:
+        return None, None
+    if ds_type in ('pg', 'excel', 'kingbase'):
+        rows: List[float] = []
+        costs: List[float] = []
+        _walk_pg(_load_json(result[0][0])[0].get('Plan', {}), rows, costs)
+        return (max(rows) if rows else None), (max(costs) if costs else None)
+    if ds_type == 'mysql':
+        plan = _load_json(result[0][0])
+        rows: List[float] = []
+        _walk_mysql(plan, rows)
+        cost = plan.get('query_block', {}).get('cost_info', {}).get('query_cost')
+        return (max(rows) if rows else None), (float(cost) if cost is not None else None)
+    if ds_type == 'redshift':
+        matches = _redshift_plan.findall('\n'.join(str(r[0]) for r in result))
+        if not matches:
+            return None, None
+        return max(float(m[1]) for m in matches), max(float(m[0]) for m in matches)
+    if ds_type == 'doris':
+        values = [float(v) for r in result for v in _doris_cardinality.findall(str(r[0]))]
+        return (max(values) if values else None), None
+    if ds_type == 'ck':
+        # database, table, parts, rows, marks
+        return float(sum(int(r[3]) for r in result)), None
+    return None, None
+
+
+def check_sql_cost(ds_type: str, conf: Optional[DatasourceConf], run: Callable[[str], list], sql: str):
+    """
+    :param run: 在执行查询的同一连接上执行语句并返回全部行的函数
+    """
+    max_rows, max_cost = get_thresholds(conf)
+    if max_rows <= 0 and max_cost <= 0:
+        return
+    explain_sql = get_explain_sql(ds_type, sql)
+    if not explain_sql:
+        return
+    try:
+        rows, cost = parse_explain(ds_type, run(explain_sql))
+    except Exception as e:
+        # EXPLAIN 失败不阻断执行，真正的语法错误由执行阶段报告
+        SQLBotLogUtil.warning(f"Explain sql failed ({ds_type}): {e}")
+        return
+    if max_rows > 0 and rows is not None and rows > max_rows:
+        raise SQLCostExceededError(
+            f'The query is estimated to scan or return about {int(rows)} rows, which exceeds the limit of '
+            f'{int(max_rows)}. Add filters on indexed or partition columns, aggregate the data, or avoid '
+            f'joins without conditions.')
+    if max_cost > 0 and cost is not None and cost > max_cost:
+        raise SQLCostExceededError(
+            f'The estimated query cost {cost:.0f} exceeds the limit of {max_cost:.0f}. Add filters on indexed '
+            f'or partition columns, aggregate the data, or avoid joins without conditions.')
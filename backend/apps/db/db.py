@@ -1,29 +1,34 @@
 import base64
 import json
 import platform
+import threading
 import urllib.parse
 from decimal import Decimal
-from typing import Optional
+from itertools import islice
+from typing import Callable, Optional
 import math
 
 import psycopg2
 import pymssql
 from apps.db.db_sql import get_table_sql, get_field_sql, get_version_sql
-from common.error import ParseSQLResultError
+from common.error import ParseSQLResultError, SQLBotDBError
 
 if platform.system() != "Darwin":
     import dmPython
 import pymysql
 import redshift_connector
-from sqlalchemy import create_engine, text, Engine
+from sqlalchemy import create_engine, event, text, Engine
 from sqlalchemy.orm import sessionmaker
 
 from apps.datasource.models.datasource import DatasourceConf, CoreDatasource, TableSchema, ColumnSchema
 from apps.datasource.utils.utils import aes_decrypt
 from apps.db.constant import DB, ConnectType
+from apps.db.cost_guard import check_sql_cost, get_statement_timeout
 from apps.db.engine import get_engine_config
+from apps.db.pool import engine_registry, engine_pool_kwargs, config_hash, connection_pool_registry
 from apps.system.crud.assistant import get_ds_engine
 from apps.system.schemas.system_schema import AssistantOutDsSchema
+from common.core.config import settings
 from common.core.deps import Trans
 from common.utils.utils import SQLBotLogUtil
 from fastapi import HTTPException
@@ -108,27 +113,72 @@ def get_engine(ds: CoreDatasource, timeout: int = 0) -> Engine:
         conf.timeout = timeout
     if timeout > 0:
         conf.timeout = timeout
+    # 同一数据源、同一配置复用 Engine 及其连接池
+    return engine_registry.get(f'ds:{ds.id}', config_hash(ds.type, ds.configuration, conf.timeout),
+                               lambda: create_ds_engine(ds, conf))
+
+
+def create_ds_engine(ds: CoreDatasource, conf: DatasourceConf) -> Engine:
+    pool_kwargs = engine_pool_kwargs()
     if ds.type == "pg":
         if conf.dbSchema is not None and conf.dbSchema != "":
             engine = create_engine(get_uri(ds),
                                    connect_args={"options": f"-c search_path={urllib.parse.quote(conf.dbSchema)}",
                                                  "connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   pool_timeout=conf.timeout, **pool_kwargs)
         else:
             engine = create_engine(get_uri(ds),
                                    connect_args={"connect_timeout": conf.timeout},
-                                   pool_timeout=conf.timeout)
+                                   pool_timeout=conf.timeout, **pool_kwargs)
     elif ds.type == 'sqlServer':
         engine = create_engine('mssql+pymssql://', creator=lambda: get_origin_connect(ds.type, conf),
-                               pool_timeout=conf.timeout)
+                               pool_timeout=conf.timeout, **pool_kwargs)
     elif ds.type == 'oracle':
         engine = create_engine(get_uri(ds),
-                               pool_timeout=conf.timeout)
-    else:  # mysql, ck
-        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout)
+                               pool_timeout=conf.timeout, **pool_kwargs)
+    elif ds.type == 'ck':
+        connect_args = {"connect_timeout": conf.timeout}
+        statement_timeout = get_statement_timeout(conf)
+        if statement_timeout > 0:
+            # 作为 HTTP 请求参数传给 ClickHouse，不改写 SQL 文本；SQL 中自带的 SETTINGS 优先
+            connect_args["ch_settings"] = {"max_execution_time": statement_timeout}
+        engine = create_engine(get_uri(ds), connect_args=connect_args, pool_timeout=conf.timeout, **pool_kwargs)
+    else:  # mysql
+        engine = create_engine(get_uri(ds), connect_args={"connect_timeout": conf.timeout}, pool_timeout=conf.timeout,
+                               **pool_kwargs)
     return engine
 
 
+def create_native_connection(type: str, conf: DatasourceConf):
+    extra_config_dict = get_extra_config(conf)
+    if type == 'dm':
+        return dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
+                                port=conf.port, **extra_config_dict)
+    elif type == 'doris':
+        return pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
+                               port=conf.port, db=conf.database, connect_timeout=conf.timeout,
+                               read_timeout=conf.timeout, **extra_config_dict)
+    elif type == 'redshift':
+        return redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
+                                          password=conf.password,
+                                          timeout=conf.timeout, **extra_config_dict)
+    elif type == 'kingbase':
+        return psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
+                                password=conf.password,
+                                connect_timeout=conf.timeout,
+                                options=f"-c statement_timeout={conf.timeout * 1000}",
+                                **extra_config_dict)
+    raise Exception(f'Datasource type {type} does not use a native driver')
+
+
+# use native DB-API driver (dm, doris, redshift, kingbase), connections are pooled per datasource
+def get_native_connection(ds: CoreDatasource | AssistantOutDsSchema, conf: DatasourceConf):
+    ds_key = f'ds:{ds.id}' if isinstance(ds, CoreDatasource) else f'assistant:{ds.id}'
+    pool = connection_pool_registry.get(ds_key, config_hash(ds.type, json.dumps(conf.to_dict(), default=str)),
+                                        lambda: create_native_connection(ds.type, conf))
+    return pool.connection()
+
+
 def get_session(ds: CoreDatasource | AssistantOutDsSchema):
     engine = get_engine(ds) if isinstance(ds, CoreDatasource) else get_ds_engine(ds)
     session_maker = sessionmaker(bind=engine)
@@ -152,10 +202,8 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                 return False
         else:
             conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-            extra_config_dict = get_extra_config(conf)
             if ds.type == 'dm':
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                     try:
                         cursor.execute('select 1', timeout=10).fetchall()
                         SQLBotLogUtil.info("success")
@@ -166,9 +214,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                             raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                         return False
             elif ds.type == 'doris':
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                     try:
                         cursor.execute('select 1')
                         SQLBotLogUtil.info("success")
@@ -179,10 +225,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                             raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                         return False
             elif ds.type == 'redshift':
-                with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database,
-                                                user=conf.username,
-                                                password=conf.password,
-                                                timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                     try:
                         cursor.execute('select 1')
                         SQLBotLogUtil.info("success")
@@ -193,10 +236,7 @@ def check_connection(trans: Optional[Trans], ds: CoreDatasource | AssistantOutDs
                             raise HTTPException(status_code=500, detail=trans('i18n_ds_invalid') + f': {e.args}')
                         return False
             elif ds.type == 'kingbase':
-                with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database,
-                                      user=conf.username,
-                                      password=conf.password,
-                                      connect_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                     try:
                         cursor.execute('select 1')
                         SQLBotLogUtil.info("success")
@@ -253,17 +293,13 @@ def get_version(ds: CoreDatasource | AssistantOutDsSchema):
                     res = result.fetchall()
                     version = res[0][0]
         else:
-            extra_config_dict = get_extra_config(conf)
             if ds.type == 'dm':
-                with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                      port=conf.port) as conn, conn.cursor() as cursor:
-                    cursor.execute(sql, timeout=10, **extra_config_dict)
+                with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
+                    cursor.execute(sql, timeout=10)
                     res = cursor.fetchall()
                     version = res[0][0]
             elif ds.type == 'doris':
-                with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                     port=conf.port, db=conf.database, connect_timeout=10,
-                                     read_timeout=10, **extra_config_dict) as conn, conn.cursor() as cursor:
+                with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                     cursor.execute(sql)
                     res = cursor.fetchall()
                     version = res[0][0]
@@ -292,27 +328,20 @@ def get_schema(ds: CoreDatasource):
                 res_list = [item[0] for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if ds.type == 'dm':
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""select OBJECT_NAME from dba_objects where object_type='SCH'""", timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
         elif ds.type == 'redshift':
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
                 return res_list
         elif ds.type == 'kingbase':
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute("""SELECT nspname FROM pg_namespace""")
                 res = cursor.fetchall()
                 res_list = [item[0] for item in res]
@@ -330,35 +359,26 @@ def get_tables(ds: CoreDatasource):
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if ds.type == 'dm':
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, {"param": sql_param}, timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif ds.type == 'doris':
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif ds.type == 'redshift':
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (sql_param,))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
                 return res_list
         elif ds.type == 'kingbase':
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql.format(sql_param))
                 res = cursor.fetchall()
                 res_list = [TableSchema(*item) for item in res]
@@ -380,35 +400,26 @@ def get_fields(ds: CoreDatasource, table_name: str = None):
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
     else:
-        extra_config_dict = get_extra_config(conf)
         if ds.type == 'dm':
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, {"param1": p1, "param2": p2}, timeout=conf.timeout)
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif ds.type == 'doris':
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif ds.type == 'redshift':
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql, (p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
                 return res_list
         elif ds.type == 'kingbase':
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
                 cursor.execute(sql.format(p1, p2))
                 res = cursor.fetchall()
                 res_list = [ColumnSchema(*item) for item in res]
@@ -419,124 +430,340 @@ def get_fields(ds: CoreDatasource, table_name: str = None):
             return res_list
 
 
-def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False):
+def sanitize_value(value):
+    """Sanitize values to make them JSON compliant"""
+    if isinstance(value, Decimal):
+        value = float(value)
+    if isinstance(value, float):
+        if math.isinf(value) or math.isnan(value):
+            return None  # or you could return a string representation like "Infinity" or "NaN"
+    return value
+
+
+def _estimate_size(row) -> int:
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+
+def fetch_result(columns: list, fetch_batch, sql: str) -> dict:
+    """
+    分批读取查询结果，行数超过 SQL_RESULT_MAX_ROWS 或估算大小超过 SQL_RESULT_MAX_BYTES 时停止读取并标记 truncated
+
+    :param fetch_batch: 接收批大小、返回一批行（空表示读完）的函数，如 cursor.fetchmany
+    """
+    max_rows = settings.SQL_RESULT_MAX_ROWS
+    max_bytes = settings.SQL_RESULT_MAX_BYTES
+    batch_size = settings.SQL_RESULT_FETCH_BATCH
+    keys = [str(c) for c in columns]
+    result_list = []
+    size = 0
+    truncated = False
+    while not truncated:
+        rows = fetch_batch(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            if len(result_list) >= max_rows or size >= max_bytes:
+                truncated = True
+                break
+            size += _estimate_size(row)
+            result_list.append({keys[i]: sanitize_value(value) for i, value in enumerate(row)})
+    if truncated:
+        SQLBotLogUtil.warning(f"SQL result truncated at {len(result_list)} rows / {size} bytes")
+    return {"fields": columns, "data": result_list, "truncated": truncated,
+            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+
+
+class QueryCanceller:
+    """
+    跨线程取消正在执行的查询：执行线程在拿到连接后 attach 取消函数，其他线程调用 cancel
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancel: Optional[Callable[[], None]] = None
+        self.cancelled = False
+
+    def attach(self, cancel: Optional[Callable[[], None]]):
+        with self._lock:
+            self._cancel = cancel
+            cancelled = self.cancelled
+        if cancelled:
+            self._run(cancel)
+
+    def detach(self):
+        with self._lock:
+            self._cancel = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            cancel = self._cancel
+        self._run(cancel)
+
+    @staticmethod
+    def _run(cancel: Optional[Callable[[], None]]):
+        if cancel is None:
+            return
+        try:
+            cancel()
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Cancel query failed: {e}")
+
+
+def get_query_cancel(ds_type: str, dbapi_conn, kill_query: Optional[Callable[[str], None]] = None):
+    """
+    返回取消当前语句的函数：psycopg2/oracledb/dmPython 等驱动的 cancel()（pg 即 pg_cancel_backend），
+    pymysql 通过另一个连接执行 KILL QUERY
+    """
+    if ds_type in ('mysql', 'doris') and kill_query is not None:
+        thread_id = dbapi_conn.thread_id()
+        return lambda: kill_query(f'KILL QUERY {thread_id}')
+    cancel = getattr(dbapi_conn, 'cancel', None)
+    if callable(cancel):
+        return cancel
+    return None
+
+
+# 连接池中连接的 info 标记：已设置会话级超时，归还时需要恢复
+_statement_timeout_flag = 'sqlbot_statement_timeout'
+
+
+def _reset_statement_timeout(dbapi_connection, connection_record):
+    """连接归还连接池时恢复会话级超时，避免元数据查询等复用该连接的语句继承对话查询的超时"""
+    ds_type = connection_record.info.pop(_statement_timeout_flag, None)
+    if ds_type is None or dbapi_connection is None:
+        return
+    try:
+        if ds_type == 'mysql':
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute('SET SESSION MAX_EXECUTION_TIME = DEFAULT')
+            finally:
+                cursor.close()
+        elif ds_type == 'oracle':
+            dbapi_connection.call_timeout = 0
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Reset statement timeout failed ({ds_type}), discard connection: {e}")
+        connection_record.invalidate(e)
+
+
+def _set_statement_timeout(session, ds_type: str, timeout: int):
+    if timeout <= 0:
+        return
+    try:
+        if ds_type in ('pg', 'excel'):
+            # 只在当前事务内生效，连接归还连接池时随回滚恢复
+            session.execute(text(f'SET LOCAL statement_timeout = {timeout * 1000}'))
+        elif ds_type in ('mysql', 'oracle'):
+            # 会话级设置，连接归还连接池时由 _reset_statement_timeout 恢复
+            engine = session.get_bind()
+            if not event.contains(engine, 'checkin', _reset_statement_timeout):
+                event.listen(engine, 'checkin', _reset_statement_timeout)
+            connection = session.connection().connection
+            connection.info[_statement_timeout_flag] = ds_type
+            if ds_type == 'mysql':
+                session.execute(text(f'SET SESSION MAX_EXECUTION_TIME = {timeout * 1000}'))
+            else:
+                connection.driver_connection.call_timeout = timeout * 1000
+        # sqlServer 使用连接参数 timeout，ck 在创建 Engine 时设置 max_execution_time
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Set statement timeout failed ({ds_type}): {e}")
+
+
+def _set_native_statement_timeout(cursor, ds_type: str, timeout: int) -> Optional[str]:
+    """
+    :return: doris 设置前的 query_timeout，由 _reset_native_statement_timeout 在连接归还前恢复
+    """
+    if timeout <= 0:
+        return None
+    if ds_type == 'doris':
+        cursor.execute('SELECT @@query_timeout')
+        row = cursor.fetchone()
+        cursor.execute(f'SET query_timeout = {timeout}')
+        return str(row[0]) if row and row[0] is not None else 'DEFAULT'
+    elif ds_type in ('redshift', 'kingbase'):
+        # 只在当前事务内生效，连接归还连接池时随回滚恢复
+        cursor.execute(f'SET LOCAL statement_timeout = {timeout * 1000}')
+    # dm 在 execute 时传入 timeout
+    return None
+
+
+def _reset_native_statement_timeout(conn, ds_type: str, previous: Optional[str]):
+    if previous is None:
+        return
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f'SET query_timeout = {previous}')
+    except Exception as e:
+        # 关闭后归还时回滚失败，连接池会直接丢弃该连接
+        SQLBotLogUtil.warning(f"Reset statement timeout failed ({ds_type}), discard connection: {e}")
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _cursor_columns(description, origin_column: bool) -> list:
+    return [field[0] for field in description] if origin_column else [field[0].lower() for field in description]
+
+
+_result_cursor_name = 'sqlbot_result'
+
+
+def _declare_result_cursor(cursor, sql: str):
+    """
+    redshift / kingbase 的驱动在 execute 时把整个结果读入内存，这里在当前事务中声明服务端游标，
+    每批用 FETCH FORWARD 读取；游标随连接归还连接池时的回滚关闭
+
+    :return: (列描述, 接收批大小返回一批行的函数)
+    """
+    cursor.execute(f'DECLARE {_result_cursor_name} CURSOR FOR {sql}')
+
+    def fetch(size: int):
+        cursor.execute(f'FETCH FORWARD {size} FROM {_result_cursor_name}')
+        return cursor.fetchall()
+
+    # 列描述在第一次 FETCH 之后才有
+    first = fetch(settings.SQL_RESULT_FETCH_BATCH)
+    description = cursor.description
+    pending = [first]
+
+    def fetch_batch(size: int):
+        if pending:
+            return pending.pop()
+        return fetch(size)
+
+    return description, fetch_batch
+
+
+def _get_exec_conf(ds: CoreDatasource | AssistantOutDsSchema) -> Optional[DatasourceConf]:
+    if not isinstance(ds, CoreDatasource):
+        return None
+    try:
+        return DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
+    except Exception:
+        return None
+
+
+def exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column=False, cost_guard=False,
+             canceller: Optional[QueryCanceller] = None):
+    """
+    :param cost_guard: 执行前按数据源阈值做 EXPLAIN 检查，超过时抛出 SQLCostExceededError
+    :param canceller: 执行期间登记取消函数，客户端断开时由其他线程取消正在执行的语句
+    """
+    if canceller is not None and canceller.cancelled:
+        raise SQLBotDBError('Query cancelled')
+    try:
+        return _exec_sql(ds, sql, origin_column, cost_guard, canceller)
+    finally:
+        if canceller is not None:
+            canceller.detach()
+
+
+def _exec_sql(ds: CoreDatasource | AssistantOutDsSchema, sql: str, origin_column: bool, cost_guard: bool,
+              canceller: Optional[QueryCanceller]):
     while sql.endswith(';'):
         sql = sql[:-1]
 
-    def sanitize_value(value):
-        """Sanitize values to make them JSON compliant"""
-        if isinstance(value, float):
-            if math.isinf(value) or math.isnan(value):
-                return None  # or you could return a string representation like "Infinity" or "NaN"
-        return value
-
     db = DB.get_db(ds.type)
     if db.connect_type == ConnectType.sqlalchemy:
+        conf = _get_exec_conf(ds)
+        timeout = get_statement_timeout(conf)
         with get_session(ds) as session:
-            with session.execute(text(sql)) as result:
+            _set_statement_timeout(session, ds.type, timeout)
+            if cost_guard:
+                def run(q: str):
+                    try:
+                        return session.execute(text(q)).fetchall()
+                    except Exception:
+                        # EXPLAIN 失败会使 pg 事务中止，回滚后重新设置超时
+                        session.rollback()
+                        _set_statement_timeout(session, ds.type, timeout)
+                        raise
+
+                check_sql_cost(ds.type, conf, run, sql)
+            if canceller is not None:
+                # EXPLAIN 失败回滚后会换用新的连接，取消函数在其后登记
+                engine = session.get_bind()
+
+                def kill_query(q: str):
+                    with engine.connect() as kill_conn:
+                        kill_conn.exec_driver_sql(q)
+
+                canceller.attach(get_query_cancel(ds.type, session.connection().connection.driver_connection,
+                                                  kill_query))
+            # 服务端游标分批读取，不支持的方言会退化为普通游标
+            with session.execute(text(sql),
+                                 execution_options={"stream_results": True,
+                                                    "max_row_buffer": settings.SQL_RESULT_FETCH_BATCH}) as result:
                 try:
                     columns = result.keys()._keys if origin_column else [item.lower() for item in result.keys()._keys]
-                    res = result.fetchall()
-                    result_list = [
-                        {str(columns[i]): sanitize_value(float(value) if isinstance(value, Decimal) else value) for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                    return fetch_result(columns, result.fetchmany, sql)
                 except Exception as ex:
                     raise ParseSQLResultError(str(ex))
     else:
         conf = DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
-        extra_config_dict = get_extra_config(conf)
-        if ds.type == 'dm':
-            with dmPython.connect(user=conf.username, password=conf.password, server=conf.host,
-                                  port=conf.port, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql, timeout=conf.timeout)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): sanitize_value(float(value) if isinstance(value, Decimal) else value) for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif ds.type == 'doris':
-            with pymysql.connect(user=conf.username, passwd=conf.password, host=conf.host,
-                                 port=conf.port, db=conf.database, connect_timeout=conf.timeout,
-                                 read_timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): sanitize_value(float(value) if isinstance(value, Decimal) else value) for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif ds.type == 'redshift':
-            with redshift_connector.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                            password=conf.password,
-                                            timeout=conf.timeout, **extra_config_dict) as conn, conn.cursor() as cursor:
-                try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): sanitize_value(float(value) if isinstance(value, Decimal) else value) for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
-        elif ds.type == 'kingbase':
-            with psycopg2.connect(host=conf.host, port=conf.port, database=conf.database, user=conf.username,
-                                  password=conf.password,
-                                  options=f"-c statement_timeout={conf.timeout * 1000}",
-                                  **extra_config_dict) as conn, conn.cursor() as cursor:
+        timeout = get_statement_timeout(conf)
+        if ds.type in ('dm', 'doris', 'redshift', 'kingbase'):
+            with get_native_connection(ds, conf) as conn, conn.cursor() as cursor:
+                def run(q: str):
+                    try:
+                        cursor.execute(q)
+                        return cursor.fetchall()
+                    except Exception:
+                        conn.rollback()
+                        if ds.type in ('redshift', 'kingbase'):
+                            # SET LOCAL 随回滚失效，重新设置
+                            _set_native_statement_timeout(cursor, ds.type, timeout)
+                        raise
+
+                previous_timeout = _set_native_statement_timeout(cursor, ds.type, timeout)
                 try:
-                    cursor.execute(sql)
-                    res = cursor.fetchall()
-                    columns = [field[0] for field in cursor.description] if origin_column else [field[0].lower() for
-                                                                                                field in
-                                                                                                cursor.description]
-                    result_list = [
-                        {str(columns[i]): sanitize_value(float(value) if isinstance(value, Decimal) else value) for i, value in
-                         enumerate(tuple_item)}
-                        for tuple_item in res
-                    ]
-                    return {"fields": columns, "data": result_list,
-                            "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
-                except Exception as ex:
-                    raise ParseSQLResultError(str(ex))
+                    if canceller is not None:
+                        def kill_query(q: str):
+                            kill_conn = create_native_connection(ds.type, conf)
+                            try:
+                                with kill_conn.cursor() as kill_cursor:
+                                    kill_cursor.execute(q)
+                            finally:
+                                kill_conn.close()
+
+                        canceller.attach(get_query_cancel(ds.type, conn, kill_query))
+                    if cost_guard and isinstance(ds, CoreDatasource):
+                        check_sql_cost(ds.type, conf, run, sql)
+                    try:
+                        if ds.type == 'dm':
+                            cursor.execute(sql, timeout=timeout if timeout > 0 else conf.timeout)
+                            return fetch_result(_cursor_columns(cursor.description, origin_column), cursor.fetchmany,
+                                                sql)
+                        if ds.type == 'doris':
+                            # 默认游标在 execute 时把整个结果读入内存，非缓冲游标按批从连接读取；
+                            # 截断后关闭游标会读完并丢弃剩余的行，由 query_timeout 限制耗时
+                            with conn.cursor(pymysql.cursors.SSCursor) as ss_cursor:
+                                ss_cursor.execute(sql)
+                                return fetch_result(_cursor_columns(ss_cursor.description, origin_column),
+                                                    ss_cursor.fetchmany, sql)
+                        description, fetch_batch = _declare_result_cursor(cursor, sql)
+                        return fetch_result(_cursor_columns(description, origin_column), fetch_batch, sql)
+                    except Exception as ex:
+                        raise ParseSQLResultError(str(ex))
+                finally:
+                    _reset_native_statement_timeout(conn, ds.type, previous_timeout)
         elif ds.type == 'es':
             try:
-                res, columns = get_es_data_by_http(conf, sql)
+                # 多取一行用于判断是否截断
+                res, columns = get_es_data_by_http(conf, sql, fetch_size=settings.SQL_RESULT_MAX_ROWS + 1,
+                                                   timeout=timeout)
                 columns = [field.get('name') for field in columns] if origin_column else [field.get('name').lower() for
                                                                                           field in
                                                                                           columns]
-                result_list = [
-                    {str(columns[i]): sanitize_value(float(value) if isinstance(value, Decimal) else value) for i, value in
-                     enumerate(tuple(tuple_item))}
-                    for tuple_item in res
-                ]
-                return {"fields": columns, "data": result_list,
-                        "sql": bytes.decode(base64.b64encode(bytes(sql, 'utf-8')))}
+                rows = iter(res or [])
+                return fetch_result(columns, lambda size: [tuple(r) for r in islice(rows, size)], sql)
             except Exception as ex:
                 raise Exception(str(ex))
@@ -89,7 +89,7 @@ def get_es_fields(conf: DatasourceConf, table_name: str):
 #     return res, fields
 
 
-def get_es_data_by_http(conf: DatasourceConf, sql: str):
+def get_es_data_by_http(conf: DatasourceConf, sql: str, fetch_size: int = None, timeout: int = 0):
     url = conf.host
     while url.endswith('/'):
         url = url[:-1]
@@ -106,12 +106,23 @@ def get_es_data_by_http(conf: DatasourceConf, sql: str):
         "Authorization": f"Basic {encoded_credentials}"
     }
 
-    response = requests.post(host, data=json.dumps({"query": sql}), headers=headers)
+    body = {"query": sql}
+    if fetch_size:
+        body["fetch_size"] = fetch_size
+    if timeout > 0:
+        body["request_timeout"] = f'{timeout}s'
+    response = requests.post(host, data=json.dumps(body), headers=headers)
 
     # print(response.json())
     res = response.json()
     if res.get('error'):
         raise SingleMessageError(json.dumps(res))
+    if res.get('cursor'):
+        # 只取第一页，释放服务端游标
+        try:
+            requests.post(f'{url}/_sql/close', data=json.dumps({"cursor": res.get('cursor')}), headers=headers)
+        except Exception:
+            pass
     fields = res.get('columns')
     result = res.get('rows')
     return result, fields
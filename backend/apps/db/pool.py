@@ -0,0 +1,329 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import Engine
+
+from common.core.config import settings
+from common.utils.utils import SQLBotLogUtil
+
+
+def config_hash(*parts) -> str:
+    return hashlib.sha256('\x00'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:16]
+
+
+def engine_pool_kwargs() -> dict:
+    return {
+        "pool_size": settings.DS_POOL_SIZE,
+        "max_overflow": settings.DS_MAX_OVERFLOW,
+        "pool_recycle": settings.DS_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+class _EngineEntry:
+    def __init__(self, ds_key: str, engine: Engine):
+        self.ds_key = ds_key
+        self.engine = engine
+        self.create_time = time.monotonic()
+        self.last_used = self.create_time
+
+
+class EngineRegistry:
+    """
+    数据源 SQLAlchemy Engine 注册表
+
+    - 按 数据源 key + 配置 hash 复用 Engine（及其连接池），配置变化后生成新的 Engine
+    - 空闲超过 DS_POOL_IDLE_TIMEOUT 秒或超过 DS_MAX_ENGINES 个时释放最久未使用的 Engine，
+      有连接正在使用（如 stream_results 读取中的查询）的 Engine 不释放，数量可暂时超过上限
+    - 数据源修改/删除时调用 dispose 释放对应的 Engine
+    """
+
+    def __init__(self, idle_timeout: int, max_engines: int):
+        self.idle_timeout = idle_timeout
+        self.max_engines = max_engines
+        self._lock = threading.Lock()
+        self._engines: OrderedDict[str, _EngineEntry] = OrderedDict()
+        self._created = 0
+        self._disposed = 0
+
+    def get(self, ds_key: str, conf_hash: str, factory: Callable[[], Engine]) -> Engine:
+        key = f'{ds_key}:{conf_hash}'
+        with self._lock:
+            # evict before the lookup and never the requested key, so a disposed engine is never handed out
+            expired = self._evict(keep=key)
+            entry = self._engines.get(key)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._engines.move_to_end(key)
+        if entry is not None:
+            self._dispose_engines(expired)
+            return entry.engine
+        # create outside the lock, create_engine does not connect but may be slow to import dialects
+        engine = factory()
+        with self._lock:
+            entry = self._engines.get(key)
+            if entry is not None:
+                expired.append(engine)
+            else:
+                entry = _EngineEntry(ds_key, engine)
+                self._engines[key] = entry
+                self._created += 1
+            entry.last_used = time.monotonic()
+            self._engines.move_to_end(key)
+            expired.extend(self._evict(keep=key))
+        self._dispose_engines(expired)
+        return entry.engine
+
+    def dispose(self, ds_key: str):
+        with self._lock:
+            keys = [k for k, e in self._engines.items() if e.ds_key == ds_key]
+            expired = [self._engines.pop(k).engine for k in keys]
+        self._dispose_engines(expired)
+
+    def evict_idle(self):
+        with self._lock:
+            expired = self._evict()
+        self._dispose_engines(expired)
+
+    def _evict(self, keep: Optional[str] = None) -> list[Engine]:
+        # called with self._lock held
+        expired = []
+        now = time.monotonic()
+        for key in list(self._engines.keys()):
+            if key == keep:
+                continue
+            entry = self._engines[key]
+            if entry.engine.pool.checkedout() > 0:
+                continue
+            if len(self._engines) > self.max_engines or now - entry.last_used > self.idle_timeout:
+                expired.append(self._engines.pop(key).engine)
+        return expired
+
+    def _dispose_engines(self, engines: list[Engine]):
+        for engine in engines:
+            try:
+                engine.dispose()
+                self._disposed += 1
+            except Exception as e:
+                SQLBotLogUtil.warning(f"Dispose datasource engine failed: {e}")
+
+    def stats(self) -> Dict:
+        self.evict_idle()
+        now = time.monotonic()
+        with self._lock:
+            engines = []
+            for key, entry in self._engines.items():
+                pool = entry.engine.pool
+                item = {"key": key, "idle_seconds": round(now - entry.last_used, 1)}
+                for name in ("size", "checkedin", "checkedout", "overflow"):
+                    fn = getattr(pool, name, None)
+                    if callable(fn):
+                        item[name] = fn()
+                engines.append(item)
+            return {"engines": len(self._engines), "created": self._created, "disposed": self._disposed,
+                    "detail": engines}
+
+
+engine_registry = EngineRegistry(idle_timeout=settings.DS_POOL_IDLE_TIMEOUT, max_engines=settings.DS_MAX_ENGINES)
+
+
+class ConnectionPool:
+    """
+    线程安全的 DB-API 连接池，供 dm、doris、redshift、kingbase 等非 SQLAlchemy 驱动使用
+
+    - 连接总数（含已借出）不超过 max_size，池满时等待 checkout_timeout 秒后报错
+    - 借出时，空闲超过 check_interval 秒的连接先做健康检查，失效则丢弃重建
+    - 空闲超过 idle_timeout 秒的连接被关闭
+    - 归还时回滚未结束的事务，回滚失败的连接直接丢弃
+    """
+
+    def __init__(self, name: str, creator: Callable, max_size: int, idle_timeout: int, check_interval: int,
+                 checkout_timeout: int):
+        self.name = name
+        self.creator = creator
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.checkout_timeout = checkout_timeout
+        self._cond = threading.Condition()
+        # (connection, last used time), most recently returned at the end
+        self._idle: deque = deque()
+        self._size = 0
+        self._disposed = False
+        self.last_used = time.monotonic()
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    def checkedout(self) -> int:
+        with self._cond:
+            return self._size - len(self._idle)
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            conn, last_used = None, None
+            with self._cond:
+                expired = self._pop_expired()
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._close_all(expired)
+                        raise TimeoutError(f"Connection pool {self.name} exhausted ({self.max_size} connections)")
+                    self._cond.wait(remaining)
+                self.last_used = time.monotonic()
+            self._close_all(expired)
+
+            if conn is None:
+                try:
+                    return self.creator()
+                except BaseException:
+                    self._release_slot()
+                    raise
+            if time.monotonic() - last_used < self.check_interval or self._is_alive(conn):
+                return conn
+            self._close_all([conn])
+            self._release_slot()
+
+    def _checkin(self, conn):
+        try:
+            conn.rollback()
+        except Exception:
+            self._close_all([conn])
+            self._release_slot()
+            return
+        with self._cond:
+            if self._disposed:
+                discard = True
+            else:
+                discard = False
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+        if discard:
+            self._close_all([conn])
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _pop_expired(self) -> list:
+        # called with self._cond held, oldest idle connections are at the front
+        expired = []
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+        return expired
+
+    @staticmethod
+    def _is_alive(conn) -> bool:
+        try:
+            ping = getattr(conn, 'ping', None)
+            if callable(ping):
+                ping()
+                return True
+            cursor = conn.cursor()
+            try:
+                cursor.execute('select 1')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_all(conns: list):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def evict_idle(self):
+        with self._cond:
+            expired = self._pop_expired()
+        self._close_all(expired)
+
+    def dispose(self):
+        with self._cond:
+            self._disposed = True
+            conns = [c for c, _ in self._idle]
+            self._size -= len(conns)
+            self._idle.clear()
+            self._cond.notify_all()
+        self._close_all(conns)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "checkedout": self._size - len(self._idle),
+                    "max_size": self.max_size}
+
+
+class ConnectionPoolRegistry:
+    """按 数据源 key + 配置 hash 管理原生驱动连接池，长时间未使用的连接池整体释放"""
+
+    def __init__(self, idle_timeout: int):
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._pools: Dict[str, Tuple[str, ConnectionPool]] = {}
+
+    def get(self, ds_key: str, conf_hash: str, creator: Callable) -> ConnectionPool:
+        key = f'{ds_key}:{conf_hash}'
+        with self._lock:
+            # evict before the lookup and never the requested key, so a disposed pool is never handed out
+            expired = self._evict(keep=key)
+            item = self._pools.get(key)
+            if item is None:
+                item = (ds_key, ConnectionPool(key, creator, max_size=settings.DS_NATIVE_POOL_SIZE,
+                                               idle_timeout=settings.DS_POOL_IDLE_TIMEOUT,
+                                               check_interval=settings.DS_NATIVE_POOL_CHECK_INTERVAL,
+                                               checkout_timeout=settings.DS_NATIVE_POOL_TIMEOUT))
+                self._pools[key] = item
+            item[1].last_used = time.monotonic()
+        for pool in expired:
+            pool.dispose()
+        return item[1]
+
+    def dispose(self, ds_key: str):
+        with self._lock:
+            keys = [k for k, (d, _) in self._pools.items() if d == ds_key]
+            expired = [self._pools.pop(k)[1] for k in keys]
+        for pool in expired:
+            pool.dispose()
+
+    def _evict(self, keep: Optional[str] = None) -> list[ConnectionPool]:
+        # called with self._lock held
+        now = time.monotonic()
+        keys = [k for k, (_, p) in self._pools.items()
+                if k != keep and now - p.last_used > self.idle_timeout and p.checkedout() == 0]
+        return [self._pools.pop(k)[1] for k in keys]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            expired = self._evict()
+            pools = [{"key": k, **p.stats()} for k, (_, p) in self._pools.items()]
+        for pool in expired:
+            pool.dispose()
+        return {"pools": len(pools), "detail": pools}
+
+
+connection_pool_registry = ConnectionPoolRegistry(idle_timeout=settings.DS_POOL_IDLE_TIMEOUT)
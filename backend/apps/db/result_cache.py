@@ -0,0 +1,140 @@
+"""
+SQL 执行结果缓存
+
+键：数据源 id + 数据源版本号 + 归一化 SQL + 权限指纹（Excel 数据源还包含各表的版本号）。
+按数据源开启：过期时间取数据源配置 DatasourceConf.cacheTtl，未配置时使用 SQL_RESULT_CACHE_TTL（默认 0），0 表示不缓存。
+外部数据库的写入无法感知，只有 Excel 数据源在重新导入时失效，开启前需确认数据源能接受 cacheTtl 秒内的旧数据。
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import orjson
+
+from apps.datasource.models.datasource import CoreDatasource, DatasourceConf
+from apps.datasource.utils.utils import aes_decrypt
+from apps.db.db import exec_sql, QueryCanceller
+from common.core.config import settings
+from common.core.sqlbot_cache import SyncCache
+from common.utils.utils import SQLBotLogUtil, prepare_for_orjson
+
+result_cache = SyncCache('sql_result', max_memory_bytes=settings.SQL_RESULT_CACHE_MAX_MEMORY_MB * 1024 * 1024)
+
+_whitespace = re.compile(r'\s+')
+
+
+class _ResultCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def hit(self, saved_seconds: float):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += saved_seconds
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": settings.SQL_RESULT_CACHE_ENABLED and result_cache.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "storage": result_cache.stats(),
+            }
+
+
+_stats = _ResultCacheStats()
+
+
+def normalize_sql(sql: str) -> str:
+    sql = (sql or '').strip()
+    while sql.endswith(';'):
+        sql = sql[:-1].rstrip()
+    return _whitespace.sub(' ', sql)
+
+
+def get_cache_ttl(ds: CoreDatasource, conf: Optional[DatasourceConf] = None) -> int:
+    if not settings.SQL_RESULT_CACHE_ENABLED or not result_cache.enabled or not isinstance(ds, CoreDatasource):
+        return 0
+    if conf is None:
+        conf = _get_conf(ds)
+    if conf is not None and conf.cacheTtl is not None and conf.cacheTtl >= 0:
+        return conf.cacheTtl
+    return settings.SQL_RESULT_CACHE_TTL
+
+
+def _get_conf(ds: CoreDatasource) -> Optional[DatasourceConf]:
+    try:
+        return DatasourceConf(**json.loads(aes_decrypt(ds.configuration)))
+    except Exception:
+        return None
+
+
+def _get_key(ds: CoreDatasource, conf: Optional[DatasourceConf], sql: str, permission_fingerprint: str,
+             origin_column: bool) -> str:
+    parts = [str(ds.id), str(result_cache.get_version(f'ds:{ds.id}')), normalize_sql(sql),
+             permission_fingerprint or '', str(origin_column)]
+    if ds.type == 'excel' and conf is not None and conf.sheets:
+        for sheet in conf.sheets:
+            table_name = sheet.get('tableName') if isinstance(sheet, dict) else None
+            if table_name:
+                parts.append(f'{table_name}:{result_cache.get_version(f"table:{table_name}")}')
+    return hashlib.sha256('\x00'.join(parts).encode('utf-8')).hexdigest()
+
+
+def exec_sql_with_cache(ds: CoreDatasource, sql: str, permission_fingerprint: Callable[[], str], origin_column=False,
+                        cost_guard=False, canceller: Optional[QueryCanceller] = None):
+    """
+    :param permission_fingerprint: 返回用户权限指纹的函数，只在数据源开启结果缓存时调用
+    """
+    conf = _get_conf(ds) if isinstance(ds, CoreDatasource) else None
+    ttl = get_cache_ttl(ds, conf)
+    if ttl <= 0:
+        return exec_sql(ds=ds, sql=sql, origin_column=origin_column, cost_guard=cost_guard, canceller=canceller)
+
+    key = _get_key(ds, conf, sql, permission_fingerprint(), origin_column)
+    cached = result_cache.get_json(key)
+    if cached is not None:
+        _stats.hit(cached.pop('_cost', 0.0))
+        SQLBotLogUtil.info(f"SQL result cache hit on ds_id {ds.id}")
+        return cached
+
+    _stats.miss()
+    start = time.perf_counter()
+    result = exec_sql(ds=ds, sql=sql, origin_column=origin_column, cost_guard=cost_guard, canceller=canceller)
+    cost = time.perf_counter() - start
+    try:
+        value = prepare_for_orjson(result)
+        if len(value.get('data') or []) <= settings.SQL_RESULT_CACHE_MAX_ROWS:
+            result_cache.set(key, orjson.dumps({**value, '_cost': cost}, default=str), ttl)
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Cache SQL result of ds_id {ds.id} failed: {e}")
+    return result
+
+
+def invalidate_datasource_results(ds_id: Optional[int]):
+    if ds_id is not None and result_cache.enabled:
+        result_cache.bump_version(f'ds:{ds_id}')
+
+
+def invalidate_table_results(table_name: str):
+    """Excel 表重新导入后调用，使所有引用该表的数据源的结果缓存失效"""
+    if table_name and result_cache.enabled:
+        result_cache.bump_version(f'table:{table_name}')
+
+
+def get_result_cache_stats() -> Dict[str, Any]:
+    return _stats.to_dict()
@@ -0,0 +1,377 @@
+"""
+基于 sqlglot 的 SQL 改写
+
+对 LLM 生成的 SQL 做确定性的结构化改写，替代额外的 LLM 调用：
+- 行权限：把引用到的有权限规则的表替换为带过滤条件的子查询（ES 直接注入 WHERE 条件）
+- 小助手动态数据源：把表引用替换为 (表对应的 SQL) AS 表名
+"""
+
+import re
+from typing import Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.tokens import TokenType
+
+from common.utils.utils import SQLBotLogUtil
+
+# DB.type -> sqlglot dialect
+_dialects: Dict[str, str] = {
+    'mysql': 'mysql',
+    'sqlServer': 'tsql',
+    'pg': 'postgres',
+    'excel': 'postgres',
+    'oracle': 'oracle',
+    'ck': 'clickhouse',
+    'dm': 'oracle',
+    'doris': 'doris',
+    'redshift': 'redshift',
+    'kingbase': 'postgres',
+    'es': '',
+}
+
+# 不支持子查询的数据源，权限条件直接注入到引用该表的 SELECT 的 WHERE 中
+_inject_where_types = {'es'}
+
+
+def get_dialect(ds_type: str) -> str:
+    return _dialects.get(ds_type, '')
+
+
+def parse_sql(sql: str, ds_type: str) -> Optional[exp.Expression]:
+    """解析单条 SQL，解析失败或包含多条语句时返回 None"""
+    try:
+        statements = sqlglot.parse(sql.strip().rstrip(';'), read=get_dialect(ds_type))
+    except Exception as e:
+        SQLBotLogUtil.warning(f"Parse sql failed ({ds_type}): {e}")
+        return None
+    statements = [s for s in statements if s is not None]
+    if len(statements) != 1:
+        return None
+    return statements[0]
+
+
+def _cte_names(tree: exp.Expression) -> set:
+    return {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+
+
+def _physical_tables(tree: exp.Expression) -> List[exp.Table]:
+    ctes = _cte_names(tree)
+    tables = []
+    for table in tree.find_all(exp.Table):
+        if not table.name:
+            continue
+        if not table.db and table.name.lower() in ctes:
+            # 非递归 CTE 定义内部引用同名表时指向的是物理表
+            cte = table.find_ancestor(exp.CTE)
+            if cte is None or cte.alias_or_name.lower() != table.name.lower():
+                continue
+        tables.append(table)
+    return tables
+
+
+def extract_tables(sql: str, ds_type: str) -> Optional[List[str]]:
+    """返回 SQL 中引用的物理表名（不含 CTE），解析失败返回 None"""
+    tree = parse_sql(sql, ds_type)
+    if tree is None:
+        return None
+    names = []
+    for table in _physical_tables(tree):
+        if table.name not in names:
+            names.append(table.name)
+    return names
+
+
+def _alias_identifier(table: exp.Table) -> exp.Identifier:
+    alias = table.args.get('alias')
+    if alias is not None and alias.this is not None:
+        return alias.this.copy()
+    return table.this.copy()
+
+
+def inject_row_filters(sql: str, filters: List[Dict], ds_type: str) -> Optional[str]:
+    """
+    按表注入行权限条件
+
+    :param filters: [{"table": 表名, "filter": where 条件}]，来自 get_row_permission_filters
+    :return: 改写后的 SQL；SQL 或条件无法解析、或存在带 schema 限定的列引用时返回 None，由调用方回退到 LLM 改写
+    """
+    dialect = get_dialect(ds_type)
+    tree = parse_sql(sql, ds_type)
+    if tree is None:
+        return None
+
+    conditions: Dict[str, exp.Expression] = {}
+    for item in filters:
+        where = item.get('filter')
+        if not item.get('table') or not where or not where.strip():
+            continue
+        try:
+            conditions[item.get('table').lower()] = sqlglot.parse_one(where, read=dialect)
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Parse row permission filter failed ({ds_type}): {where}, {e}")
+            return None
+    if not conditions:
+        return sql
+
+    if ds_type not in _inject_where_types:
+        # 替换为子查询后 schema.table.column 形式的引用无法解析，交给 LLM 改写
+        for column in tree.find_all(exp.Column):
+            if (column.args.get('db') or column.args.get('catalog')) and column.table.lower() in conditions:
+                return None
+
+    for table in _physical_tables(tree):
+        condition = conditions.get(table.name.lower())
+        if condition is None:
+            continue
+        if ds_type in _inject_where_types:
+            select = table.find_ancestor(exp.Select)
+            if select is None:
+                return None
+            select.where(condition.copy(), append=True, copy=False)
+        else:
+            alias = exp.TableAlias(this=_alias_identifier(table))
+            source = table.copy()
+            source.set('alias', None)
+            table.replace(exp.Subquery(this=exp.select('*').from_(source).where(condition.copy()), alias=alias))
+
+    return tree.sql(dialect=dialect)
+
+
+def replace_tables_with_subqueries(sql: str, sub_sqls: Dict[str, str], ds_type: str) -> Optional[str]:
+    """
+    把表引用替换为派生表，别名沿用原别名或表名（保持原有的引号方式）
+
+    :param sub_sqls: {表名: 该表对应的 SQL}
+    :return: 改写后的 SQL；无法解析时返回 None
+    """
+    dialect = get_dialect(ds_type)
+    tree = parse_sql(sql, ds_type)
+    if tree is None:
+        return None
+
+    subs: Dict[str, exp.Expression] = {}
+    for name, sub_sql in sub_sqls.items():
+        sub_tree = parse_sql(sub_sql, ds_type)
+        if sub_tree is None:
+            return None
+        subs[name.lower()] = sub_tree
+
+    for table in _physical_tables(tree):
+        sub_tree = subs.get(table.name.lower())
+        if sub_tree is None:
+            continue
+        table.replace(exp.Subquery(this=sub_tree.copy(), alias=exp.TableAlias(this=_alias_identifier(table))))
+
+    return tree.sql(dialect=dialect)
+
+
+# 直接执行 SQL 时禁止调用的函数与系统 schema
+_forbidden_functions = {'pg_read_file', 'pg_ls_dir', 'pg_stat_file', 'system', 'pg_sleep', 'query_to_xml',
+                        'query_to_xml_and_xmlschema', 'pg_terminate_backend', 'pg_cancel_backend', 'set_config',
+                        'sleep', 'benchmark', 'dbms_lock.sleep', 'dbms_session.sleep'}
+# 按前缀禁止的函数（dblink_*、大对象 lo_*）
+_forbidden_function_prefixes = ('dblink', 'lo_')
+_forbidden_schemas = {'pg_catalog', 'information_schema'}
+
+
+def check_read_only(sql: str, ds_type: str) -> Optional[str]:
+    """
+    校验 SQL 为单条只读查询（不含 FOR UPDATE 等加锁子句）
+
+    :return: 不合法时返回原因，合法返回空字符串；无法解析返回 None。调用方无论结果如何都还需要做关键字校验
+    """
+    tree = parse_sql(sql, ds_type)
+    if tree is None:
+        return None
+    if not isinstance(tree, exp.Query):
+        return 'Only SELECT statements are allowed'
+    for node in tree.walk():
+        if isinstance(node, (exp.DML, exp.DDL, exp.Command, exp.Set, exp.Transaction, exp.Commit,
+                             exp.Rollback, exp.Grant)):
+            return 'Only SELECT statements are allowed'
+        if isinstance(node, exp.Lock):
+            return 'Locking clauses are not allowed'
+        if isinstance(node, exp.Func):
+            name = (node.name if isinstance(node, exp.Anonymous) else node.sql_name()).lower()
+            if isinstance(node.parent, exp.Dot) and node.parent.expression is node:
+                # 包限定的函数，如 oracle dbms_lock.sleep
+                name = f'{node.parent.this.name.lower()}.{name}'
+            base_name = name.split('.')[-1]
+            if name in _forbidden_functions or base_name in _forbidden_functions or \
+                    base_name.startswith(_forbidden_function_prefixes):
+                return f'Function {name} is not allowed'
+        if isinstance(node, exp.Table) and node.db and node.db.lower() in _forbidden_schemas:
+            return f'Schema {node.db} is not allowed'
+    return ''
+
+
+def _literal_int(node: Optional[exp.Expression]) -> Optional[int]:
+    if isinstance(node, exp.Literal) and not node.is_string:
+        try:
+            return int(node.this)
+        except ValueError:
+            return None
+    return None
+
+
+def _limit_count(query: exp.Query) -> Optional[exp.Expression]:
+    """已有 LIMIT / TOP / FETCH 的行数表达式；按百分比的 TOP / FETCH 返回 None"""
+    limit = query.args.get('limit')
+    if limit is None or limit.args.get('percent'):
+        return None
+    if isinstance(limit, exp.Limit):
+        return limit.expression
+    if isinstance(limit, exp.Fetch):
+        return limit.args.get('count')
+    return None
+
+
+def _rownum_condition(select: exp.Select) -> Optional[exp.Expression]:
+    where = select.args.get('where')
+    if where is None:
+        return None
+    conditions = where.this.flatten() if isinstance(where.this, exp.And) else [where.this]
+    for cond in conditions:
+        if isinstance(cond, (exp.LTE, exp.LT)) and isinstance(cond.this, exp.Column) and \
+                cond.this.name.lower() == 'rownum' and _literal_int(cond.expression) is not None:
+            return cond
+    return None
+
+
+def _rownum_bound(query: exp.Query) -> Optional[int]:
+    """oracle/dm 外层 WHERE ROWNUM <= n 的上限（有 ORDER BY 时 ROWNUM 先于排序生效，排序结果不对但行数同样受限）"""
+    if not isinstance(query, exp.Select):
+        return None
+    rownum = _rownum_condition(query)
+    if rownum is None:
+        return None
+    return _literal_int(rownum.expression) - (1 if isinstance(rownum, exp.LT) else 0)
+
+
+def _outer_select_end(body: str, dialect: str) -> Optional[int]:
+    """外层 SELECT（以及其后的 DISTINCT / ALL）关键字结束的位置，用于插入 TOP"""
+    try:
+        tokens = sqlglot.Dialect.get_or_raise(dialect).tokenize(body)
+    except Exception:
+        return None
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token.token_type == TokenType.L_PAREN:
+            depth += 1
+        elif token.token_type == TokenType.R_PAREN:
+            depth -= 1
+        elif token.token_type == TokenType.SELECT and depth == 0:
+            end = token.end
+            if i + 1 < len(tokens) and tokens[i + 1].token_type in (TokenType.DISTINCT, TokenType.ALL):
+                end = tokens[i + 1].end
+            return end + 1
+    return None
+
+
+def _oracle_fetch_first(ds_type: str, db_version: str) -> bool:
+    """FETCH FIRST 从 oracle 12c 开始支持；版本未知时按旧版本处理"""
+    if ds_type != 'oracle':
+        return True
+    match = re.match(r'\s*(\d+)', db_version or '')
+    return bool(match) and int(match.group(1)) >= 12
+
+
+def _wrap_rownum(tree: exp.Query, body: str, limit: int, dialect: str) -> Optional[str]:
+    """
+    旧版本 oracle 包一层 SELECT * FROM (...) WHERE ROWNUM <= n。
+    派生表的列名必须唯一：外层列名重复时为重复的列加上别名后重新生成内层 SQL，
+    包含 * 且有关联时无法确定列名，返回 None
+    """
+    select = tree
+    while not isinstance(select, exp.Select):
+        select = select.this
+        if select is None:
+            return None
+    if any(isinstance(e, exp.Star) or (isinstance(e, exp.Column) and isinstance(e.this, exp.Star))
+           for e in select.expressions) and select.args.get('joins'):
+        return None
+
+    names = [e.alias_or_name.upper() for e in select.expressions]
+    inner = body
+    if len(set(names)) != len(names):
+        tree = tree.copy()
+        select = tree
+        while not isinstance(select, exp.Select):
+            select = select.this
+        seen = set(names)
+        used = set()
+        for projection, name in zip(list(select.expressions), names):
+            if name not in used:
+                used.add(name)
+                continue
+            index = 2
+            while f'{name}_{index}' in seen:
+                index += 1
+            alias = f'{name}_{index}'
+            seen.add(alias)
+            projection.replace(exp.alias_(projection.unalias(), alias, quoted=True))
+        try:
+            inner = tree.sql(dialect=dialect)
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Generate sql failed ({dialect}): {e}")
+            return None
+    # 换行后再闭合括号，原 SQL 以行注释结尾时也不会把括号注释掉
+    return f'SELECT * FROM (\n{inner}\n) WHERE ROWNUM <= {limit}'
+
+
+def apply_row_limit(sql: str, limit: int, ds_type: str, db_version: str = '') -> Optional[str]:
+    """
+    按数据源方言为查询加上行数上限。借助语法树定位后直接修改原 SQL 文本，不重新生成、也不包子查询，
+    执行的 SQL 与保存、展示给用户的 SQL 保持一致（重新生成会改写函数写法，派生表要求列名唯一且非空）：
+
+    - 已有不大于上限的 LIMIT / TOP / FETCH / ROWNUM 条件时保持不变，已有更大的字面量上限时原位改小
+    - 没有上限时：mysql/pg/ck/doris/es 等在末尾追加 LIMIT；sqlServer 在外层 SELECT 后插入 TOP，
+      UNION 带 ORDER BY 时追加 OFFSET 0 ROWS FETCH NEXT；oracle 12c 及以上和 dm 追加 FETCH FIRST n ROWS ONLY，
+      更早或未知版本的 oracle 包一层 SELECT * FROM (...) WHERE ROWNUM <= n
+    - 无法安全修改时（非字面量或百分比上限、只有 OFFSET、ck 的 SETTINGS / FORMAT 等）保持不变，
+      由 fetch_result 的读取上限兜底
+
+    :param db_version: get_version 取到的数据库版本，用于判断 oracle 是否支持 FETCH FIRST
+
+    :return: 加上上限后的 SQL；无法解析或不是查询语句时返回 None
+    """
+    body = sql.strip()
+    while body.endswith(';'):
+        body = body[:-1].rstrip()
+    tree = parse_sql(body, ds_type)
+    if tree is None or not isinstance(tree, exp.Query):
+        return None
+
+    if tree.args.get('limit') is not None:
+        count = _limit_count(tree)
+        value = _literal_int(count)
+        if value is None or value <= limit:
+            return sql
+        start, end = count.meta.get('start'), count.meta.get('end')
+        if start is None or end is None or body[start:end + 1] != count.this:
+            return sql
+        return f'{body[:start]}{limit}{body[end + 1:]}'
+
+    # 换行追加，原 SQL 以行注释结尾时也不会把新加的部分注释掉
+    if ds_type in ('oracle', 'dm'):
+        bound = _rownum_bound(tree)
+        if bound is not None and bound <= limit:
+            return sql
+        if _oracle_fetch_first(ds_type, db_version):
+            return f'{body}\nFETCH FIRST {limit} ROWS ONLY'
+        return _wrap_rownum(tree, body, limit, get_dialect(ds_type)) or sql
+    if ds_type == 'sqlServer':
+        if tree.args.get('offset') is not None:
+            return f'{body}\nFETCH NEXT {limit} ROWS ONLY'
+        if isinstance(tree, exp.Select):
+            position = _outer_select_end(body, get_dialect(ds_type))
+            if position is None:
+                return sql
+            return f'{body[:position]} TOP {limit}{body[position:]}'
+        if tree.args.get('order'):
+            return f'{body}\nOFFSET 0 ROWS FETCH NEXT {limit} ROWS ONLY'
+        return sql
+    if tree.args.get('offset') is not None or tree.args.get('settings') or tree.args.get('format'):
+        return sql
+    return f'{body}\nLIMIT {limit}'
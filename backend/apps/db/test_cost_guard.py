@@ -0,0 +1,86 @@
+import json
+
+from apps.db.cost_guard import parse_explain
+
+# EXPLAIN (FORMAT JSON) SELECT * FROM orders LIMIT 1001
+_pg_limit_plan = [{
+    "Plan": {
+        "Node Type": "Limit",
+        "Startup Cost": 0.0,
+        "Total Cost": 15.41,
+        "Plan Rows": 1001,
+        "Plans": [{
+            "Node Type": "Seq Scan",
+            "Parent Relationship": "Outer",
+            "Relation Name": "orders",
+            "Startup Cost": 0.0,
+            "Total Cost": 15406250.0,
+            "Plan Rows": 1000000000,
+        }],
+    }
+}]
+
+# 两表无条件连接后再取前 1001 行
+_pg_nested_plan = [{
+    "Plan": {
+        "Node Type": "Limit",
+        "Total Cost": 20.5,
+        "Plan Rows": 1001,
+        "Plans": [{
+            "Node Type": "Nested Loop",
+            "Total Cost": 2500000.0,
+            "Plan Rows": 250000000,
+            "Plans": [
+                {"Node Type": "Seq Scan", "Relation Name": "a", "Total Cost": 180.0, "Plan Rows": 10000},
+                {"Node Type": "Materialize", "Total Cost": 230.0, "Plan Rows": 25000,
+                 "Plans": [{"Node Type": "Seq Scan", "Relation Name": "b", "Total Cost": 180.0,
+                            "Plan Rows": 25000}]},
+            ],
+        }],
+    }
+}]
+
+_redshift_plan = [
+    ("XN Limit  (cost=0.00..10.01 rows=1001 width=8)",),
+    ("  ->  XN Seq Scan on orders  (cost=0.00..50000000.00 rows=5000000000 width=8)",),
+]
+
+
+class TestParseExplain:
+
+    def test_pg_limit_over_seq_scan(self):
+        """测试 pg 顶层 Limit 节点下的全表扫描按扫描节点的估算计算"""
+        rows, cost = parse_explain('pg', [(json.dumps(_pg_limit_plan),)])
+        assert rows == 1000000000
+        assert cost == 15406250.0
+
+    def test_pg_nested_plan(self):
+        """测试 pg 多层嵌套计划取所有节点的最大值"""
+        rows, cost = parse_explain('kingbase', [(_pg_nested_plan,)])
+        assert rows == 250000000
+        assert cost == 2500000.0
+
+    def test_redshift_limit_over_seq_scan(self):
+        """测试 redshift 文本计划取所有节点的最大值"""
+        rows, cost = parse_explain('redshift', _redshift_plan)
+        assert rows == 5000000000
+        assert cost == 50000000.0
+
+    def test_mysql_nested(self):
+        """测试 mysql 取嵌套连接中最大的扫描行数"""
+        plan = {"query_block": {"cost_info": {"query_cost": "1200.50"}, "nested_loop": [
+            {"table": {"table_name": "a", "rows_examined_per_scan": 100, "rows_produced_per_join": 100}},
+            {"table": {"table_name": "b", "rows_examined_per_scan": 50000, "rows_produced_per_join": 5000000}},
+        ]}}
+        rows, cost = parse_explain('mysql', [(json.dumps(plan),)])
+        assert rows == 5000000
+        assert cost == 1200.5
+
+    def test_doris_cardinality(self):
+        """测试 doris 取最大的 cardinality"""
+        result = [("  0:VOlapScanNode",), ("     cardinality=800000",), ("  1:VEXCHANGE",), ("     cardinality=1001",)]
+        assert parse_explain('doris', result) == (800000, None)
+
+    def test_empty(self):
+        """测试没有计划时返回 None"""
+        assert parse_explain('pg', []) == (None, None)
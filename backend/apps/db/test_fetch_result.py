@@ -0,0 +1,87 @@
+import pytest
+
+from apps.db.db import _declare_result_cursor, fetch_result
+from common.core.config import settings
+
+
+class _Batches:
+    """模拟 cursor.fetchmany，记录读取次数"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.calls = 0
+
+    def __call__(self, size):
+        self.calls += 1
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setattr(settings, 'SQL_RESULT_MAX_ROWS', 3)
+    monkeypatch.setattr(settings, 'SQL_RESULT_MAX_BYTES', 1024)
+    monkeypatch.setattr(settings, 'SQL_RESULT_FETCH_BATCH', 2)
+
+
+class TestFetchResult:
+
+    def test_all_rows(self, small_limits):
+        """测试行数恰好等于上限时完整返回，不标记截断"""
+        result = fetch_result(['id', 'name'], _Batches([(1, 'a'), (2, 'b'), (3, 'c')]), 'select 1')
+        assert result['data'] == [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}]
+        assert not result['truncated']
+
+    def test_row_cap(self, small_limits):
+        """测试超过行数上限时停止读取并标记截断"""
+        batches = _Batches([(i,) for i in range(100)])
+        result = fetch_result(['id'], batches, 'select 1')
+        assert [r['id'] for r in result['data']] == [0, 1, 2]
+        assert result['truncated']
+        assert batches.calls == 2
+
+    def test_byte_cap(self, small_limits):
+        """测试估算大小超过上限时停止读取并标记截断"""
+        result = fetch_result(['text'], _Batches([('x' * 600,), ('y' * 600,), ('z',)]), 'select 1')
+        assert len(result['data']) == 2
+        assert result['truncated']
+
+    def test_empty(self, small_limits):
+        """测试空结果"""
+        result = fetch_result(['id'], _Batches([]), 'select 1')
+        assert result['data'] == []
+        assert not result['truncated']
+
+
+class _DeclaredCursor:
+    """模拟 DECLARE / FETCH FORWARD 的服务端游标，记录执行的语句"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.statements = []
+        self.description = None
+        self._batch = []
+
+    def execute(self, sql):
+        self.statements.append(sql)
+        if sql.startswith('FETCH FORWARD'):
+            size = int(sql.split()[2])
+            self._batch, self.rows = self.rows[:size], self.rows[size:]
+            self.description = [('ID',)]
+
+    def fetchall(self):
+        return self._batch
+
+
+class TestDeclareResultCursor:
+
+    def test_fetch_in_batches(self, small_limits):
+        """测试声明服务端游标后分批 FETCH，截断后不再读取剩余的行"""
+        cursor = _DeclaredCursor([(i,) for i in range(100)])
+        description, fetch_batch = _declare_result_cursor(cursor, 'SELECT id FROM t')
+        assert description == [('ID',)]
+        result = fetch_result(['id'], fetch_batch, 'SELECT id FROM t')
+        assert [r['id'] for r in result['data']] == [0, 1, 2]
+        assert result['truncated']
+        assert cursor.statements[0] == 'DECLARE sqlbot_result CURSOR FOR SELECT id FROM t'
+        assert len(cursor.statements) == 3
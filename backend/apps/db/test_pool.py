@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+from apps.db.pool import ConnectionPool, ConnectionPoolRegistry, EngineRegistry
+
+
+class _FakeConnection:
+    def __init__(self, fail_rollback: bool = False):
+        self.closed = False
+        self.fail_rollback = fail_rollback
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise RuntimeError('connection lost')
+
+    def ping(self):
+        if self.closed:
+            raise RuntimeError('closed')
+
+    def close(self):
+        self.closed = True
+
+
+class _FakePool:
+    def __init__(self):
+        self.checked_out = 0
+
+    def checkedout(self):
+        return self.checked_out
+
+
+class _FakeEngine:
+    def __init__(self):
+        self.pool = _FakePool()
+        self.disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+def _expire(registry_entry_owner, seconds: float = 3600):
+    registry_entry_owner.last_used = time.monotonic() - seconds
+
+
+class TestConnectionPool:
+
+    def test_reuse_connection(self):
+        """测试归还的连接被再次借出，不重复创建"""
+        created = []
+        pool = ConnectionPool('t', lambda: created.append(_FakeConnection()) or created[-1], max_size=2,
+                              idle_timeout=60, check_interval=30, checkout_timeout=1)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            assert second is first
+        assert len(created) == 1
+
+    def test_exhausted(self):
+        """测试连接数达到上限时等待超时后报错"""
+        pool = ConnectionPool('t', _FakeConnection, max_size=1, idle_timeout=60, check_interval=30,
+                              checkout_timeout=0.1)
+        with pool.connection():
+            with pytest.raises(TimeoutError):
+                with pool.connection():
+                    pass
+        assert pool.stats()['checkedout'] == 0
+
+    def test_discard_on_rollback_failure(self):
+        """测试归还时回滚失败的连接被丢弃"""
+        conn = _FakeConnection(fail_rollback=True)
+        pool = ConnectionPool('t', lambda: conn, max_size=1, idle_timeout=60, check_interval=30, checkout_timeout=1)
+        with pool.connection():
+            pass
+        assert conn.closed
+        assert pool.stats()['size'] == 0
+
+
+class TestConnectionPoolRegistry:
+
+    def test_expired_pool_not_returned(self):
+        """测试已超过空闲时间的连接池在 get 时不会被释放后再返回"""
+        registry = ConnectionPoolRegistry(idle_timeout=60)
+        pool = registry.get('ds:1', 'a', _FakeConnection)
+        _expire(pool)
+        assert registry.get('ds:1', 'a', _FakeConnection) is pool
+        assert not pool._disposed
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            assert second is first
+
+    def test_evict_other_idle_pools(self):
+        """测试 get 时释放其他空闲超时的连接池"""
+        registry = ConnectionPoolRegistry(idle_timeout=60)
+        idle = registry.get('ds:1', 'a', _FakeConnection)
+        _expire(idle)
+        registry.get('ds:2', 'a', _FakeConnection)
+        assert idle._disposed
+        assert registry.get('ds:1', 'a', _FakeConnection) is not idle
+
+
+class TestEngineRegistry:
+
+    def test_expired_engine_not_returned(self):
+        """测试已超过空闲时间的 Engine 在 get 时不会被释放后再返回"""
+        registry = EngineRegistry(idle_timeout=60, max_engines=10)
+        engine = registry.get('ds:1', 'a', _FakeEngine)
+        _expire(registry._engines['ds:1:a'])
+        assert registry.get('ds:1', 'a', _FakeEngine) is engine
+        assert not engine.disposed
+
+    def test_evict_idle_and_overflow(self):
+        """测试空闲超时和超过数量上限的 Engine 被释放，有连接正在使用的保留"""
+        registry = EngineRegistry(idle_timeout=60, max_engines=2)
+        idle = registry.get('ds:1', 'a', _FakeEngine)
+        busy = registry.get('ds:2', 'a', _FakeEngine)
+        busy.pool.checked_out = 1
+        _expire(registry._engines['ds:1:a'])
+        _expire(registry._engines['ds:2:a'])
+        other = registry.get('ds:3', 'a', _FakeEngine)
+        assert idle.disposed
+        assert not busy.disposed
+        registry.get('ds:4', 'a', _FakeEngine)
+        assert other.disposed
+        assert not busy.disposed
+        assert len(registry._engines) == 2
+        busy.pool.checked_out = 0
+        registry.get('ds:5', 'a', _FakeEngine)
+        assert busy.disposed
+        assert len(registry._engines) == 2
+
+    def test_config_change(self):
+        """测试配置变化后生成新的 Engine，dispose 释放数据源的所有 Engine"""
+        registry = EngineRegistry(idle_timeout=60, max_engines=10)
+        old = registry.get('ds:1', 'a', _FakeEngine)
+        new = registry.get('ds:1', 'b', _FakeEngine)
+        assert new is not old
+        registry.dispose('ds:1')
+        assert old.disposed and new.disposed
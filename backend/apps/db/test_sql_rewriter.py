@@ -0,0 +1,188 @@
+from apps.db.sql_rewriter import apply_row_limit, check_read_only, extract_tables, inject_row_filters, \
+    replace_tables_with_subqueries
+
+
+class TestApplyRowLimit:
+
+    def test_append_limit(self):
+        """测试没有上限时在末尾追加 LIMIT，原 SQL 文本保持不变"""
+        sql = "SELECT toStartOfMonth(d) AS m, count(*) FROM t GROUP BY m"
+        assert apply_row_limit(sql, 1001, 'ck') == sql + '\nLIMIT 1001'
+
+    def test_keep_smaller_limit(self):
+        """测试已有更小的上限时保持不变"""
+        sql = "SELECT x::date FROM t LIMIT 10"
+        assert apply_row_limit(sql, 1001, 'pg') == sql
+
+    def test_lower_larger_limit_in_place(self):
+        """测试已有更大的字面量上限时原位改小，不包子查询"""
+        sql = "SELECT a.id, b.id FROM a JOIN b ON a.x = b.x LIMIT 5000;"
+        assert apply_row_limit(sql, 1001, 'mysql') == "SELECT a.id, b.id FROM a JOIN b ON a.x = b.x LIMIT 1001"
+
+    def test_lower_mysql_offset_limit(self):
+        """测试 mysql LIMIT offset, count 只修改行数"""
+        assert apply_row_limit("SELECT a FROM t LIMIT 10, 5000", 1001, 'mysql') == "SELECT a FROM t LIMIT 10, 1001"
+
+    def test_line_comment_at_end(self):
+        """测试原 SQL 以行注释结尾时追加的上限不被注释掉"""
+        assert apply_row_limit("SELECT 1 -- note", 1001, 'pg') == "SELECT 1 -- note\nLIMIT 1001"
+
+    def test_offset_without_limit_unchanged(self):
+        """测试只有 OFFSET 时保持不变，由读取上限兜底"""
+        sql = "SELECT a FROM t OFFSET 5"
+        assert apply_row_limit(sql, 1001, 'pg') == sql
+
+    def test_sqlserver_aggregate_only(self):
+        """测试 sqlServer 只有聚合列时在外层 SELECT 上加 TOP，不产生无列名的派生表"""
+        assert apply_row_limit("SELECT COUNT(*) FROM orders", 1001, 'sqlServer') == \
+               "SELECT TOP 1001 COUNT(*) FROM orders"
+
+    def test_sqlserver_duplicate_columns(self):
+        """测试 sqlServer 重复列名和 DISTINCT、ORDER BY"""
+        sql = "SELECT DISTINCT a.id, b.id FROM a JOIN b ON a.x = b.x ORDER BY 1"
+        assert apply_row_limit(sql, 1001, 'sqlServer') == \
+               "SELECT DISTINCT TOP 1001 a.id, b.id FROM a JOIN b ON a.x = b.x ORDER BY 1"
+
+    def test_sqlserver_cte(self):
+        """测试 sqlServer 带 CTE 时 TOP 加在外层 SELECT 上"""
+        sql = "WITH x AS (SELECT TOP 5 a FROM t) SELECT a FROM x"
+        assert apply_row_limit(sql, 1001, 'sqlServer') == "WITH x AS (SELECT TOP 5 a FROM t) SELECT TOP 1001 a FROM x"
+
+    def test_sqlserver_lower_top(self):
+        """测试 sqlServer 已有更大的 TOP 时原位改小"""
+        assert apply_row_limit("SELECT TOP (5000) a FROM t", 1001, 'sqlServer') == "SELECT TOP (1001) a FROM t"
+
+    def test_sqlserver_union(self):
+        """测试 sqlServer UNION 带 ORDER BY 时追加 FETCH，不带时保持不变"""
+        sql = "SELECT a FROM t UNION SELECT b FROM u"
+        assert apply_row_limit(sql, 1001, 'sqlServer') == sql
+        assert apply_row_limit(sql + " ORDER BY 1", 1001, 'sqlServer') == \
+               sql + " ORDER BY 1\nOFFSET 0 ROWS FETCH NEXT 1001 ROWS ONLY"
+
+    def test_oracle_fetch_first(self):
+        """测试 oracle 12c 及以上和 dm 追加 FETCH FIRST"""
+        sql = "SELECT a.id, b.id FROM a JOIN b ON a.x = b.x"
+        assert apply_row_limit(sql, 1001, 'oracle', '19.0.0.0.0') == sql + '\nFETCH FIRST 1001 ROWS ONLY'
+        assert apply_row_limit(sql, 1001, 'dm') == sql + '\nFETCH FIRST 1001 ROWS ONLY'
+
+    def test_oracle_rownum_wrap(self):
+        """测试 oracle 12c 以前或版本未知时包 ROWNUM 子查询，重复列名加上别名"""
+        sql = 'SELECT "id" FROM "T" ORDER BY "id"'
+        assert apply_row_limit(sql, 1001, 'oracle', '11.2.0.4.0') == \
+               f'SELECT * FROM (\n{sql}\n) WHERE ROWNUM <= 1001'
+        assert apply_row_limit(sql, 1001, 'oracle') == f'SELECT * FROM (\n{sql}\n) WHERE ROWNUM <= 1001'
+        assert apply_row_limit("SELECT a.id, b.id FROM a JOIN b ON a.x = b.x", 1001, 'oracle', '11.2') == \
+               'SELECT * FROM (\nSELECT a.id, b.id AS "ID_2" FROM a JOIN b ON a.x = b.x\n) WHERE ROWNUM <= 1001'
+        sql = "SELECT * FROM a JOIN b ON a.x = b.x"
+        assert apply_row_limit(sql, 1001, 'oracle', '11.2') == sql
+
+    def test_oracle_existing_bounds(self):
+        """测试 oracle 已有 ROWNUM 条件（包括带 ORDER BY 时）保持不变，已有更大的 FETCH FIRST 原位改小"""
+        sql = "SELECT a FROM t WHERE ROWNUM <= 10"
+        assert apply_row_limit(sql, 1001, 'oracle') == sql
+        sql = 'SELECT "id" FROM "T" WHERE ROWNUM <= 1000 ORDER BY "id"'
+        assert apply_row_limit(sql, 1001, 'oracle', '19.0.0.0.0') == sql
+        assert apply_row_limit("SELECT a FROM t FETCH FIRST 5000 ROWS ONLY", 1001, 'oracle', '19.0.0.0.0') == \
+               "SELECT a FROM t FETCH FIRST 1001 ROWS ONLY"
+
+    def test_ck_settings_and_format(self):
+        """测试 ck 以 SETTINGS / FORMAT 结尾时保持不变"""
+        sql = "SELECT a FROM t SETTINGS max_threads = 1"
+        assert apply_row_limit(sql, 1001, 'ck') == sql
+        sql = "SELECT a FROM t FORMAT JSONEachRow"
+        assert apply_row_limit(sql, 1001, 'ck') == sql
+
+    def test_not_query(self):
+        """测试非查询语句返回 None"""
+        assert apply_row_limit("DELETE FROM t", 1001, 'pg') is None
+
+
+class TestCheckReadOnly:
+
+    def test_plain_select(self):
+        """测试普通查询通过校验"""
+        assert check_read_only("SELECT a.id, count(*) FROM t a GROUP BY a.id", 'pg') == ''
+
+    def test_not_select(self):
+        """测试非查询语句被拒绝"""
+        assert check_read_only("DELETE FROM t", 'pg')
+        assert check_read_only("UPDATE t SET a = 1", 'mysql')
+
+    def test_locking_clause(self):
+        """测试 FOR UPDATE 被拒绝"""
+        assert check_read_only("SELECT * FROM t FOR UPDATE", 'pg')
+
+    def test_forbidden_functions(self):
+        """测试执行任意 SQL、终止会话和长时间占用连接的函数被拒绝"""
+        assert check_read_only("SELECT query_to_xml('delete from orders', true, true, '')", 'pg')
+        assert check_read_only("SELECT pg_terminate_backend(1)", 'pg')
+        assert check_read_only("SELECT lo_get(1)", 'pg')
+        assert check_read_only("SELECT sleep(100)", 'mysql')
+        assert check_read_only("SELECT benchmark(1000000000, md5('a'))", 'doris')
+        assert check_read_only("SELECT dbms_lock.sleep(5) FROM dual", 'oracle')
+        assert check_read_only("SELECT sys.dbms_session.sleep(5) FROM dual", 'oracle')
+
+    def test_system_schema(self):
+        """测试访问系统 schema 被拒绝"""
+        assert check_read_only("SELECT * FROM pg_catalog.pg_user", 'pg')
+
+    def test_unparsable(self):
+        """测试无法解析时返回 None，由调用方做关键字校验"""
+        assert check_read_only("SELEC a FROM", 'pg') is None
+
+
+class TestExtractTables:
+
+    def test_skip_cte(self):
+        """测试返回物理表，不含 CTE"""
+        sql = "WITH x AS (SELECT * FROM a) SELECT * FROM x JOIN b ON x.id = b.id"
+        assert sorted(extract_tables(sql, 'pg')) == ['a', 'b']
+
+    def test_unparsable(self):
+        """测试无法解析时返回 None"""
+        assert extract_tables("SELEC a FROM", 'pg') is None
+
+
+class TestInjectRowFilters:
+
+    def test_keep_quoted_alias(self):
+        """测试替换为子查询后保留别名的引号"""
+        sql = 'SELECT "Ord"."a" FROM orders "Ord" WHERE "Ord"."a" = 1'
+        assert inject_row_filters(sql, [{'table': 'orders', 'filter': '"b" = 2'}], 'pg') == \
+               'SELECT "Ord"."a" FROM (SELECT * FROM orders WHERE "b" = 2) AS "Ord" WHERE "Ord"."a" = 1'
+
+    def test_cte_with_same_name(self):
+        """测试与 CTE 同名时只替换 CTE 内部引用的物理表"""
+        sql = 'WITH orders AS (SELECT * FROM orders) SELECT a FROM orders'
+        assert inject_row_filters(sql, [{'table': 'orders', 'filter': '"b" = 2'}], 'pg') == \
+               'WITH orders AS (SELECT * FROM (SELECT * FROM orders WHERE "b" = 2) AS orders) SELECT a FROM orders'
+
+    def test_schema_qualified_column(self):
+        """测试存在 schema 限定的列引用时返回 None，回退到 LLM 改写"""
+        sql = 'SELECT public.orders.a FROM public.orders'
+        assert inject_row_filters(sql, [{'table': 'orders', 'filter': '"b" = 2'}], 'pg') is None
+
+    def test_es_inject_where(self):
+        """测试 ES 直接把条件注入 WHERE"""
+        assert inject_row_filters("SELECT a FROM orders WHERE c = 1", [{'table': 'orders', 'filter': 'b = 2'}],
+                                  'es') == "SELECT a FROM orders WHERE c = 1 AND b = 2"
+
+    def test_no_matching_table(self):
+        """测试没有引用有规则的表时保持不变"""
+        assert inject_row_filters("SELECT a FROM t", [{'table': 'orders', 'filter': 'b = 2'}], 'pg') == \
+               "SELECT a FROM t"
+
+    def test_invalid_filter(self):
+        """测试条件无法解析时返回 None"""
+        assert inject_row_filters("SELECT a FROM orders", [{'table': 'orders', 'filter': 'b = '}], 'pg') is None
+
+
+class TestReplaceTablesWithSubqueries:
+
+    def test_keep_alias(self):
+        """测试派生表沿用原别名或表名（保持引号方式）"""
+        sql = 'SELECT o.a FROM orders o JOIN "Items" ON o.id = "Items".oid'
+        assert replace_tables_with_subqueries(sql, {'orders': 'SELECT * FROM x WHERE y = 1',
+                                                    'items': 'SELECT 1 AS oid'}, 'pg') == \
+               'SELECT o.a FROM (SELECT * FROM x WHERE y = 1) AS o JOIN (SELECT 1 AS oid) AS "Items" ' \
+               'ON o.id = "Items".oid'
@@ -3,6 +3,7 @@
 import json
 import traceback
 from datetime import timedelta
+from typing import Optional
 
 import jwt
 from fastapi import HTTPException, status, APIRouter
@@ -28,6 +29,7 @@ from common.core.config import settings
 from common.core.deps import SessionDep
 from common.core.schemas import TokenPayload, XOAuth2PasswordBearer, Token
 from common.core.security import create_access_token
+from common.error import ChatTaskRejectedError
 
 reusable_oauth2 = XOAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
@@ -110,12 +112,17 @@ async def mcp_question(session: SessionDep, chat: McpQuestion):
 
     mcp_chat = ChatMcp(token=chat.token, chat_id=chat.chat_id, question=chat.question)
 
+    llm_service: Optional[LLMService] = None
     try:
         llm_service = await LLMService.create(session_user, mcp_chat)
         llm_service.init_record()
         llm_service.run_task_async(False, chat.stream)
+    except ChatTaskRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
     except Exception as e:
         traceback.print_exc()
+        if llm_service:
+            llm_service.close()
 
         if chat.stream:
             def _err(_e: Exception):
@@ -132,7 +139,7 @@ async def mcp_question(session: SessionDep, chat: McpQuestion):
     else:
         res = llm_service.await_result()
         raw_data = {}
-        for chunk in res:
+        async for chunk in res:
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -166,12 +173,17 @@ async def mcp_assistant(session: SessionDep, chat: McpAssistant):
     # assistant question
     mcp_chat = ChatQuestion(chat_id=c.id, question=chat.question)
     # ask
+    llm_service: Optional[LLMService] = None
     try:
         llm_service = await LLMService.create(session_user, mcp_chat, mcp_assistant_header)
         llm_service.init_record()
         llm_service.run_task_async(False, chat.stream, ChatFinishStep.QUERY_DATA)
+    except ChatTaskRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': str(e.retry_after)})
     except Exception as e:
         traceback.print_exc()
+        if llm_service:
+            llm_service.close()
 
         if chat.stream:
             def _err(_e: Exception):
@@ -188,7 +200,7 @@ async def mcp_assistant(session: SessionDep, chat: McpAssistant):
     else:
         res = llm_service.await_result()
         raw_data = {}
-        for chunk in res:
+        async for chunk in res:
             if chunk:
                 raw_data = chunk
         status_code = 200
@@ -145,9 +145,38 @@ def setup_scheduler(app: FastAPI) -> AsyncIOScheduler:
         SQLBotLogUtil.info("[APS] registered daily cleanup job for processed Excel files")
     except Exception as e:
         SQLBotLogUtil.error(f"[APS] failed to add cleanup job: {e}")
+
+    # Daily cleanup job for chat payloads stored out of line that are no longer referenced
+    if settings.CHAT_STORAGE_GC_GRACE_HOURS > 0:
+        try:
+            scheduler.add_job(
+                _cleanup_chat_storage,
+                trigger=CronTrigger(minute=30, hour=3, timezone=scheduler.timezone),
+                id="cleanup_chat_storage",
+                replace_existing=True,
+                coalesce=True,
+                max_instances=1,
+            )
+            SQLBotLogUtil.info("[APS] registered daily cleanup job for chat storage")
+        except Exception as e:
+            SQLBotLogUtil.error(f"[APS] failed to add chat storage cleanup job: {e}")
     return scheduler
 
 
+def _cleanup_chat_storage():
+    from sqlmodel import Session
+    from common.core.db import engine
+    from apps.chat.curd import log_prompt, record_blob
+    try:
+        with Session(engine) as session:
+            removed_blobs = record_blob.collect_garbage(session)
+            removed_prompts = log_prompt.collect_garbage(session)
+        SQLBotLogUtil.info(f"[APS] chat storage cleanup finished, removed {removed_blobs} chat record blobs "
+                           f"and {removed_prompts} chat log prompts")
+    except Exception as e:
+        SQLBotLogUtil.error(f"[APS] chat storage cleanup failed: {e}")
+
+
 def add_cron_demo_job(app: FastAPI, cron: str, job_id: str = "cron_demo") -> None:
     """Add a cron-based demo job with a standard Cron expression.
 
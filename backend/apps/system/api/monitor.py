@@ -0,0 +1,45 @@
+from fastapi import APIRouter
+
+from apps.chat.task.scheduler import chat_task_scheduler
+from apps.chat.task.sql_cache import get_sql_cache_stats
+from apps.db.pool import engine_registry, connection_pool_registry
+from apps.db.result_cache import get_result_cache_stats
+from common.core.db import get_pool_status
+from common.core.deps import CurrentUser, Trans
+
+router = APIRouter(tags=["system/monitor"], prefix="/system/monitor")
+
+
+def check_admin(current_user: CurrentUser, trans: Trans):
+    if not current_user.isAdmin:
+        raise Exception(trans('i18n_permission.no_permission', url=", ", msg=trans('i18n_permission.only_admin')))
+
+
+@router.get("/pool")
+async def pool_status(current_user: CurrentUser, trans: Trans):
+    check_admin(current_user, trans)
+    return get_pool_status()
+
+
+@router.get("/chat_task")
+async def chat_task_status(current_user: CurrentUser, trans: Trans):
+    check_admin(current_user, trans)
+    return chat_task_scheduler.stats()
+
+
+@router.get("/sql_cache")
+async def sql_cache_status(current_user: CurrentUser, trans: Trans):
+    check_admin(current_user, trans)
+    return get_sql_cache_stats()
+
+
+@router.get("/sql_result_cache")
+async def sql_result_cache_status(current_user: CurrentUser, trans: Trans):
+    check_admin(current_user, trans)
+    return get_result_cache_stats()
+
+
+@router.get("/ds_pool")
+async def ds_pool_status(current_user: CurrentUser, trans: Trans):
+    check_admin(current_user, trans)
+    return {"engines": engine_registry.stats(), "native": connection_pool_registry.stats()}
@@ -202,6 +202,15 @@ class AssistantOutDsFactory:
 
 
 def get_ds_engine(ds: AssistantOutDsSchema) -> Engine:
+    from apps.db.pool import engine_registry, config_hash
+    return engine_registry.get(f'assistant:{ds.id}',
+                               config_hash(ds.type, ds.host, ds.port, ds.user, ds.password, ds.dataBase, ds.db_schema),
+                               lambda: create_assistant_ds_engine(ds))
+
+
+def create_assistant_ds_engine(ds: AssistantOutDsSchema) -> Engine:
+    from apps.db.pool import engine_pool_kwargs
+    pool_kwargs = engine_pool_kwargs()
     timeout: int = 30
     connect_args = {"connect_timeout": timeout}
     conf = DatasourceConf(
@@ -225,12 +234,19 @@ def get_ds_engine(ds: AssistantOutDsSchema) -> Engine:
         engine = create_engine(uri,
                                connect_args={"options": f"-c search_path={urllib.parse.quote(ds.db_schema)}",
                                              "connect_timeout": timeout},
-                               pool_timeout=timeout)
+                               pool_timeout=timeout, **pool_kwargs)
     elif ds.type == 'sqlServer':
-        engine = create_engine(uri, pool_timeout=timeout)
+        engine = create_engine(uri, pool_timeout=timeout, **pool_kwargs)
     elif ds.type == 'oracle':
         engine = create_engine(uri,
-                               pool_timeout=timeout)
+                               pool_timeout=timeout, **pool_kwargs)
+    elif ds.type == 'ck':
+        from apps.db.cost_guard import get_statement_timeout
+        statement_timeout = get_statement_timeout(None)
+        if statement_timeout > 0:
+            # 作为 HTTP 请求参数传给 ClickHouse，不改写 SQL 文本
+            connect_args["ch_settings"] = {"max_execution_time": statement_timeout}
+        engine = create_engine(uri, connect_args=connect_args, pool_timeout=timeout, **pool_kwargs)
     else:
-        engine = create_engine(uri, connect_args={"connect_timeout": timeout}, pool_timeout=timeout)
+        engine = create_engine(uri, connect_args={"connect_timeout": timeout}, pool_timeout=timeout, **pool_kwargs)
     return engine
@@ -10,6 +10,7 @@ from sqlalchemy.orm import aliased
 from sqlalchemy.orm.session import Session
 
 from apps.ai_model.embedding import EmbeddingModelCache
+from apps.chat.task.sql_cache import invalidate_workspace
 from apps.datasource.models.datasource import CoreDatasource
 from apps.template.generate_chart.generator import get_base_terminology_template
 from apps.terminology.models.terminology_model import Terminology, TerminologyInfo
@@ -298,6 +299,7 @@ def create_terminology(session: SessionDep, info: TerminologyInfo, oid: int, tra
 
     # embedding
     run_save_terminology_embeddings([result.id])
+    invalidate_workspace(oid)
 
     return result.id
 
@@ -391,14 +393,18 @@ def update_terminology(session: SessionDep, info: TerminologyInfo, oid: int, tra
 
     # embedding
     run_save_terminology_embeddings([info.id])
+    invalidate_workspace(oid)
 
     return info.id
 
 
 def delete_terminology(session: SessionDep, ids: list[int]):
+    oids = session.query(Terminology.oid).filter(Terminology.id.in_(ids)).distinct().all()
     stmt = delete(Terminology).where(or_(Terminology.id.in_(ids), Terminology.pid.in_(ids)))
     session.execute(stmt)
     session.commit()
+    for (oid,) in oids:
+        invalidate_workspace(oid)
 
 
 # def run_save_embeddings(ids: List[int]):
@@ -105,8 +105,88 @@ class Settings(BaseSettings):
     PG_POOL_RECYCLE: int = 3600
     PG_POOL_PRE_PING: bool = True
 
+    # 数据源连接池：每个数据源 Engine 的连接池大小，空闲多久后释放 Engine，最多保留多少个 Engine
+    DS_POOL_SIZE: int = 5
+    DS_MAX_OVERFLOW: int = 10
+    DS_POOL_RECYCLE: int = 3600
+    DS_POOL_IDLE_TIMEOUT: int = 600
+    DS_MAX_ENGINES: int = 200
+    # 原生驱动（dm、doris、redshift、kingbase）连接池：每个数据源最大连接数、借出前健康检查的空闲间隔、等待连接超时
+    DS_NATIVE_POOL_SIZE: int = 10
+    DS_NATIVE_POOL_CHECK_INTERVAL: int = 30
+    DS_NATIVE_POOL_TIMEOUT: int = 30
+
+    # 对话任务调度：全局/每个工作空间/每个用户的并发上限，以及排队上限，超出后返回 429
+    CHAT_TASK_MAX_RUNNING: int = 200
+    CHAT_TASK_MAX_PER_OID: int = 50
+    CHAT_TASK_MAX_PER_USER: int = 5
+    CHAT_TASK_MAX_QUEUE: int = 500
+    CHAT_TASK_RETRY_AFTER: int = 5
+    # 对话上下文准备（术语/数据训练/连接检查等）并发线程数
+    CHAT_CONTEXT_MAX_WORKERS: int = 50
+    # LLM 流式输出合并：连续的同类分片缓冲到该毫秒数或字符数后作为一个 SSE 帧输出，0 为不合并
+    SSE_COALESCE_INTERVAL_MS: int = 50
+    SSE_COALESCE_MAX_CHARS: int = 1024
+    # 构建对话历史时读取的最近生成 SQL / 图表日志条数
+    CHAT_HISTORY_LOG_LIMIT: int = 1
+    # 对话历史摘要：只原样回放最近几轮，更早的轮次压缩为 问题/表/SQL 列表放入系统提示词
+    CHAT_HISTORY_MEMORY_ENABLED: bool = False
+    CHAT_HISTORY_MEMORY_TURNS: int = 10
+    CHAT_HISTORY_RECENT_TURNS: int = 1
+    # chat_log.messages 中不少于该字符数的消息内容按 sha256 去重存入 chat_log_prompt，0 表示不外置
+    CHAT_LOG_PROMPT_THRESHOLD: int = 1024
+
+    # 问题 -> SQL 缓存：相同问题直接复用已执行成功的 SQL 和图表配置，跳过 LLM
+    SQL_CACHE_ENABLED: bool = True
+    SQL_CACHE_EXPIRE: int = 24 * 3600
+    # 相似问题匹配的余弦相似度阈值，1 表示只做精确匹配（默认）；相似匹配还要求问题中的数字、日期、引号内的值完全一致
+    SQL_CACHE_SIMILARITY: float = 1
+    SQL_CACHE_INDEX_SIZE: int = 200
+    SQL_CACHE_MAX_MEMORY_MB: int = 64
+
+    # 对话中查询结果的展示行数上限，执行前按数据源方言自动为 SQL 加上 LIMIT / TOP / FETCH FIRST
+    SQL_QUERY_ROW_LIMIT: int = 1000
+
+    # 单条查询超时秒数（数据源配置 queryTimeout 可覆盖，0 为不限制）
+    SQL_STATEMENT_TIMEOUT: int = 300
+    # 执行前 EXPLAIN 检查：估算行数/代价上限（数据源配置 maxEstimatedRows / maxEstimatedCost 可覆盖，0 为不检查）
+    SQL_EXPLAIN_MAX_ROWS: int = 0
+    SQL_EXPLAIN_MAX_COST: float = 0
+
+    # SQL 执行结果读取上限：超过行数或估算字节数时停止读取并标记 truncated
+    SQL_RESULT_MAX_ROWS: int = 10000
+    SQL_RESULT_MAX_BYTES: int = 64 * 1024 * 1024
+    SQL_RESULT_FETCH_BATCH: int = 500
+
+    # SQL 执行结果缓存：按数据源开启（数据源配置 cacheTtl 大于 0 时缓存对应秒数），超过行数上限的结果不缓存
+    SQL_RESULT_CACHE_ENABLED: bool = True
+    # 未配置 cacheTtl 的数据源的过期秒数，默认 0 不缓存（外部数据库的写入无法感知，缓存结果可能过期）
+    SQL_RESULT_CACHE_TTL: int = 0
+    SQL_RESULT_CACHE_MAX_ROWS: int = 10000
+    SQL_RESULT_CACHE_MAX_MEMORY_MB: int = 256
+
+    # 对话记录中超过该字节数的查询结果（data / predict_data）压缩后单独存放到 chat_record_blob 表，0 为不拆分
+    CHAT_RECORD_BLOB_THRESHOLD: int = 64 * 1024
+    # 每天清理不再被引用的 chat_record_blob / chat_log_prompt 外置内容，只清理写入超过该小时数的行，0 为不清理
+    CHAT_STORAGE_GC_GRACE_HOURS: int = 24
+
     TABLE_EMBEDDING_ENABLED: bool = False
     TABLE_EMBEDDING_COUNT: int = 10
+    # 生成 SQL 时 schema 的 token 预算，按问题相关度裁剪表和字段（模型参数 schema_token_budget 可覆盖，0 为不裁剪）
+    SCHEMA_TOKEN_BUDGET: int = 0
+    # 数据源 schema 缓存：按 数据源 + 元数据版本号 + 列权限指纹 缓存各表的 M-Schema，同步/修改表和字段时失效
+    SCHEMA_CACHE_ENABLED: bool = True
+    SCHEMA_CACHE_EXPIRE: int = 24 * 3600
+    # CACHE_TYPE 为 memory 时的缓存秒数：元数据变更只在发生变更的进程内失效，其他进程（mcp_app）最多延迟这么久，
+    # 需要跨进程立即失效时使用 redis
+    SCHEMA_CACHE_MEMORY_EXPIRE: int = 30
+    SCHEMA_CACHE_MAX_MEMORY_MB: int = 32
+    # 权限索引（用户 -> 表 -> 行/列权限）缓存秒数，规则组或权限变更后立即失效
+    PERMISSION_INDEX_EXPIRE: int = 3600
+    # CACHE_TYPE 为 memory 时的缓存秒数：失效只在发生变更的进程内生效，其他进程（mcp_app）最多延迟这么久，
+    # 需要跨进程立即失效时使用 redis
+    PERMISSION_INDEX_MEMORY_EXPIRE: int = 5
+    PERMISSION_INDEX_MAX_MEMORY_MB: int = 16
 
     API_FETCH_JOBS: str | None = None
 
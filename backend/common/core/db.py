@@ -14,5 +14,16 @@ def get_session():
         yield session
 
 
+def get_pool_status() -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": settings.PG_MAX_OVERFLOW,
+    }
+
+
 def init_db():
     SQLModel.metadata.create_all(engine)
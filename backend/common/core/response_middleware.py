@@ -100,7 +100,7 @@ class exception_handler():
         return JSONResponse(
             status_code=exc.status_code,
             content=exc.detail,
-            headers={"Access-Control-Allow-Origin": "*"}
+            headers={**(exc.headers or {}), "Access-Control-Allow-Origin": "*"}
         )
 
     @staticmethod
@@ -1,3 +1,8 @@
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
 from fastapi_cache import FastAPICache
 from functools import partial, wraps
 from typing import Optional, Any, Dict, Tuple
@@ -155,4 +160,155 @@ def is_cache_initialized() -> bool:
         return backend is not None
     except (AssertionError, AttributeError, Exception) as e:
         SQLBotLogUtil.debug(f"缓存初始化检查失败: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+class _MemoryStore:
+    """进程内 LRU 存储，按字节数计量并淘汰，条目可带过期时间"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._data: OrderedDict[str, Tuple[bytes, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expire_at = item
+            if expire_at is not None and expire_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, expire: Optional[int] = None):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, time.monotonic() + expire if expire else None)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes and self._data:
+                self._remove(next(iter(self._data)))
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.used_bytes -= len(item[0])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "used_bytes": self.used_bytes, "max_bytes": self.max_bytes}
+
+
+_sync_redis_client = None
+_sync_redis_lock = threading.Lock()
+
+
+def _get_sync_redis():
+    global _sync_redis_client
+    if _sync_redis_client is None:
+        with _sync_redis_lock:
+            if _sync_redis_client is None:
+                import redis
+                _sync_redis_client = redis.Redis.from_url(settings.CACHE_REDIS_URL or "redis://localhost:6379/0")
+    return _sync_redis_client
+
+
+class SyncCache:
+    """
+    供线程池中的同步代码（对话任务等）使用的缓存，与 CACHE_TYPE 保持一致：
+    redis 时多进程共享，memory 时为进程内按字节限额的 LRU，None 时不缓存
+    """
+
+    def __init__(self, namespace: str, max_memory_bytes: int = 64 * 1024 * 1024):
+        self.namespace = namespace
+        self.cache_type = (settings.CACHE_TYPE or "None").lower()
+        self._memory = _MemoryStore(max_memory_bytes) if self.cache_type == "memory" else None
+        self._versions: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache_type in ("memory", "redis")
+
+    def _key(self, key: str) -> str:
+        return f"sqlbot-cache:{self.namespace}:{key}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            if self.cache_type == "memory":
+                return self._memory.get(key)
+            if self.cache_type == "redis":
+                return _get_sync_redis().get(self._key(key))
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Cache get {self.namespace}:{key} failed: {e}")
+        return None
+
+    def set(self, key: str, value: bytes, expire: Optional[int] = None):
+        try:
+            if self.cache_type == "memory":
+                self._memory.set(key, value, expire)
+            elif self.cache_type == "redis":
+                _get_sync_redis().set(self._key(key), value, ex=expire or None)
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Cache set {self.namespace}:{key} failed: {e}")
+
+    def delete(self, key: str):
+        try:
+            if self.cache_type == "memory":
+                self._memory.delete(key)
+            elif self.cache_type == "redis":
+                _get_sync_redis().delete(self._key(key))
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Cache delete {self.namespace}:{key} failed: {e}")
+
+    def get_json(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            return None
+        try:
+            return orjson.loads(value)
+        except Exception:
+            return None
+
+    def set_json(self, key: str, value: Any, expire: Optional[int] = None):
+        self.set(key, orjson.dumps(value), expire)
+
+    def get_version(self, key: str) -> int:
+        if self.cache_type == "memory":
+            return self._versions.get(key, 0)
+        value = self.get(f"version:{key}")
+        return int(value) if value else 0
+
+    def bump_version(self, key: str) -> None:
+        """递增版本号，使依赖该版本号拼接缓存键的条目全部失效"""
+        try:
+            if self.cache_type == "memory":
+                # 版本号不放进 LRU，避免被淘汰后回退到旧版本号而命中旧条目
+                with self._memory._lock:
+                    self._versions[key] = self._versions.get(key, 0) + 1
+            elif self.cache_type == "redis":
+                _get_sync_redis().incr(self._key(f"version:{key}"))
+        except Exception as e:
+            SQLBotLogUtil.warning(f"Cache bump version {self.namespace}:{key} failed: {e}")
+
+    def shared_expire(self, expire: int, memory_expire: int) -> int:
+        """
+        memory 时版本号只在本进程递增，其他进程（如 start.sh 单独启动的 mcp_app）感知不到失效，
+        依赖版本号失效的缓存改用较短的过期时间；需要跨进程立即失效时使用 redis
+        """
+        if self.cache_type == "memory":
+            return min(expire, memory_expire) if expire else memory_expire
+        return expire
+
+    def stats(self) -> dict:
+        if self._memory is not None:
+            return {"type": self.cache_type, **self._memory.stats()}
+        return {"type": self.cache_type}
@@ -15,5 +15,16 @@ class SQLBotDBError(Exception):
     pass
 
 
+class SQLCostExceededError(SQLBotDBError):
+    """EXPLAIN 估算的行数或代价超过数据源阈值"""
+    pass
+
+
 class ParseSQLResultError(Exception):
     pass
+
+
+class ChatTaskRejectedError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f'Too many chat tasks, retry after {retry_after} seconds')
+        self.retry_after = retry_after
@@ -232,6 +232,23 @@ export class ChatInfo extends Chat {
   }
 }
 
+// 查询结果以列式结构 { fields, rows } 传输，这里还原为 { fields, data: [行对象] }
+const fromColumnarData = (res: any) => {
+  if (!res || !Array.isArray(res.rows)) {
+    return res
+  }
+  const { rows, ...rest } = res
+  const fields: Array<string> = rest.fields ?? []
+  rest.data = rows.map((row: Array<any>) => {
+    const item: { [key: string]: any } = {}
+    fields.forEach((field, index) => {
+      item[field] = row[index]
+    })
+    return item
+  })
+  return rest
+}
+
 const toChatRecord = (data?: any): ChatRecord | undefined => {
   if (!data) {
     return undefined
@@ -312,7 +329,9 @@ export const chatApi = {
     return request.get(`/chat/get/with_data/${id}`)
   },
   get_chart_data: (record_id?: number): Promise<any> => {
-    return request.get(`/chat/record/get/${record_id}/data`)
+    return request
+      .get(`/chat/record/get/${record_id}/data`, { params: { columnar: true } })
+      .then(fromColumnarData)
   },
   get_chart_predict_data: (record_id?: number): Promise<any> => {
     return request.get(`/chat/record/get/${record_id}/predict_data`)